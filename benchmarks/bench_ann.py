@@ -0,0 +1,72 @@
+"""
+Recall and queries per second of IVFIndex against exact search with EdgeIndex, on synthetic clustered embeddings.
+Usage: python benchmarks/bench_ann.py [sizes ...] [--dimension 64] [--queries 200] [--k 10] [--nprobe 1 4 8 16 32] [--spread 1.0]
+       python benchmarks/bench_ann.py 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lifelike.StateManager.ann import IVFIndex
+from lifelike.StateManager.retriever import EdgeIndex
+
+
+def synthetic(size: int, queries: int, dimension: int, spread: float, seed: int=0) -> tuple:
+    """
+    Embeddings and queries from the same gaussian mixture, one component per 100 embeddings.
+    Closer to text embeddings than uniform noise, where every neighbour is about as far. A larger spread blurs the components.
+    """
+    rng = numpy.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, size // 100), dimension)).astype(numpy.float32)
+    def sample(count: int) -> numpy.ndarray:
+        return centers[rng.integers(0, centers.shape[0], count)] + spread * rng.standard_normal((count, dimension)).astype(numpy.float32)
+    return (sample(size), sample(queries))
+
+
+def measure(size: int, dimension: int, queries: int, k: int, nprobes: list, spread: float) -> dict:
+    (embeddings, query_embeddings) = synthetic(size, queries, dimension, spread)
+    keys = [("_", str(i)) for i in range(size)]
+
+    exact = EdgeIndex(size)
+    exact.matrix = embeddings
+    exact.norms = numpy.linalg.norm(embeddings, axis=1)
+    exact.keys = keys
+    exact.rows = {key: row for (row, key) in enumerate(keys)}
+    start = time.perf_counter()
+    truth = [set(key for (key, _) in exact.search(query, k)) for query in query_embeddings]
+    exact_qps = queries / (time.perf_counter() - start)
+
+    index = IVFIndex()
+    start = time.perf_counter()
+    index.build(keys, embeddings)
+    build = time.perf_counter() - start
+
+    runs = []
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        found = [index.search(query, k, nprobe) for query in query_embeddings] # One query at a time, like a retriever
+        seconds = time.perf_counter() - start
+        recall = numpy.mean([len(truth[i] & set(key for (key, _) in results)) / k for (i, results) in enumerate(found)])
+        runs.append({"nprobe": nprobe, "recall": round(float(recall), 4), "qps": round(queries / seconds, 1)})
+
+    return {"size": size, "dimension": dimension, "spread": spread, "k": k, "nlist": index.nlist, "build_seconds": round(build, 2),
+            "exact_qps": round(exact_qps, 1), "runs": runs}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sizes", type=int, nargs="*", default=[10000, 100000])
+    parser.add_argument("--dimension", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--spread", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(json.dumps([measure(size, args.dimension, args.queries, args.k, args.nprobe, args.spread) for size in args.sizes], indent=2))
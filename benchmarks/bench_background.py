@@ -0,0 +1,122 @@
+"""
+Prompt tokens per turn with whole character backgrounds, and with BackgroundMemory putting only the top k chunks in the prompt.
+Characters have multi-page backgrounds made of topical paragraphs. The embedder hashes the set of words of a text into a vector, so chunks that share
+words with the conversation score higher. Tokens are counted with tiktoken when it is installed, otherwise words and punctuation are counted.
+Usage: python benchmarks/bench_background.py [--turns 50] [--paragraphs 40] [--k 3] [--chunk-chars 500]
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+from typing import Any, List, Optional
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from langchain.llms.base import LLM
+
+from lifelike.background import BackgroundMemory
+from lifelike.brain import Characters, Conversations
+
+TOPICS = ["harbor", "violin", "orchard", "railway", "lighthouse", "library", "vineyard", "foundry", "observatory", "bakery"]
+
+
+try:
+    import tiktoken
+    ENCODING = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    ENCODING = None
+
+
+def count_tokens(text: str) -> int:
+    if ENCODING is not None:
+        return len(ENCODING.encode(text))
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+class HashedBagOfWords:
+    """Set of words hashed into a fixed number of dimensions"""
+    def __init__(self, dimension: int = 256) -> None:
+        self.dimension = dimension
+        self.calls = 0
+
+    def _embed(self, text: str) -> list:
+        vector = numpy.zeros(self.dimension, dtype=numpy.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode()).hexdigest()[:8], 16) % self.dimension] = 1
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        return self._embed(text)
+
+
+class PromptRecorder(LLM):
+    """Fake llm that records the prompts it is given and talks about a topic"""
+    prompts: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "prompt-recorder"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        self.prompts.append(prompt)
+        return f" Tell me more about the {TOPICS[len(self.prompts) % len(TOPICS)]}."
+
+
+def background(name: str, paragraphs: int, rng: random.Random) -> str:
+    filler = "she remembers details of that time with unusual clarity and often returns to them in conversation".split()
+    return "\n\n".join(f"{name} and the {TOPICS[i % len(TOPICS)]}: " + " ".join(rng.choice(filler) for _ in range(50)) + "."
+                       for i in range(paragraphs))
+
+
+def run(turns: int, paragraphs: int, memory: Optional[BackgroundMemory]) -> dict:
+    tmp = tempfile.mkdtemp()
+    rng = random.Random(0)
+    characters = Characters(os.path.join(tmp, "characters.json"), memory=memory)
+    for name in ("Alice", "Bob"):
+        characters.add(name, background(name, paragraphs, rng))
+    llm = PromptRecorder(prompts=[])
+    convos = Conversations(os.path.join(tmp, "conversations.json"), characters, llm)
+    convos.new("room", {"Alice", "Bob"})
+    random.seed(0)
+    for _ in range(turns):
+        convos.generate("room", "", set())
+    tokens = [count_tokens(prompt) for prompt in llm.prompts]
+    # Share of the background paragraphs in the prompt that are about a topic of the conversation window
+    precision = []
+    for prompt in llm.prompts[1:]:
+        (background_part, log_part) = prompt.split("Background:")[1].split("Relevant pieces of information:")
+        window = set(re.findall(r"about the (\w+)", log_part))
+        shown = re.findall(r"and the (\w+):", background_part)
+        precision.append(sum(topic in window for topic in shown) / len(shown))
+    return {"mean_prompt_tokens": round(sum(tokens) / len(tokens), 1), "max_prompt_tokens": max(tokens),
+            "background_precision": round(sum(precision) / len(precision), 3)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--paragraphs", type=int, default=40)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--chunk-chars", type=int, default=500)
+    args = parser.parse_args()
+
+    embeddings = HashedBagOfWords()
+    before = run(args.turns, args.paragraphs, None)
+    after = run(args.turns, args.paragraphs, BackgroundMemory(embeddings, args.k, args.chunk_chars))
+    print(json.dumps({
+        "turns": args.turns, "background_tokens": count_tokens(background("Alice", args.paragraphs, random.Random(0))),
+        "tokenizer": "words" if ENCODING is None else "tiktoken",
+        "whole_background": before, "background_memory": after,
+        "token_reduction": round(1 - after["mean_prompt_tokens"] / before["mean_prompt_tokens"], 3), "embed_calls": embeddings.calls,
+    }, indent=2))
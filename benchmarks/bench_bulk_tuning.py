@@ -0,0 +1,109 @@
+"""
+Retuning a tree from playtest logs: tune_edge() per edge, tune_edges() in bulk, and one thread per player session with CoalescingEmbeddings.
+The embedder hashes texts to vectors and sleeps a fixed latency per call, like a remote embedding API.
+Exits with status 1 if bulk or coalesced tuning does not give the same embeddings as sequential tuning.
+Usage: python benchmarks/bench_bulk_tuning.py [--edges 2000] [--prompts 3] [--dimension 256] [--latency 0.002] [--players 8]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lifelike.StateManager.base_game_tree import BaseGameTree, EdgeEmbedding, GameNode
+from lifelike.StateManager.embeddings import CoalescingEmbeddings
+
+
+class RemoteEmbeddings:
+    """Deterministic vectors seeded by a hash of each text, with a fixed latency per call"""
+    def __init__(self, dimension: int, latency: float) -> None:
+        self.dimension = dimension
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: list) -> list:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return [numpy.random.default_rng(int(hashlib.sha256(text.encode()).hexdigest()[:16], 16)).standard_normal(self.dimension).tolist()
+                for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+def build(embed, edges: int, dimension: int) -> BaseGameTree:
+    tree = BaseGameTree("bench-bulk-tuning", embed)
+    template = EdgeEmbedding("template", embed, numpy.ones(dimension), 5)
+    tree.add_embedding_template(template)
+    tree.add_node(GameNode("start", "start", {}))
+    for i in range(edges):
+        tree.add_node(GameNode(str(i), str(i), {}))
+        tree.add_edge("start", str(i), str(i), template)
+    return tree
+
+
+def logs(edges: int, prompts: int) -> dict:
+    """Playtest prompts per edge, with some repeated between edges"""
+    return {("start", str(i)): ["player said {} about {}".format(j, i % 50) for j in range(prompts)] for i in range(edges)}
+
+
+def embeddings(edge_dict: dict) -> dict:
+    return {edge_id: edge_dict[edge_id].get_embedding() for edge_id in edge_dict}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--edges", type=int, default=2000)
+    parser.add_argument("--prompts", type=int, default=3)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.002)
+    parser.add_argument("--players", type=int, default=8)
+    args = parser.parse_args()
+    edge_prompts = logs(args.edges, args.prompts)
+    results = {}
+
+    embed = RemoteEmbeddings(args.dimension, args.latency)
+    sequential = build(embed, args.edges, args.dimension)
+    start = time.perf_counter()
+    for (edge_id, prompts) in edge_prompts.items():
+        sequential.tune_edge(edge_id, prompts)
+    results["tune_edge"] = {"seconds": round(time.perf_counter() - start, 3), "embed_calls": embed.calls}
+    expected = embeddings(sequential.edge_dict)
+
+    embed = RemoteEmbeddings(args.dimension, args.latency)
+    bulk = build(embed, args.edges, args.dimension)
+    start = time.perf_counter()
+    bulk.tune_edges(edge_prompts)
+    results["tune_edges"] = {"seconds": round(time.perf_counter() - start, 3), "embed_calls": embed.calls}
+    same = all(numpy.array_equal(expected[edge_id], embedding) for (edge_id, embedding) in embeddings(bulk.edge_dict).items())
+
+    # Every player session retunes its share of the edges with tune_edge(), concurrently
+    embed = RemoteEmbeddings(args.dimension, args.latency)
+    coalescing = CoalescingEmbeddings(embed)
+    tree = build(coalescing, args.edges, args.dimension).freeze()
+    sessions = [tree.new_session(str(player)) for player in range(args.players)]
+    def play(player: int) -> None:
+        for (i, (edge_id, prompts)) in enumerate(edge_prompts.items()):
+            if i % args.players == player:
+                sessions[player].tune_edge(edge_id, prompts)
+    threads = [threading.Thread(target=play, args=(player,)) for player in range(args.players)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results["coalesced_sessions"] = {"seconds": round(time.perf_counter() - start, 3), "embed_calls": embed.calls, "requests": coalescing.requests}
+    for session in sessions:
+        same = same and all(numpy.array_equal(expected[edge_id], edge.get_embedding()) for (edge_id, edge) in session.edge_dict.items())
+
+    results["identical"] = same
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if same else 1)
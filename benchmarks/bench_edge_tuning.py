@@ -0,0 +1,70 @@
+"""
+Tuning many edges, before (python float lists and numpy.average) and after (float32 ndarrays with incremental mean).
+The embedder returns precomputed vectors so only the tuning itself is measured.
+Usage: python benchmarks/bench_edge_tuning.py [edges] [dimension] [prompts per tune]
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lifelike.StateManager.base_game_tree import EdgeEmbedding
+
+
+class PrecomputedEmbeddings:
+    """Returns the same batch of vectors for every call"""
+    def __init__(self, vectors: list) -> None:
+        self.vectors = vectors
+
+    def embed_documents(self, texts: list) -> list:
+        return self.vectors[:len(texts)]
+
+
+class LegacyEdgeEmbedding:
+    """EdgeEmbedding tuning as it was implemented with python lists"""
+    def __init__(self, embed, embedding: list, weight: int) -> None:
+        self.embed = embed
+        self.embedding = embedding
+        self.weight = weight
+
+    def tune_prompts(self, prompts: list) -> list:
+        new_embeddings = self.embed.embed_documents(prompts)
+        self.embedding = numpy.average([self.embedding] + new_embeddings, 0, [self.weight]+[1]*len(prompts)).tolist()
+        self.weight += len(prompts)
+        return self.embedding
+
+
+def measure(build, edges: int, prompts: list) -> dict:
+    tracemalloc.start()
+    objects = [build(i) for i in range(edges)]
+    storage = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for edge in objects:
+        edge.tune_prompts(prompts)
+    return {"tune_s": time.perf_counter() - start, "storage_mb": storage / 2**20}
+
+
+def run(edges: int, dimension: int, prompt_count: int) -> dict:
+    rng = numpy.random.default_rng(0)
+    initial = rng.standard_normal(dimension).tolist()
+    vectors = rng.standard_normal((prompt_count, dimension)).tolist()
+    embed = PrecomputedEmbeddings(vectors)
+    prompts = ["prompt"] * prompt_count
+
+    before = measure(lambda i: LegacyEdgeEmbedding(embed, list(initial), 20), edges, prompts)
+    after = measure(lambda i: EdgeEmbedding(str(i), embed, initial, 20), edges, prompts)
+    return {"edges": edges, "dimension": dimension, "prompts": prompt_count, "before": before, "after": after}
+
+
+if __name__ == "__main__":
+    edges = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    dimension = int(sys.argv[2]) if len(sys.argv) > 2 else 768
+    prompt_count = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    print(json.dumps(run(edges, dimension, prompt_count)))
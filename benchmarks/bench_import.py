@@ -0,0 +1,62 @@
+"""
+Import time of the lifelike modules, measured with python -X importtime in a fresh interpreter per module.
+Exits with status 1 if a module takes longer than the budget to import or loads langchain or chromadb, so it can be used as a regression check.
+Usage: python benchmarks/bench_import.py [--budget 1.0] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Imports that must stay light: characters, json and binary tree conversion, nodes and sessions
+TARGETS = [
+    "from lifelike.brain import Characters, Conversations",
+    "from lifelike.StateManager.base_game_tree import BaseGameTree, GameNode, convert_json_to_binary",
+    "from lifelike.StateManager.sequence_tree import SequenceTree",
+    "from lifelike.StateManager.knowledge_tree import KnowledgeTree",
+    "from lifelike.StateManager.session import GameSession",
+    "from lifelike.StateManager.compact import CompactEdgeDict",
+    "from lifelike.StateManager.ann import IVFIndex",
+]
+HEAVY = ("langchain", "chromadb")
+
+
+def measure(statement: str) -> dict:
+    """Total import time of the statement and the heaviest top-level packages it loads"""
+    check = "import sys; {}; print(','.join(sorted(name for name in sys.modules if name.split('.')[0] in {})))".format(statement, HEAVY)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", check], cwd=ROOT, capture_output=True, text=True, check=True)
+
+    total = 0
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        (_, self_us, cumulative_us, name) = [part.strip() for part in line.replace("import time:", "|").split("|")]
+        total += int(self_us)
+        if not name.startswith(" "):
+            packages[name.strip()] = int(cumulative_us)
+    heaviest = sorted(packages.items(), key=lambda item: -item[1])[:3]
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    return {"seconds": total / 1e6, "heaviest": {name: round(us / 1e6, 3) for (name, us) in heaviest}, "heavy_modules": loaded}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = []
+    failed = False
+    for statement in TARGETS:
+        runs = [measure(statement) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run["seconds"]) # Least disturbed by the rest of the machine
+        ok = best["seconds"] <= args.budget and not best["heavy_modules"]
+        failed = failed or not ok
+        results.append(dict(best, statement=statement, seconds=round(best["seconds"], 3), budget=args.budget, ok=ok))
+
+    print(json.dumps(results, indent=2))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,74 @@
+"""
+Overhead of the metrics module on generate, with no hook, with Histograms and with a PrometheusFile, using an llm that answers instantly.
+Prints the p50/p99 of each stage recorded by Histograms and the Prometheus file written at the end.
+Usage: python benchmarks/bench_metrics.py [--turns 2000] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fakes import FakeLLM
+from lifelike import metrics
+from lifelike.brain import Characters, Conversations
+
+
+def run(turns: int) -> float:
+    tmp = tempfile.mkdtemp()
+    characters = Characters(os.path.join(tmp, "characters.json"))
+    for name in ("Alice", "Bob"):
+        characters.add(name, f"{name} lives in the village.")
+    convos = Conversations(os.path.join(tmp, "conversations.json"), characters, FakeLLM())
+    convos.new("square", {"Alice", "Bob"})
+    random.seed(0)
+    start = time.perf_counter()
+    for _ in range(turns):
+        convos.generate("square", "", set())
+    return (time.perf_counter() - start) / turns
+
+
+def best(turns: int, repeat: int) -> float:
+    return min(run(turns) for _ in range(repeat))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    disabled = best(args.turns, args.repeat)
+
+    histograms = metrics.Histograms()
+    metrics.add_hook(histograms)
+    metrics.set_token_counter(lambda text: len(text.split()))
+    with_histograms = best(args.turns, args.repeat)
+
+    path = os.path.join(tempfile.mkdtemp(), "lifelike.prom")
+    prometheus = metrics.PrometheusFile(path, interval=None)
+    metrics.add_hook(prometheus)
+    with_both = best(args.turns, args.repeat)
+    prometheus.write()
+    metrics.remove_hook(histograms)
+    metrics.remove_hook(prometheus)
+    metrics.set_token_counter(None)
+
+    summary = histograms.summary()
+    stages = {name: {"p50_us": round(stats["p50"] * 1e6, 1), "p99_us": round(stats["p99"] * 1e6, 1)}
+              for name, stats in summary.items() if name.startswith("conversations.") and "p50" in stats and "_" not in name.split(".")[1]}
+    with open(path, encoding="utf-8") as f:
+        exported = f.read()
+    print(json.dumps({
+        "turns": args.turns,
+        "generate_us": {"disabled": round(disabled * 1e6, 1), "histograms": round(with_histograms * 1e6, 1), "histograms_and_prometheus": round(with_both * 1e6, 1)},
+        "overhead": {"histograms": round(with_histograms / disabled - 1, 3), "histograms_and_prometheus": round(with_both / disabled - 1, 3)},
+        "stages": stages,
+        "prompt_chars_p50": summary["conversations.llm_prompt_chars"]["p50"],
+        "prometheus_lines": len(exported.splitlines()),
+    }, indent=2))
+    print(exported)
@@ -0,0 +1,112 @@
+"""
+Quantized embedding storage: memory, disk, and top-k agreement of quantized search with full precision search.
+Exits with status 1 if the agreement of a dtype is below its threshold, so it can be used as a check.
+Usage: python benchmarks/bench_quantized.py [--size 20000] [--dimension 384] [--queries 200] [--k 10]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lifelike.StateManager.base_game_tree import BaseGameTree, EdgeEmbedding, GameNode
+from lifelike.StateManager.retriever import EdgeIndex
+
+# Minimum mean overlap of the top k with full precision search, with re-scoring
+THRESHOLDS = {"float16": 0.99, "int8": 0.97}
+
+
+class PrecomputedEmbeddings:
+    """Returns the same batch of vectors for every call"""
+    def __init__(self, vectors: numpy.ndarray) -> None:
+        self.vectors = vectors
+
+    def embed_documents(self, texts: list) -> list:
+        return self.vectors[:len(texts)]
+
+
+def synthetic(size: int, queries: int, dimension: int, seed: int=0) -> tuple:
+    """Embeddings and queries from the same gaussian mixture, one component per 100 embeddings"""
+    rng = numpy.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, size // 100), dimension)).astype(numpy.float32)
+    def sample(count: int) -> numpy.ndarray:
+        return centers[rng.integers(0, centers.shape[0], count)] + rng.standard_normal((count, dimension)).astype(numpy.float32)
+    return (sample(size), sample(queries))
+
+
+def agreement(truth: list, found: list) -> float:
+    k = len(truth[0])
+    return float(numpy.mean([len(set(a) & set(b)) / k for (a, b) in zip(truth, found)]))
+
+
+def top_keys(index: EdgeIndex, queries: numpy.ndarray, k: int) -> list:
+    return [[key for (key, _) in results] for results in index.search(queries, k)]
+
+
+def tuning_drift(dimension: int, dtype: str, tunes: int=1000) -> float:
+    """Largest error of an edge tuned one prompt at a time in a quantized compact tree, against a float64 average"""
+    prompts = numpy.random.default_rng(2).standard_normal((tunes, 1, dimension)).astype(numpy.float32)
+    tree = BaseGameTree("bench-quantized-tune", PrecomputedEmbeddings(prompts[0]), compact=True, dtype=dtype)
+    tree.node_dict["a"] = GameNode("a", "a", {})
+    tree.edge_dict[("_", "a")] = EdgeEmbedding("a", tree.embed)
+    for vectors in prompts:
+        tree.embed.vectors = vectors
+        tree.tune_edge(("_", "a"), ["prompt"])
+    return float(numpy.abs(tree.edge_dict[("_", "a")].get_embedding() - prompts.astype(numpy.float64).mean(0)[0]).max())
+
+
+def disk(embeddings: numpy.ndarray, dtype: str) -> int:
+    """Size of the .npy (and .scales.npy) files of to_binary()"""
+    tree = BaseGameTree("bench-quantized-disk", PrecomputedEmbeddings(embeddings))
+    for (i, embedding) in enumerate(embeddings):
+        tree.node_dict[str(i)] = GameNode(str(i), "", {})
+        tree.edge_dict[("_", str(i))] = EdgeEmbedding(str(i), tree.embed, embedding, 1)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tree")
+        tree.to_binary(path, dtype)
+        return sum(os.path.getsize(path + suffix) for suffix in (".npy", ".scales.npy") if os.path.exists(path + suffix))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    (embeddings, queries) = synthetic(args.size, args.queries, args.dimension)
+    keys = [("_", str(i)) for i in range(args.size)]
+    full = {key: embedding for (key, embedding) in zip(keys, embeddings)}
+
+    exact = EdgeIndex(args.size)
+    for (key, embedding) in full.items():
+        exact.upsert(key, embedding)
+    truth = top_keys(exact, queries, args.k)
+
+    results = []
+    failed = False
+    for dtype in ("float32", "float16", "int8"):
+        index = EdgeIndex(args.size, dtype, full.get)
+        for (key, embedding) in full.items():
+            index.upsert(key, embedding)
+        rescored = agreement(truth, top_keys(index, queries, args.k))
+        index.lookup = None
+        raw = agreement(truth, top_keys(index, queries, args.k))
+
+        threshold = THRESHOLDS.get(dtype, 1.0)
+        failed = failed or rescored < threshold
+        results.append({
+            "dtype": dtype,
+            "index_mb": round((index.matrix.nbytes + (index.scales.nbytes if dtype == "int8" else 0)) / 2**20, 2),
+            "disk_mb": round(disk(embeddings, dtype) / 2**20, 2),
+            "agreement": round(rescored, 4), "agreement_without_rescoring": round(raw, 4), "threshold": threshold,
+            "tuning_drift": tuning_drift(args.dimension, dtype),
+        })
+
+    print(json.dumps(results, indent=2))
+    sys.exit(1 if failed else 0)
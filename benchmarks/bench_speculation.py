@@ -0,0 +1,66 @@
+"""
+Perceived latency of generate with and without a Speculator, in a room where NPCs talk and the player sometimes interjects.
+Lines are shown for a reading time before the next turn is asked for. Speculations started after each append get that time to finish.
+Usage: python benchmarks/bench_speculation.py [--turns 40] [--latency 0.2] [--reading 0.3] [--interjection 0.25] [--npcs 2] [--max-in-flight 4]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fakes import FakeLLM
+from lifelike.brain import Characters, Conversations
+from lifelike.speculation import Speculator
+
+
+def run(turns: int, latency: float, reading: float, interjection: float, npcs: int, speculator: Optional[Speculator]) -> dict:
+    tmp = tempfile.mkdtemp()
+    characters = Characters(os.path.join(tmp, "characters.json"))
+    names = [f"NPC {i}" for i in range(npcs)]
+    for name in names + ["Player"]:
+        characters.add(name, f"{name} lives in the village.")
+    llm = FakeLLM(latency=latency)
+    convos = Conversations(os.path.join(tmp, "conversations.json"), characters, llm, speculator=speculator)
+    convos.new("square", set(names) | {"Player"})
+    rng = random.Random(0)
+    random.seed(0)
+
+    waits = []
+    for turn in range(turns):
+        if rng.random() < interjection:
+            convos.append("square", "Player", f"What about the harvest {turn}?")
+        start = time.perf_counter()
+        convos.generate("square", "", {"Player"})
+        waits.append(time.perf_counter() - start)
+        time.sleep(reading)
+
+    waits.sort()
+    result = {"mean_wait_s": round(sum(waits) / len(waits), 3), "p95_wait_s": round(waits[int(0.95 * (len(waits) - 1))], 3), "llm_calls": llm.calls}
+    if speculator is not None:
+        speculator.wait()
+        result["speculation"] = speculator.stats()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--reading", type=float, default=0.3)
+    parser.add_argument("--interjection", type=float, default=0.25)
+    parser.add_argument("--npcs", type=int, default=2)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    args = parser.parse_args()
+
+    settings = (args.turns, args.latency, args.reading, args.interjection, args.npcs)
+    print(json.dumps({
+        "turns": args.turns, "latency_s": args.latency, "reading_s": args.reading, "interjection": args.interjection, "npcs": args.npcs,
+        "without": run(*settings, None),
+        "with": run(*settings, Speculator(args.max_in_flight)),
+    }, indent=2))
@@ -0,0 +1,83 @@
+"""
+Memory of a game tree's nodes and edges, default dict of EdgeEmbedding versus BaseGameTree(compact=True).
+Every node gets one wildcard edge with an embedding and one edge without embedding to the next node.
+Usage: python benchmarks/bench_tree_memory.py [nodes ...] [--dimension 32]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lifelike.StateManager.base_game_tree import BaseGameTree, EdgeEmbedding, GameNode
+
+
+class ZeroEmbeddings:
+    """Never called, only makes the tree editable"""
+    def embed_documents(self, texts: list) -> list:
+        return [[0.0] for _ in texts]
+
+
+def add_nodes(tree: BaseGameTree, nodes: int) -> list:
+    ids = ["node-{:08d}".format(i) for i in range(nodes)]
+    for (i, node_id) in enumerate(ids):
+        tree.node_dict[node_id] = GameNode(node_id, "context {}".format(i), {"index": i})
+    return ids
+
+
+def add_edges(tree: BaseGameTree, ids: list, vectors: numpy.ndarray) -> None:
+    """Same edges as add_texts() plus a chain between consecutive nodes, without going through the embedding function or Chroma"""
+    for (i, node_id) in enumerate(ids):
+        tree.edge_dict[('_', node_id)] = EdgeEmbedding(node_id, tree.embed, vectors[i].copy(), 1)
+        if i > 0:
+            tree.edge_dict[(ids[i - 1], node_id)] = EdgeEmbedding(node_id, tree.embed)
+
+
+def measure(nodes: int, dimension: int, compact: bool) -> dict:
+    """Memory is traced with tracemalloc, build and iteration times are measured on a second, untraced tree"""
+    vectors = numpy.random.default_rng(0).standard_normal((nodes, dimension)).astype(numpy.float32)
+
+    tree = BaseGameTree("bench-memory", ZeroEmbeddings(), compact=compact)
+    gc.collect()
+    tracemalloc.start()
+    ids = add_nodes(tree, nodes)
+    nodes_bytes = tracemalloc.get_traced_memory()[0]
+    add_edges(tree, ids, vectors)
+    total_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    edges = len(tree.edge_dict)
+    del tree
+    gc.collect()
+
+    tree = BaseGameTree("bench-memory", ZeroEmbeddings(), compact=compact)
+    ids = add_nodes(tree, nodes)
+    start = time.perf_counter()
+    add_edges(tree, ids, vectors)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    for (_, edge) in tree.edge_dict.items():
+        edge.weight
+    iterate = time.perf_counter() - start
+
+    return {
+        "nodes": nodes, "edges": edges, "dimension": dimension, "compact": compact,
+        "nodes_mb": round(nodes_bytes / 2**20, 1), "edges_mb": round((total_bytes - nodes_bytes) / 2**20, 1),
+        "peak_mb": round(peak_bytes / 2**20, 1), "bytes_per_edge": round((total_bytes - nodes_bytes) / edges, 1),
+        "build_edges_seconds": round(build, 3), "iterate_edges_seconds": round(iterate, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("nodes", type=int, nargs="*", default=[100000])
+    parser.add_argument("--dimension", type=int, default=32)
+    args = parser.parse_args()
+
+    results = [measure(nodes, args.dimension, compact) for nodes in args.nodes for compact in (False, True)]
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,57 @@
+"""
+Per turn cost of building the conversation window as the log grows.
+The legacy column re-joins the whole log every turn like generate used to.
+Usage: python benchmarks/bench_window.py [max_log_size]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lifelike.brain import Characters, Conversations
+
+
+def legacy_window(log: list) -> str:
+    log_str = '\n'.join([f"{speaker}: {utterance}" for speaker, utterance in log])
+    return '\n'.join(log_str.split('\n')[-3:])
+
+
+def per_call(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def run(max_size: int) -> list:
+    tmp = tempfile.mkdtemp()
+    characters = Characters(os.path.join(tmp, "characters.json"))
+    characters.add("Alice", "A detective.")
+    characters.add("Bob", "A suspect.")
+    convos = Conversations(os.path.join(tmp, "conversations.json"), characters, None, window_chars=2000)
+    convos.new("room", {"Alice", "Bob"})
+
+    results = []
+    size = 0
+    checkpoint = 10
+    while checkpoint <= max_size:
+        while size < checkpoint:
+            convos.append("room", "Alice" if size % 2 else "Bob", f"Line number {size} of the interrogation.")
+            size += 1
+        log = convos.get("room")["log"]
+        results.append({
+            "log_size": size,
+            "window_us": per_call(lambda: convos.window("room"), 1000) * 1e6,
+            "legacy_us": per_call(lambda: legacy_window(log), max(1, 100000 // size)) * 1e6,
+        })
+        checkpoint *= 10
+    return results
+
+
+if __name__ == "__main__":
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for result in run(max_size):
+        print(json.dumps(result))
@@ -0,0 +1,96 @@
+"""
+Deterministic fakes of the llm and of the embedding model, shared by the benchmarks so that they run offline and give the same work on every run.
+"""
+import asyncio
+import hashlib
+import re
+import time
+from typing import Any, List, Optional
+
+import numpy
+
+from langchain.embeddings.base import Embeddings
+from langchain.llms.base import LLM
+
+WORDS = ("the harbor violin orchard railway lighthouse library vineyard foundry observatory bakery weather road market "
+         "river storm lantern winter festival bridge garden letter stranger mill tower").split()
+
+
+class FakeLLM(LLM):
+    """
+    Fake llm answering with words picked from a hash of the prompt, after sleeping latency seconds.
+    The same prompt always gets the same answer, and every answer is words long, followed by a line the stop sequence cuts off.
+    """
+    latency: float = 0.0
+    words: int = 12
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _answer(self, prompt: str, stop: Optional[List[str]]) -> str:
+        self.calls += 1
+        seed = int(hashlib.md5(prompt.encode('utf-8')).hexdigest()[:8], 16)
+        text = " " + " ".join(WORDS[(seed + i * 7) % len(WORDS)] for i in range(self.words)) + ".\nextra line"
+        for sequence in stop or []:
+            text = text.split(sequence)[0]
+        return text
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._answer(prompt, stop)
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._answer(prompt, stop)
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Fake embedding model hashing each word of a text to a signed dimension, so that texts sharing words are close.
+    Vectors have unit norm. latency seconds are slept per call, not per text, like a remote model.
+    """
+    def __init__(self, dimension: int = 256, latency: float = 0.0) -> None:
+        self.dimension = dimension
+        self.latency = latency
+        self.calls = 0
+        self.texts = 0
+
+    def _embed(self, text: str) -> List[float]:
+        vector = numpy.zeros(self.dimension, dtype=numpy.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = int(hashlib.md5(word.encode('utf-8')).hexdigest()[:8], 16)
+            vector[digest % self.dimension] += 1.0 if digest & 1 << 31 else -1.0
+        norm = numpy.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        self.texts += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
+
+
+def sentences(count: int, words: int = 12, seed: int = 0) -> List[str]:
+    """Deterministic texts made of WORDS, to fill logs and trees"""
+    rng = numpy.random.default_rng(seed)
+    picks = rng.integers(0, len(WORDS), size=(count, words))
+    return [" ".join(WORDS[i] for i in row).capitalize() + "." for row in picks]
+
+
+def random_unit_vectors(count: int, dimension: int, seed: int = 0) -> numpy.ndarray:
+    """Deterministic unit vectors, to fill large trees without calling an embedding model"""
+    vectors = numpy.random.default_rng(seed).standard_normal((count, dimension)).astype(numpy.float32)
+    vectors /= numpy.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
@@ -0,0 +1,270 @@
+"""
+Offline benchmark suite of the hot paths, using the deterministic fakes of fakes.py:
+    - generate: Conversations.generate with growing log sizes
+    - storage: Characters and Conversations save and load
+    - tree: BaseGameTree add_texts, tune_edge, to_json/build_from_json and write_db against an in-process Chroma
+    - retrieval: exact, node scoped and approximate retrieval over 1k to 1M edges
+Results are written as JSON, one record per benchmark and parameters. Give a previous result file to --compare to get the ratio of every timing.
+Usage: python benchmarks/suite.py [--quick | --full] [--only generate,tree] [--output results.json] [--compare baseline.json] [--threshold 1.25] [--min-difference 0.001]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy
+
+from fakes import FakeLLM, HashEmbeddings, random_unit_vectors, sentences
+from lifelike.brain import Characters, Conversations
+from lifelike.StateManager.base_game_tree import BaseGameTree
+
+SIZES = {
+    "quick": {"logs": [10, 1000], "characters": [100], "texts": [1000], "edges": [1000, 10000]},
+    "default": {"logs": [10, 1000, 100000], "characters": [100, 10000], "texts": [1000, 10000], "edges": [1000, 10000, 100000]},
+    "full": {"logs": [10, 1000, 100000], "characters": [100, 10000], "texts": [1000, 10000], "edges": [1000, 10000, 100000, 1000000]},
+}
+
+
+def stats(seconds: list) -> dict:
+    """Median and tail of repeated timings"""
+    seconds = sorted(seconds)
+    return {"p50_s": seconds[len(seconds) // 2], "p99_s": seconds[min(len(seconds) - 1, int(0.99 * len(seconds)))], "runs": len(seconds)}
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def record(benchmark: str, params: dict, metrics: dict) -> dict:
+    return {"benchmark": benchmark, "params": params, "metrics": metrics}
+
+
+def conversations(tmp: str, llm: FakeLLM, characters: int = 2) -> Conversations:
+    names = {"NPC {}".format(i) for i in range(characters)}
+    cast = Characters(os.path.join(tmp, "characters.json"))
+    for name in sorted(names):
+        cast.add(name, "{} lives in the village. {}".format(name, " ".join(sentences(5, seed=len(name)))))
+    convos = Conversations(os.path.join(tmp, "conversations.json"), cast, llm)
+    return convos
+
+
+def bench_generate(sizes: dict, turns: int, warmup: int = 20, batch: int = 10) -> list:
+    """
+    Time of one generate() turn, with the log already holding log_size utterances.
+    After warmup untimed turns, turns are timed in batches of batch turns so that a single slow turn does not move the median.
+    """
+    records = []
+    for log_size in sizes["logs"]:
+        tmp = tempfile.mkdtemp()
+        llm = FakeLLM()
+        convos = conversations(tmp, llm)
+        participants = set(convos.valid.characters)
+        speakers = sorted(participants)
+        convos.new("square", participants)
+        convos.update("square", participants, [[speakers[i % 2], text] for (i, text) in enumerate(sentences(log_size))])
+        turn = lambda: convos.generate("square", "", set())
+        for _ in range(warmup):
+            turn()
+        seconds = [timed(lambda: [turn() for _ in range(batch)]) / batch for _ in range(max(1, turns // batch))]
+        records.append(record("conversations.generate", {"log_size": log_size, "batch": batch}, {"generate": stats(seconds), "llm_calls": llm.calls}))
+    return records
+
+
+def bench_storage(sizes: dict, repeat: int) -> list:
+    """Time of save() and of loading the json files back, for many characters and a conversation per character"""
+    records = []
+    for count in sizes["characters"]:
+        tmp = tempfile.mkdtemp()
+        llm = FakeLLM()
+        cast = Characters(os.path.join(tmp, "characters.json"))
+        names = ["Character {}".format(i) for i in range(count)]
+        for (i, name) in enumerate(names):
+            cast.add(name, " ".join(sentences(10, seed=i)))
+        convos = Conversations(os.path.join(tmp, "conversations.json"), cast, llm)
+        log = sentences(20)
+        for (i, name) in enumerate(names):
+            convos.new("context {}".format(i), {name})
+            convos.update("context {}".format(i), {name}, [[name, text] for text in log])
+
+        metrics = {
+            "characters_save": stats([timed(cast.save) for _ in range(repeat)]),
+            "characters_load": stats([timed(lambda: Characters(cast.path)) for _ in range(repeat)]),
+            "conversations_save": stats([timed(convos.save) for _ in range(repeat)]),
+            "conversations_load": stats([timed(lambda: Conversations(convos.path, cast, llm)) for _ in range(repeat)]),
+            "characters_bytes": os.path.getsize(cast.path),
+            "conversations_bytes": os.path.getsize(convos.path),
+        }
+        records.append(record("storage", {"characters": count, "utterances_per_conversation": len(log)}, metrics))
+    return records
+
+
+def bench_tree(sizes: dict, dimension: int, tunes: int) -> list:
+    """Time of building a tree from texts, tuning its edges, a json round trip and syncing it with Chroma"""
+    records = []
+    for count in sizes["texts"]:
+        tmp = tempfile.mkdtemp()
+        embed = HashEmbeddings(dimension)
+        texts = sentences(count)
+        tree = BaseGameTree("bench-{}".format(uuid.uuid4().hex[:8]), embed)
+        add_texts = timed(lambda: tree.add_texts(texts, ids=["node-{}".format(i) for i in range(count)]))
+
+        prompts = sentences(tunes, words=6, seed=1)
+        edge_ids = list(tree.edge_dict)
+        tune_edge = [timed(lambda: tree.tune_edge(edge_ids[i * 7919 % len(edge_ids)], [prompts[i]])) for i in range(tunes)]
+
+        path = os.path.join(tmp, "tree.json")
+        to_json = timed(lambda: tree.to_json(path))
+        build_from_json = timed(lambda: BaseGameTree.build_from_json(path, embed))
+
+        write_db = timed(tree.write_db)
+        tree.tune_edge(edge_ids[0], prompts[:1])
+        write_db_one_change = timed(tree.write_db)
+        write_db_no_change = timed(tree.write_db)
+        tree.vectorstore._client.delete_collection(tree.name)
+
+        records.append(record("tree", {"texts": count, "dimension": dimension}, {
+            "add_texts_s": add_texts, "tune_edge": stats(tune_edge), "to_json_s": to_json, "build_from_json_s": build_from_json,
+            "json_bytes": os.path.getsize(path), "write_db_s": write_db, "write_db_one_change_s": write_db_one_change,
+            "write_db_no_change_s": write_db_no_change, "embed_calls": embed.calls,
+        }))
+    return records
+
+
+def bench_retrieval(sizes: dict, dimension: int, queries: int, k: int) -> list:
+    """
+    Per query time of the in-process retrievers, with the index build times reported apart.
+    Edges are random unit vectors, see bench_ann.py for the recall of the approximate index on clustered embeddings.
+    """
+    records = []
+    query_texts = sentences(queries, words=6, seed=2)
+    for count in sizes["edges"]:
+        embed = HashEmbeddings(dimension)
+        tree = BaseGameTree("bench-retrieval", embed, compact=count >= 1000000)
+        ids = ["node-{}".format(i) for i in range(count)]
+        build = timed(lambda: tree.add_texts(ids, ids=ids, custom_embeddings=random_unit_vectors(count, dimension)))
+
+        metrics = {"build_tree_s": build}
+        exact = tree.get_retriever(local=True, search_kwargs={"k": k})
+        metrics["build_edge_index_s"] = timed(lambda: exact.get_relevant_documents(query_texts[0]))
+        metrics["exact_query"] = stats([timed(lambda: exact.get_relevant_documents(text)) for text in query_texts])
+        metrics["exact_batch_per_query_s"] = timed(lambda: exact.get_relevant_documents_batch(query_texts)) / queries
+
+        # The scoped retriever only scores the 16 edges going out of the first node
+        for end in ids[1:17]:
+            tree.add_edge(ids[0], end, end, tree.edge_dict[('_', end)])
+        node = tree.get_node_retriever(ids[0], k)
+        metrics["node_query"] = stats([timed(lambda: node.get_relevant_documents(text)) for text in query_texts])
+
+        approximate = [None]
+        metrics["build_ann_index_s"] = timed(lambda: approximate.__setitem__(0, tree.get_retriever(local=True, ann=True, search_kwargs={"k": k})))
+        metrics["ann_query"] = stats([timed(lambda: approximate[0].get_relevant_documents(text)) for text in query_texts])
+
+        records.append(record("retrieval", {"edges": count, "dimension": dimension, "k": k, "compact": count >= 1000000}, metrics))
+        del tree, exact, node, approximate
+    return records
+
+
+def timings(metrics: dict, prefix: str = "") -> dict:
+    """Flat name - seconds of the timings of a record, using the p50 of repeated ones"""
+    flat = {}
+    for (name, value) in metrics.items():
+        if isinstance(value, dict) and "p50_s" in value:
+            flat[prefix + name] = value["p50_s"]
+        elif name.endswith("_s") and isinstance(value, (int, float)):
+            flat[prefix + name] = value
+    return flat
+
+
+def compare(baseline: dict, results: dict, threshold: float, min_difference: float = 0.001) -> dict:
+    """
+    Ratio of every timing to the baseline. Regressions are the ratios above threshold of the timings
+    that also grew by more than min_difference seconds, sub-millisecond timings are too noisy to flag on their ratio alone.
+    """
+    def key(rec: dict) -> str:
+        return rec["benchmark"] + json.dumps(rec["params"], sort_keys=True)
+    before = {key(rec): timings(rec["metrics"]) for rec in baseline["records"]}
+    ratios = {}
+    regressions = {}
+    for rec in results["records"]:
+        old = before.get(key(rec))
+        if old is None:
+            continue
+        for (name, seconds) in timings(rec["metrics"]).items():
+            if old.get(name):
+                label = "{} {} {}".format(rec["benchmark"], json.dumps(rec["params"], sort_keys=True), name)
+                ratios[label] = round(seconds / old[name], 3)
+                if ratios[label] > threshold and seconds - old[name] > min_difference:
+                    regressions[label] = ratios[label]
+    return {"baseline": baseline["meta"], "ratios": ratios, "regressions": regressions}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--quick", action="store_true", help="small sizes, for a smoke run")
+    size.add_argument("--full", action="store_true", help="adds retrieval over 1M edges")
+    parser.add_argument("--only", default="generate,storage,tree,retrieval", help="comma separated benchmarks to run")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20, help="untimed generate turns before timing")
+    parser.add_argument("--batch", type=int, default=10, help="generate turns per timing")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tunes", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--output", help="path of the result json, printed if not provided")
+    parser.add_argument("--compare", help="result json of a previous run")
+    parser.add_argument("--threshold", type=float, default=1.25, help="ratio to the baseline above which a timing is a regression")
+    parser.add_argument("--min-difference", type=float, default=0.001, help="seconds a timing must also grow by to be a regression")
+    args = parser.parse_args()
+
+    sizes = SIZES["quick" if args.quick else "full" if args.full else "default"]
+    benchmarks = {
+        "generate": lambda: bench_generate(sizes, args.turns, args.warmup, args.batch),
+        "storage": lambda: bench_storage(sizes, args.repeat),
+        "tree": lambda: bench_tree(sizes, args.dimension, args.tunes),
+        "retrieval": lambda: bench_retrieval(sizes, args.dimension, args.queries, args.k),
+    }
+    selected = args.only.split(",")
+    unknown = set(selected) - set(benchmarks)
+    if unknown:
+        parser.error("unknown benchmarks {}".format(sorted(unknown)))
+
+    results = {
+        "meta": {"commit": git_commit(), "date": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                 "python": platform.python_version(), "machine": platform.machine(), "numpy": numpy.__version__,
+                 "sizes": "quick" if args.quick else "full" if args.full else "default"},
+        "records": [],
+    }
+    for name in selected:
+        results["records"].extend(benchmarks[name]())
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            results["comparison"] = compare(json.load(f), results, args.threshold, args.min_difference)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+    if args.compare and results["comparison"]["regressions"]:
+        sys.exit(1)
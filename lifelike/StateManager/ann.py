@@ -0,0 +1,295 @@
+"""
+Approximate nearest-neighbour search over edge embeddings, for corpora too large for the exact EdgeIndex.
+IVFIndex is an inverted file index (IVF-flat): embeddings are clustered with k-means, and a query only scores the
+embeddings of the nprobe clusters closest to it. Pure numpy, no native dependency.
+    tree.get_retriever(local=True, ann=True, nprobe=16)
+"""
+import json
+
+import numpy
+
+class IVFIndex:
+    """
+    Inverted file index with flat (uncompressed) float32 lists. Each list is a contiguous block that grows by doubling.
+    Recall and latency are traded with nprobe: more probed lists is slower and closer to exact search.
+    """
+    def __init__(self, nlist: int=None, nprobe: int=8, metric: str="cosine", seed: int=0) -> None:
+        """
+        Constructor. Lists are trained by build(), or by the first add().
+        Params:
+            - nlist: number of clusters. If not provided, 4 * sqrt(number of embeddings at training time).
+            - nprobe: default number of clusters scored per query
+            - metric: "cosine" for cosine similarity, "l2" for negated squared euclidean distance
+            - seed: seed of the k-means initialization and sampling
+        """
+        if metric not in ("cosine", "l2"):
+            raise ValueError("Unknown metric {}. Must be one of cosine, l2".format(metric))
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.metric = metric
+        self.seed = seed
+
+        self.centroids = None # (nlist, dimension)
+        self.lists = [] # list - (capacity, dimension) embeddings, normalized for cosine
+        self.norms = [] # list - (capacity,) squared norms, used by l2
+        self.keys = [] # list - keys of its rows
+        self.locations = {} # key - (list, row)
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def __contains__(self, key) -> bool:
+        return key in self.locations
+
+    def _prepare(self, embeddings) -> numpy.ndarray:
+        """(n, dimension) float32 embeddings, normalized for cosine"""
+        embeddings = numpy.array(embeddings, dtype=numpy.float32, ndmin=2)
+        if self.metric == "cosine":
+            embeddings /= numpy.maximum(numpy.linalg.norm(embeddings, axis=1, keepdims=True), numpy.finfo(numpy.float32).tiny)
+        return embeddings
+
+    def _centroid_scores(self, embeddings: numpy.ndarray, centroids: numpy.ndarray) -> numpy.ndarray:
+        """Similarity of prepared embeddings to centroids, higher is closer"""
+        scores = embeddings @ centroids.T
+        if self.metric == "l2":
+            scores = 2 * scores - (centroids ** 2).sum(1)[None, :]
+        return scores
+
+    def _assign(self, embeddings: numpy.ndarray, centroids: numpy.ndarray) -> numpy.ndarray:
+        """Closest centroid of every prepared embedding, in chunks so that the score matrix stays small"""
+        assignments = numpy.empty(embeddings.shape[0], dtype=numpy.int64)
+        chunk = max(1, 2**24 // max(centroids.shape[0], 1))
+        for start in range(0, embeddings.shape[0], chunk):
+            assignments[start:start + chunk] = self._centroid_scores(embeddings[start:start + chunk], centroids).argmax(1)
+        return assignments
+
+    def train(self, embeddings, iterations: int=10, sample: int=None) -> None:
+        """
+        Learn the cluster centroids with k-means. Only allowed on an empty index, use build() to re-cluster an existing one.
+        Params:
+            - embeddings: (n, dimension) training embeddings
+            - iterations: k-means iterations
+            - sample: number of embeddings k-means runs on. Defaulted to 64 per cluster.
+        """
+        if len(self):
+            raise ValueError("IVFIndex can only be trained while empty, use build() to rebuild it")
+        embeddings = self._prepare(embeddings)
+        rng = numpy.random.default_rng(self.seed)
+        nlist = self.nlist or max(1, int(4 * numpy.sqrt(embeddings.shape[0])))
+        nlist = min(nlist, embeddings.shape[0])
+        sample = sample or 64 * nlist
+        if embeddings.shape[0] > sample:
+            embeddings = embeddings[rng.choice(embeddings.shape[0], sample, replace=False)]
+
+        centroids = embeddings[rng.choice(embeddings.shape[0], nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = self._assign(embeddings, centroids)
+            counts = numpy.bincount(assignments, minlength=nlist)
+            order = numpy.argsort(assignments, kind="stable")
+            (present, starts) = numpy.unique(assignments[order], return_index=True)
+            sums = numpy.add.reduceat(embeddings[order], starts, axis=0, dtype=numpy.float64)
+            centroids[present] = sums / counts[present, None]
+            empty = counts == 0
+            # Empty clusters restart from random embeddings
+            centroids[empty] = embeddings[rng.choice(embeddings.shape[0], int(empty.sum()))]
+            if self.metric == "cosine":
+                centroids /= numpy.maximum(numpy.linalg.norm(centroids, axis=1, keepdims=True), numpy.finfo(numpy.float32).tiny)
+
+        self.nlist = nlist
+        self.centroids = centroids.astype(numpy.float32)
+        self.lists = [numpy.zeros((0, centroids.shape[1]), dtype=numpy.float32) for _ in range(nlist)]
+        self.norms = [numpy.zeros(0, dtype=numpy.float32) for _ in range(nlist)]
+        self.keys = [[] for _ in range(nlist)]
+
+    def build(self, keys: list, embeddings, iterations: int=10) -> None:
+        """
+        Cluster and add embeddings, replacing the content of the index.
+        Params:
+            - keys: identifier of each embedding, usually edge_dict keys
+            - embeddings: (n, dimension) embeddings
+            - iterations: k-means iterations
+        """
+        self.centroids = None
+        self.locations = {}
+        self.train(embeddings, iterations)
+        self.add(keys, embeddings)
+
+    def add(self, keys: list, embeddings) -> None:
+        """
+        Add or replace embeddings. They go to the list of their closest centroid, centroids are not updated:
+        rebuild with build() if the distribution of the embeddings drifts a lot. Trains the index if it was not yet.
+        Params:
+            - keys: identifier of each embedding
+            - embeddings: (n, dimension) embeddings
+        """
+        if len(keys) == 0:
+            return
+        if self.centroids is None:
+            self.train(embeddings)
+        embeddings = self._prepare(embeddings)
+        for key in keys:
+            if key in self.locations:
+                self.remove(key)
+
+        assignments = self._assign(embeddings, self.centroids)
+        order = numpy.argsort(assignments, kind="stable")
+        bounds = numpy.flatnonzero(numpy.diff(assignments[order])) + 1
+        for group in numpy.split(order, bounds):
+            self._append(int(assignments[group[0]]), [keys[i] for i in group], embeddings[group])
+
+    def _append(self, list_id: int, keys: list, embeddings: numpy.ndarray) -> None:
+        """Append prepared embeddings to a list, doubling its block when full"""
+        size = len(self.keys[list_id])
+        block = self.lists[list_id]
+        if size + len(keys) > block.shape[0]:
+            capacity = max(size + len(keys), 2 * block.shape[0], 16)
+            grown = numpy.zeros((capacity, block.shape[1]), dtype=numpy.float32)
+            grown[:size] = block[:size]
+            norms = numpy.zeros(capacity, dtype=numpy.float32)
+            norms[:size] = self.norms[list_id][:size]
+            self.lists[list_id], self.norms[list_id] = grown, norms
+
+        self.lists[list_id][size:size + len(keys)] = embeddings
+        self.norms[list_id][size:size + len(keys)] = (embeddings ** 2).sum(1)
+        for (i, key) in enumerate(keys):
+            self.locations[key] = (list_id, size + i)
+        self.keys[list_id].extend(keys)
+
+    def upsert(self, key, embedding) -> None:
+        """Add or replace one embedding, same interface as EdgeIndex"""
+        self.add([key], [embedding])
+
+    def remove(self, key) -> bool:
+        """
+        Remove an embedding. The last row of its list is moved into its place.
+        Params:
+            - key: identifier of the embedding
+        """
+        location = self.locations.pop(key, None)
+        if location is None:
+            return False
+        (list_id, row) = location
+        keys = self.keys[list_id]
+        last = len(keys) - 1
+        last_key = keys.pop()
+        if row != last:
+            self.lists[list_id][row] = self.lists[list_id][last]
+            self.norms[list_id][row] = self.norms[list_id][last]
+            keys[row] = last_key
+            self.locations[last_key] = (list_id, row)
+        return True
+
+    def search(self, queries, k: int=4, nprobe: int=None) -> list:
+        """
+        Approximate top-k search.
+        Params:
+            - queries: a (dimension,) query embedding or a (n, dimension) batch of them
+            - k: number of results per query
+            - nprobe: number of clusters scored per query. Defaulted to the index's nprobe.
+
+        Returns: for each query, a list of (key, score) sorted from closest, like EdgeIndex.search(). A single list for a single query.
+        """
+        single = numpy.ndim(queries) == 1
+        queries = self._prepare(queries)
+        if self.centroids is None or k <= 0:
+            results = [[] for _ in queries]
+            return results[0] if single else results
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probes = numpy.argpartition(-self._centroid_scores(queries, self.centroids), nprobe - 1, axis=1)[:, :nprobe]
+        query_norms = (queries ** 2).sum(1)
+
+        results = []
+        for (query, query_probes, query_norm) in zip(queries, probes, query_norms):
+            scores = []
+            candidates = [] # (list, number of rows) in the order of scores
+            for list_id in query_probes:
+                size = len(self.keys[list_id])
+                if size == 0:
+                    continue
+                list_scores = self.lists[list_id][:size] @ query
+                if self.metric == "l2":
+                    list_scores = 2 * list_scores - self.norms[list_id][:size] - query_norm
+                scores.append(list_scores)
+                candidates.append((list_id, size))
+            if not scores:
+                results.append([])
+                continue
+
+            scores = numpy.concatenate(scores)
+            top_k = min(k, scores.shape[0])
+            top = numpy.argpartition(-scores, top_k - 1)[:top_k]
+            top = top[numpy.argsort(-scores[top])]
+            offsets = numpy.cumsum([0] + [size for (_, size) in candidates])
+            query_results = []
+            for i in top:
+                j = int(numpy.searchsorted(offsets, i, side="right")) - 1
+                query_results.append((self.keys[candidates[j][0]][i - offsets[j]], float(scores[i])))
+            results.append(query_results)
+        return results[0] if single else results
+
+    def save(self, path: str) -> None:
+        """
+        Save the index to a single .npz file. Keys must be strings or tuples of strings, like edge_dict keys.
+        Params:
+            - path: path of the file, .npz is added if missing
+        """
+        sizes = [len(keys) for keys in self.keys]
+        dimension = 0 if self.centroids is None else self.centroids.shape[1]
+        numpy.savez(
+            path,
+            settings=numpy.array(json.dumps({"nlist": self.nlist, "nprobe": self.nprobe, "metric": self.metric, "seed": self.seed})),
+            centroids=numpy.zeros((0, dimension), dtype=numpy.float32) if self.centroids is None else self.centroids,
+            embeddings=numpy.concatenate([block[:size] for (block, size) in zip(self.lists, sizes)]) if sizes else numpy.zeros((0, dimension), dtype=numpy.float32),
+            sizes=numpy.array(sizes, dtype=numpy.int64),
+            keys=numpy.array(json.dumps([key for keys in self.keys for key in keys]))
+        )
+
+    @classmethod
+    def load(cls: 'IVFIndex', path: str) -> 'IVFIndex':
+        """
+        Load an index saved with save().
+        Params:
+            - path: path of the .npz file
+        """
+        with numpy.load(path if path.endswith(".npz") else path + ".npz") as data:
+            index = cls(**json.loads(str(data["settings"])))
+            keys = [tuple(key) if isinstance(key, list) else key for key in json.loads(str(data["keys"]))]
+            embeddings, sizes, centroids = data["embeddings"], data["sizes"], data["centroids"]
+
+        if centroids.shape[0] == 0:
+            return index
+        index.centroids = centroids
+        index.lists, index.norms, index.keys = [], [], []
+        offsets = numpy.concatenate([[0], numpy.cumsum(sizes)])
+        for list_id in range(len(sizes)):
+            block = numpy.array(embeddings[offsets[list_id]:offsets[list_id + 1]])
+            index.lists.append(block)
+            index.norms.append((block ** 2).sum(1))
+            index.keys.append(keys[offsets[list_id]:offsets[list_id + 1]])
+            for (row, key) in enumerate(index.keys[-1]):
+                index.locations[key] = (list_id, row)
+        return index
+
+    @classmethod
+    def from_edge_dict(cls: 'IVFIndex', edge_dict: dict, nlist: int=None, nprobe: int=8, metric: str="cosine") -> 'IVFIndex':
+        """Build an index from the edge_dict of a game tree. Edges without embedding are skipped."""
+        keys = []
+        embeddings = []
+        for (key, edge) in edge_dict.items():
+            embedding = edge.get_embedding()
+            if embedding is not None:
+                keys.append(key)
+                embeddings.append(embedding)
+        index = cls(nlist, nprobe, metric)
+        if keys:
+            index.build(keys, numpy.asarray(embeddings, dtype=numpy.float32))
+        return index
+
+
+def __getattr__(name: str):
+    # ANNRetriever moved to retriever.py with the other langchain retrievers, so that IVFIndex does not load langchain
+    if name == "ANNRetriever":
+        from lifelike.StateManager.retriever import ANNRetriever
+        return ANNRetriever
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
@@ -4,22 +4,106 @@ Tunes sequence embeddings to allow the game to more accurately predict player's
 For now, requires chromadb
 """
 import numpy
+import itertools
 import json
+import time
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from lifelike import metrics
+from lifelike.StateManager.index import EdgeIndex
+from lifelike.StateManager.quantize import check_dtype, dequantize, quantize
+
+# langchain and chromadb take seconds to import, they are only loaded once a vectorstore or retriever is used
+if TYPE_CHECKING:
+    from langchain.embeddings.base import Embeddings # TODO: Make all embedding_function Embeddings interface
+    from langchain.schema import BaseRetriever
+    from langchain.vectorstores import Chroma
+    from lifelike.StateManager.retriever import GameNodeRetriever
+
+def buffer_key(embedding: numpy.ndarray) -> tuple:
+    """Identifies the memory of an embedding, equal for edges sharing a template's embedding"""
+    return (embedding.__array_interface__["data"][0], embedding.shape)
+
+def shared_buffers(embeddings: list) -> dict:
+    """Buffer keys used by more than one of embeddings (None are skipped) - index in order of first use"""
+    counts = {}
+    for embedding in embeddings:
+        if embedding is not None:
+            key = buffer_key(embedding)
+            counts[key] = counts.get(key, 0) + 1
+    return {key: index for (index, key) in enumerate(key for (key, count) in counts.items() if count > 1)}
+
+def read_only(embedding: numpy.ndarray) -> numpy.ndarray:
+    """Marks an embedding as shared. Tuning replaces embeddings instead of writing into them, so shared buffers are never modified."""
+    embedding.flags.writeable = False
+    return embedding
+
+def embed_documents(embed: 'Embeddings', texts: list) -> list:
+    """
+    Call embed.embed_documents(), timed as the tree.embed metric
+    Params:
+        - embed: embedding function
+        - texts: texts to embed
+
+    Returns: the embeddings of texts
+    """
+    metrics.value("tree.embed_batch_size", len(texts))
+    with metrics.span("tree.embed"):
+        return embed.embed_documents(texts)
+
+
+def embed_prompts(edges: dict, edge_prompts: dict, batch_size: int=None) -> dict:
+    """
+    Embed the tuning prompts of many edges together: unique prompts are sent once, in one embed_documents() call per batch_size prompts
+    and per embedding function. Final edges and edges without prompts are left out.
+    Params:
+        - edges: dict of the form {edge_id: EdgeEmbedding}
+        - edge_prompts: dict of the form {edge_id: prompts}
+        - batch_size: maximum number of prompts per embed_documents() call. Defaulted to None (one call).
+
+    Returns: dict of the form {edge_id: (len(prompts), dimension) float32 ndarray}, in the order of edge_prompts
+    """
+    groups = {} # id of embedding function - (embedding function, {prompt: row})
+    for (edge_id, prompts) in edge_prompts.items():
+        edge = edges[edge_id]
+        if edge._final:
+            print("The Embedding {} is marked as Final. Cannot be tuned.".format(edge.name))
+            continue
+        (_, rows) = groups.setdefault(id(edge.embed), (edge.embed, {}))
+        for prompt in prompts:
+            rows.setdefault(prompt, len(rows))
+
+    vectors = {} # id of embedding function - float32 matrix of its unique prompts
+    for (key, (embed, rows)) in groups.items():
+        texts = list(rows)
+        step = batch_size or max(1, len(texts))
+        vectors[key] = numpy.concatenate([numpy.asarray(embed_documents(embed, texts[start:start + step]), dtype=numpy.float32)
+                                          for start in range(0, len(texts), step)]) if texts else None
+
+    embedded = {}
+    for (edge_id, prompts) in edge_prompts.items():
+        edge = edges[edge_id]
+        if edge._final or not prompts:
+            continue
+        (_, rows) = groups[id(edge.embed)]
+        embedded[edge_id] = vectors[id(edge.embed)][[rows[prompt] for prompt in prompts]]
+    return embedded
 
-from langchain.schema import BaseRetriever
-from langchain.vectorstores import Chroma
-from langchain.embeddings.base import Embeddings # TODO: Make all embedding_function Embeddings interface
 
 class EdgeEmbedding:
     """Edge embedding dictionary that stores, calculate and allows for retrieval of different preset embeddings"""
-    def __init__(self, name: str, embedding_function: Embeddings=None, current_embedding: list=None, current_weight: int=0) -> None:
+    __slots__ = ("name", "_final", "embed", "embedding", "weight")
+
+    def __init__(self, name: str, embedding_function: 'Embeddings'=None, current_embedding: numpy.ndarray=None, current_weight: int=0) -> None:
         """
         Constructor. If loading from dict, use from_dict() instead. 
         Params:
             - name: identifier
             - embedding_function: the function that takes a batch of responses and returns the corresponding batch of embeddings. If not provided, the embedding is marked as Final (no tuning allowed).
-            - current_embedding: the current embedding loaded from json, or pre-determined to bypass tuning. Defaulted to None.
+            - current_embedding: the current embedding loaded from json, or pre-determined to bypass tuning. Any array-like, stored as a float32 ndarray. Defaulted to None.
             - current_weight: the current weight loaded from json (use 1 to bypass tuning). If current_weight is 0, the current_embedding will be ignored. Defaulted to 0.
         """
         if not name:
@@ -35,12 +119,12 @@ class EdgeEmbedding:
         
         self.embed = embedding_function
 
-        self.embedding = current_embedding
+        self.embedding = None if current_embedding is None else numpy.asarray(current_embedding, dtype=numpy.float32)
 
         self.weight = current_weight # The number of responses this embedding represents
 
     @classmethod
-    def from_dict(cls:'EdgeEmbedding', embedding_dict: dict, embedding_function: Embeddings=None) -> 'EdgeEmbedding':
+    def from_dict(cls:'EdgeEmbedding', embedding_dict: dict, embedding_function: 'Embeddings'=None) -> 'EdgeEmbedding':
         """
         Generate up a edge Embedding instance. DO NOT USE TO MAKE DEEP COPY, use copy() instead
         Params:
@@ -52,13 +136,13 @@ class EdgeEmbedding:
         weight = embedding_dict["weight"]
         return cls(name, embedding_function, embedding, weight)
 
-    def get_embedding(self) -> list:
+    def get_embedding(self) -> numpy.ndarray:
         """
-        Getter function for embedding attribute. Defaulted to all 0s if no responses have been added.
+        Getter function for embedding attribute, a float32 ndarray. None if no responses have been added.
         """
         return self.embedding
 
-    def tune_prompts(self, prompts: list) -> list:
+    def tune_prompts(self, prompts: list) -> numpy.ndarray:
         """
         Add prompts to the embedding and calculates new embedding using weighted average. Tunes embedding of SequenceEvent.
         Potentially suffers from density bias. Good response choices will depend on choice of embedding function.
@@ -71,39 +155,68 @@ class EdgeEmbedding:
             print("The Embedding is marked as Final. Cannot be tuned.")
             return None
 
-        new_embeddings = self.embed.embed_documents(prompts)
+        return self.tune_embeddings(embed_documents(self.embed, prompts))
+
+    def tune_embeddings(self, new_embeddings) -> numpy.ndarray:
+        """
+        Same as tune_prompts() with prompts that are already embedded, used to embed the prompts of many edges in one call.
+        Params:
+            - new_embeddings: (n, dimension) array-like of prompt embeddings
+
+        Returns: The new embedding
+        """
+        if self._final:
+            print("The Embedding is marked as Final. Cannot be tuned.")
+            return None
+
+        new_embeddings = numpy.asarray(new_embeddings, dtype=numpy.float32)
+        if len(new_embeddings) == 0:
+            return self.embedding
 
-        # Update weighted average
-        self.embedding = numpy.average([self.embedding] + new_embeddings, 0, [self.weight]+[1]*len(prompts)).tolist()
+        # Update weighted average from the running sum of the responses. O(d) on top of summing the batch
+        total = self._running_sum(new_embeddings.shape[1]) + new_embeddings.sum(0, dtype=numpy.float64)
 
         # Update weights
-        self.weight += len(prompts)
+        self.weight += len(new_embeddings)
+        self._set_running_sum(total)
         return self.embedding
 
+    def _running_sum(self, dimension: int) -> numpy.ndarray:
+        """float64 sum of the responses this embedding represents, rebuilt from the float32 embedding and its weight"""
+        if self.embedding is None or self.weight <= 0:
+            return numpy.zeros(dimension, dtype=numpy.float64)
+        return self.embedding.astype(numpy.float64) * self.weight
+
+    def _set_running_sum(self, total: numpy.ndarray) -> None:
+        """Store the average of a new running sum as the embedding, a new array as the old one may be shared"""
+        self.embedding = (total / self.weight).astype(numpy.float32)
+
     def to_dict(self) -> dict:
         """
-        Used to save to json as part of configuration, as well as make a copy
-        Returns: a dict of the form {'name': ..., 'embedding': ..., 'weight': ...} 
+        Used to save to json as part of configuration
+        Returns: a dict of the form {'name': ..., 'embedding': ..., 'weight': ...} where embedding is a list of floats
         """
         return {
             'name': self.name,
-            'embedding': self.embedding,
+            'embedding': None if self.embedding is None else self.embedding.tolist(),
             'weight': self.weight
         }
 
     def copy(self, new_name: str) -> 'EdgeEmbedding':
         """
-        Return a deep copy of this edgeEmbedding instance.
+        Return a copy of this edgeEmbedding instance. The embedding buffer is shared and made read-only, not copied:
+        tune_prompts() gives the tuned instance a new buffer (copy-on-write), so memory scales with the number of tuned edges.
         Params:
             - new_name: Give new name. Ensure it is unique in the game to avoid unexpected behaviours.
         """
-        embedding_dict = self.to_dict()
-        embedding_dict["name"] = new_name
-        return EdgeEmbedding.from_dict(embedding_dict, self.embed)
+        embedding = None if self.embedding is None else read_only(self.embedding)
+        return EdgeEmbedding(new_name, self.embed, embedding, self.weight)
 
 
 class GameNode:
     """Wrapper for a document in Database"""
+    __slots__ = ("id", "context", "metadata")
+
     def __init__(self, id: str, context: str, metadata: str) -> None:
         """
         Constructor. To build the event from dict, use .from_dict()
@@ -136,12 +249,16 @@ class BaseGameTree:
     Only Constructor can exit to support retries.
     Technically a graph, not a tree.
     """
-    def __init__(self, name: str, embedding_function: Embeddings=None) -> None:
+    def __init__(self, name: str, embedding_function: 'Embeddings'=None, compact: bool=False, dtype: str="float32") -> None:
         """
         Constructor.
         Params:
             - name: Name of the story (Must be chromadb friendly)
             - embedding_function: Takes input and returns embedding. If not provided, the Tree is marked as Final (cannot be changed)
+            - compact: store edges in a columnar CompactEdgeDict instead of a dict of EdgeEmbedding, for trees with millions of edges
+            - dtype: "float32", "float16" or "int8" (see quantize.py). Storage of the in-process EdgeIndex, of the compact edge table and
+              of to_binary() files. Without compact, edges stay float32 and the index re-scores its top candidates with them.
+              With compact, edges are quantized too: search is approximate, but edge memory shrinks 2x (float16) to 4x (int8).
         """
         self.name = name
         self._final = False # Final flag, determines if any change can be made to the tree
@@ -152,9 +269,10 @@ class BaseGameTree:
             self._final = True # Activate Final flag
         
         self.embed = embedding_function # TODO Rename this, Embeddings is not a function
+        self.dtype = check_dtype(dtype)
 
         # TODO add persistent option and metadata preset
-        self.vectorstore = Chroma(name, self.embed) # Preset to Chroma TODO make this work with all vectorstore
+        self._vectorstore = None # Preset to Chroma on first use, see vectorstore TODO make this work with all vectorstore
 
         # Currently, if there are 2 ways to reach an event, a copy with a new unique id must be made
         self.node_dict = {} # id - SequenceEvent. Mostly for lookup
@@ -163,7 +281,38 @@ class BaseGameTree:
 
         # Provides edge look up for custom edge embedding. Format: {(SequenceEvent left, SequenceEvent right): edgeEmbedding embedding}
         # Where left is start event, right is end event, and embedding is the required embedding to go from left to right
-        self.edge_dict = {} 
+        self.edge_dict = {}
+        if compact:
+            from lifelike.StateManager.compact import CompactEdgeDict # compact imports this module
+            self.edge_dict = CompactEdgeDict(self.embed, dtype=dtype)
+
+        self._edge_index = None # In-process EdgeIndex over edge_dict, built on first use by edge_index()
+        self._ann_index = None # In-process IVFIndex over edge_dict, built on first use by ann_index()
+        self._adjacency = None # start id - list of end ids, built on first use by adjacency()
+
+        # Changes since the last write_db(). Edges are identified by their edge_dict key
+        self._dirty_edges = set() # Added or tuned
+        self._removed_edges = set()
+        self.last_sync = None # Report of the last write_db()
+
+    @property
+    def vectorstore(self) -> 'Chroma':
+        """
+        The Chroma collection of the tree, named after it. Created on first use, so that trees never written with write_db() do not load chromadb.
+        chromadb is an optional dependency: pip install lifelike[chroma]
+        """
+        if self._vectorstore is None:
+            try:
+                import chromadb # Checked here, langchain only reports a missing chromadb with a ValueError
+            except ImportError as e:
+                raise ImportError("The vectorstore of tree {} needs chromadb. Install it with pip install lifelike[chroma]".format(self.name)) from e
+            from langchain.vectorstores import Chroma
+            self._vectorstore = Chroma(self.name, self.embed)
+        return self._vectorstore
+
+    @vectorstore.setter
+    def vectorstore(self, vectorstore: 'Chroma') -> None:
+        self._vectorstore = vectorstore
 
     def add_texts(self, texts, metadatas = None, ids = None, custom_embeddings = None):
         """
@@ -173,8 +322,12 @@ class BaseGameTree:
         if ids is None: # If id not provided, generate it
             ids = [str(uuid.uuid1()) for _ in texts]
 
-        if custom_embeddings is None:
-            embeddings = self.embed.embed_documents(texts)
+        if metadatas is None:
+            metadatas = [{} for _ in texts]
+
+        embeddings = custom_embeddings
+        if embeddings is None:
+            embeddings = embed_documents(self.embed, texts)
 
         # Text to tree. Does not allow for custom edges
         for i in range(len(texts)):
@@ -185,6 +338,67 @@ class BaseGameTree:
 
         return ids
 
+    def add_text_stream(self, texts, metadatas=None, ids=None, chunk_size: int=256, max_workers: int=4, max_in_flight: int=None,
+                        write_db: bool=True, progress=None) -> dict:
+        """
+        Streaming version of add_texts() for corpora too large to embed at once. Texts are embedded in fixed-size chunks by a bounded thread pool,
+        and each chunk is added with add_texts() and written to the vectorstore as soon as it is embedded, so peak memory does not grow with the corpus.
+        Params:
+            - texts: iterable of texts, can be a generator
+            - metadatas: iterable of metadata dicts in the same order as texts. If not provided, nodes get empty metadata.
+            - ids: iterable of node ids in the same order as texts. If not provided, they are generated.
+            - chunk_size: number of texts per embed_documents() call
+            - max_workers: number of threads embedding chunks
+            - max_in_flight: maximum number of chunks embedded or waiting to be added. Defaulted to 2 * max_workers.
+            - write_db: upsert each chunk into the vectorstore once added. Otherwise the edges wait for write_db().
+            - progress: called after each chunk with the report so far
+
+        Returns: a report of the form {'texts': ..., 'chunks': ..., 'seconds': ..., 'texts_per_second': ...}
+        """
+        if self._final:
+            print("Game Tree was marked as Final. No change can be made to it")
+            return None
+
+        if max_in_flight is None:
+            max_in_flight = 2 * max_workers
+        metadatas = itertools.repeat(None) if metadatas is None else iter(metadatas)
+        ids = (str(uuid.uuid1()) for _ in itertools.count()) if ids is None else iter(ids)
+        items = zip(texts, metadatas, ids)
+
+        start = time.perf_counter()
+        report = {"texts": 0, "chunks": 0, "seconds": 0.0, "texts_per_second": 0.0}
+        in_flight = deque() # (chunk, future of its embeddings), in input order
+
+        def add_oldest() -> None:
+            chunk, future = in_flight.popleft()
+            chunk_texts, chunk_metadatas, chunk_ids = zip(*chunk)
+            chunk_metadatas = [{} if metadata is None else metadata for metadata in chunk_metadatas]
+            self.add_texts(list(chunk_texts), chunk_metadatas, list(chunk_ids), future.result())
+            if write_db:
+                edge_ids = [('_', node_id) for node_id in chunk_ids if ('_', node_id) in self.edge_dict]
+                self._write_chunk(edge_ids)
+                self._dirty_edges.difference_update(edge_ids)
+
+            report["texts"] += len(chunk)
+            report["chunks"] += 1
+            report["seconds"] = time.perf_counter() - start
+            report["texts_per_second"] = report["texts"] / report["seconds"] if report["seconds"] else 0.0
+            if progress is not None:
+                progress(dict(report))
+
+        with ThreadPoolExecutor(max_workers) as pool:
+            while True:
+                chunk = list(itertools.islice(items, chunk_size))
+                if not chunk:
+                    break
+                in_flight.append((chunk, pool.submit(embed_documents, self.embed, [text for (text, _, _) in chunk])))
+                if len(in_flight) >= max_in_flight:
+                    add_oldest()
+            while in_flight:
+                add_oldest()
+
+        return report
+
     def add_node(self, node: GameNode) -> bool:
         """
         Add a GameNode to the GameTree. 
@@ -237,6 +451,10 @@ class BaseGameTree:
         if self.validate_edge(start_id, end_id, embedding_template.name):
             # Assigns to edge_dict
             self.edge_dict[(start_id, end_id)] = embedding_template.copy(embedding_name)
+            self._index_edge((start_id, end_id))
+            if self._adjacency is not None:
+                self._adjacency.setdefault(start_id, []).append(end_id)
+            self._mark_dirty((start_id, end_id))
             return True
 
     def validate_edge(self, start_id: str, end_id: str, embedding_template_name: str="default") -> bool:
@@ -270,9 +488,158 @@ class BaseGameTree:
         if edge_id not in self.edge_dict:
             print("edge {} does not exists".format(edge_id))
             return False
-        self.edge_dict[edge_id].tune_prompts(prompts)
+        with metrics.span("tree.tune_edge"):
+            self.edge_dict[edge_id].tune_prompts(prompts)
+        self._index_edge(edge_id)
+        self._mark_dirty(edge_id)
         return True
 
+    def tune_edges(self, edge_prompts: dict, batch_size: int=None) -> bool:
+        """
+        Tune many edges at once. The prompts of all edges are embedded together, in one embed_documents() call per batch_size unique prompts,
+        instead of one call per edge. Gives the same embeddings as calling tune_edge() on each edge in order.
+        Nothing is tuned if one of the edges does not exist.
+        Params:
+            - edge_prompts: dict of the form {edge_id: prompts}
+            - batch_size: maximum number of prompts per embed_documents() call. Defaulted to None (one call).
+        """
+        if self._final:
+            print("Game Tree was marked as Final. No change can be made to it")
+            return False
+
+        missing = [edge_id for edge_id in edge_prompts if edge_id not in self.edge_dict]
+        if missing:
+            print("edges {} do not exist".format(missing))
+            return False
+
+        edges = {edge_id: self.edge_dict[edge_id] for edge_id in edge_prompts}
+        with metrics.span("tree.tune_edges"):
+            for (edge_id, new_embeddings) in embed_prompts(edges, edge_prompts, batch_size).items():
+                edges[edge_id].tune_embeddings(new_embeddings)
+                self._index_edge(edge_id)
+                self._mark_dirty(edge_id)
+        metrics.value("tree.tune_edges_size", len(edge_prompts))
+        return True
+
+    def remove_edge(self, edge_id: tuple) -> bool:
+        """
+        Remove an edge. It is deleted from the database on the next write_db().
+        Params:
+            - edge_id: Identifier for edge, is a tuple of form (start_event, end_event)
+        """
+        if self._final:
+            print("Game Tree was marked as Final. No change can be made to it")
+            return False
+
+        if edge_id not in self.edge_dict:
+            print("edge {} does not exists".format(edge_id))
+            return False
+
+        self.edge_dict.pop(edge_id)
+        if self._edge_index is not None:
+            self._edge_index.remove(edge_id)
+        if self._ann_index is not None:
+            self._ann_index.remove(edge_id)
+        if self._adjacency is not None:
+            self._adjacency[edge_id[0]].remove(edge_id[1])
+        self._dirty_edges.discard(edge_id)
+        self._removed_edges.add(edge_id)
+        return True
+
+    def remove_node(self, node_id: str) -> bool:
+        """
+        Remove a node and every edge that starts or ends at it.
+        Params:
+            - node_id: id of the node
+        """
+        if self._final:
+            print("Game Tree was marked as Final. No change can be made to it")
+            return False
+
+        if node_id not in self.node_dict:
+            print("Node {} does not exists".format(node_id))
+            return False
+
+        for edge_id in [edge_id for edge_id in self.edge_dict if node_id in edge_id]:
+            self.remove_edge(edge_id)
+        self.node_dict.pop(node_id)
+        return True
+
+    def _mark_dirty(self, edge_id: tuple) -> None:
+        """Schedule an edge to be written by the next write_db()"""
+        self._dirty_edges.add(edge_id)
+        self._removed_edges.discard(edge_id)
+
+    def _index_edge(self, edge_id: tuple) -> None:
+        """Keep the in-process indexes, if built, in sync with edge_dict"""
+        embedding = self.edge_dict[edge_id].get_embedding()
+        if embedding is None:
+            return
+        if self._edge_index is not None:
+            self._edge_index.upsert(edge_id, embedding)
+        if self._ann_index is not None:
+            self._ann_index.upsert(edge_id, embedding)
+
+    def edge_index(self) -> EdgeIndex:
+        """The EdgeIndex over all edge embeddings. Built on first call, then kept in sync by add_edge() and tune_edge()."""
+        if self._edge_index is None:
+            self._edge_index = EdgeIndex.from_edge_dict(self.edge_dict, self.dtype)
+        return self._edge_index
+
+    def ann_index(self, nlist: int=None, nprobe: int=8, metric: str="cosine", rebuild: bool=False) -> 'IVFIndex':
+        """
+        The approximate IVFIndex over all edge embeddings. Built on first call, then kept in sync like edge_index().
+        New edges go to the closest existing cluster, call again with rebuild=True after large changes to re-cluster.
+        Params:
+            - nlist: number of clusters. Defaulted to 4 * sqrt(number of edges).
+            - nprobe: default number of clusters scored per query
+            - metric: "cosine" or "l2"
+            - rebuild: re-cluster even if the index is already built
+        """
+        if self._ann_index is None or rebuild:
+            from lifelike.StateManager.ann import IVFIndex
+            self._ann_index = IVFIndex.from_edge_dict(self.edge_dict, nlist, nprobe, metric)
+        return self._ann_index
+
+    def load_ann_index(self, path: str) -> 'IVFIndex':
+        """
+        Use an IVFIndex saved with ann_index().save(path) instead of building one. It must have been built from this tree.
+        Params:
+            - path: path of the .npz file
+        """
+        from lifelike.StateManager.ann import IVFIndex
+        self._ann_index = IVFIndex.load(path)
+        return self._ann_index
+
+    def adjacency(self) -> dict:
+        """Outgoing edges of every node, as {start_id: [end_id, ...]}. Built on first call, then kept in sync by add_edge()."""
+        if self._adjacency is None:
+            self._adjacency = {}
+            for (start_id, end_id) in self.edge_dict:
+                self._adjacency.setdefault(start_id, []).append(end_id)
+        return self._adjacency
+
+    def freeze(self) -> 'BaseGameTree':
+        """
+        Mark the tree as Final so that it can be shared read-only by many sessions, see new_session().
+        The in-process index and adjacency are built now, so concurrent sessions only ever read them.
+        """
+        self._final = True
+        self.edge_index()
+        self.adjacency()
+        return self
+
+    def new_session(self, session_id: str=None, node_id: str=None) -> 'GameSession':
+        """
+        Per-player overlay on this tree. Tuning, added nodes and added edges stay in the session, the tree is left untouched.
+        The tree must be frozen with freeze() first.
+        Params:
+            - session_id: identifier of the session, usually the player's
+            - node_id: the node the player starts at
+        """
+        from lifelike.StateManager.session import GameSession # session imports this module
+        return GameSession(self, session_id, node_id)
+
     def get_template_options(self) -> list:
         """Get the name of all stored templates"""
         return self.embedding_template_dict.keys()
@@ -285,37 +652,65 @@ class BaseGameTree:
         return self.embedding_template_dict[name]
 
     @classmethod
-    def build_from_json(cls:'BaseGameTree', edge_to_json: str, embedding_function: Embeddings=None) -> 'BaseGameTree':
+    def build_from_json(cls:'BaseGameTree', edge_to_json: str, embedding_function: 'Embeddings'=None, compact: bool=False, dtype: str="float32") -> 'BaseGameTree':
         """
         Rebuild tree from JSON file. May cause unexpected behaviour if the JSON file was built using derived GameNode and EdgeEmbedding classes.
         Params:
             - edge_to_json: The string that signifies the edge to the jsonified tree
             - embedding_function: Takes input and returns embedding. If not provided, the Tree is marked as Final (cannot be changed)
+            - compact: see constructor
+            - dtype: see constructor
         """
         tree_dict = {}
         with open(edge_to_json, "r") as f:
             tree_dict = json.load(f)
 
-        tree = cls(tree_dict["name"], embedding_function)
+        tree = cls(tree_dict["name"], embedding_function, compact, dtype)
         for (template_name, template_dict) in tree_dict["embedding_template_dict"].items():
             tree.embedding_template_dict[template_name] = EdgeEmbedding.from_dict(template_dict, embedding_function)
 
         for (event_id, event_dict) in tree_dict["event_dict"].items():
             tree.node_dict[event_id] = GameNode.from_dict(event_dict)
 
+        # Embeddings shared by several edges are stored once, edges refer to them by index
+        shared = [read_only(numpy.asarray(embedding, dtype=numpy.float32)) for embedding in tree_dict.get("shared_embeddings", [])]
+
         for (edge_string, embedding_dict) in tree_dict["edge_dict"].items():
-            edge = edge_string.split(" ") # Split by " "
-            tree.edge_dict[edge] = EdgeEmbedding.from_dict(embedding_dict, embedding_function)
-        
+            edge = tuple(edge_string.split(" ")) # Split by " "
+            if "shared" in embedding_dict:
+                tree.edge_dict[edge] = EdgeEmbedding(embedding_dict["name"], embedding_function, shared[embedding_dict["shared"]], embedding_dict["weight"])
+            else:
+                tree.edge_dict[edge] = EdgeEmbedding.from_dict(embedding_dict, embedding_function)
+
+        tree._dirty_edges = set(tree.edge_dict) # Nothing was written to the database yet
         return tree
 
     def to_dict(self) -> dict:
-        """Return the instance in dictionary form to be saved to json"""
+        """
+        Return the instance in dictionary form to be saved to json.
+        Embeddings shared by several edges (untuned copies of a template) are saved once in "shared_embeddings",
+        and these edges are saved as {'name': ..., 'shared': index, 'weight': ...}.
+        """
+        edges = list(self.edge_dict.items())
+        shared = shared_buffers([edge.get_embedding() for (_, edge) in edges])
+        shared_embeddings = [None] * len(shared)
+        edge_dict = {}
+        for ((start_id, end_id), edge) in edges:
+            embedding = edge.get_embedding()
+            index = None if embedding is None else shared.get(buffer_key(embedding))
+            if index is None:
+                edge_dict[start_id+" "+end_id] = edge.to_dict()
+            else:
+                if shared_embeddings[index] is None:
+                    shared_embeddings[index] = embedding.tolist()
+                edge_dict[start_id+" "+end_id] = {'name': edge.name, 'shared': index, 'weight': edge.weight}
+
         return {
             "name": self.name,
             "embedding_template_dict": {template_id: template.to_dict() for (template_id, template) in self.embedding_template_dict.items()}, # Kinda optional here
             "event_dict": {event_id: event.to_dict() for (event_id, event) in self.node_dict.items()},
-            "edge_dict": {edge[0]+" "+edge[1]: embedding.to_dict() for (edge, embedding) in self.edge_dict.items()}
+            "shared_embeddings": shared_embeddings,
+            "edge_dict": edge_dict
         }
 
     def to_json(self, edge_to_json: str) -> None:
@@ -323,29 +718,212 @@ class BaseGameTree:
         with open(edge_to_json, "w") as f:
             json.dump(self.to_dict(), f, indent=4)
 
-    def write_db(self):
-        """Write current tree to a ChromaDB collection."""
-        # Only need to add the following nodes to chroma, as the starting state does not need to be defined
+    def to_binary(self, path: str, dtype: str=None) -> None:
+        """
+        Saves current Tree configuration in binary form, much smaller and faster to load than to_json() for large trees.
+        Writes path + ".meta.json", compact metadata of nodes, templates and edges, and path + ".npy", every embedding as rows of one matrix.
+        Embeddings shared by several edges or templates are written once and these all refer to the same row.
+        Params:
+            - path: the path of the files, without extension
+            - dtype: "float32", "float16" or "int8" (see quantize.py), defaulted to the tree's dtype.
+              int8 files also have path + ".scales.npy", the scale of every row.
+        """
+        dtype = check_dtype(dtype or self.dtype)
+        templates = list(self.embedding_template_dict.values())
+        edges = list(self.edge_dict.items())
+        embeddings = [template.get_embedding() for template in templates] + [edge.get_embedding() for (_, edge) in edges]
+        shared = shared_buffers(embeddings)
+        unique = sum(1 for embedding in embeddings if embedding is not None and buffer_key(embedding) not in shared) + len(shared)
+        dimension = next((len(embedding) for embedding in embeddings if embedding is not None), 0)
+
+        # Rows are written straight into the file, no second copy of all embeddings is made
+        matrix = numpy.lib.format.open_memmap(path + ".npy", mode="w+", dtype=dtype, shape=(unique, dimension))
+        scales = numpy.ones(unique, dtype=numpy.float32)
+        rows = [] # Row of each embedding, -1 if it has none
+        shared_rows = {} # buffer key - row
+        written = 0
+        for embedding in embeddings:
+            if embedding is None:
+                rows.append(-1)
+                continue
+            key = buffer_key(embedding)
+            if key in shared_rows:
+                rows.append(shared_rows[key])
+                continue
+            if key in shared:
+                shared_rows[key] = written
+            (matrix[written], scale) = quantize(embedding, dtype)
+            if scale is not None:
+                scales[written] = scale
+            rows.append(written)
+            written += 1
+        matrix.flush()
+        del matrix
+        if dtype == "int8":
+            numpy.save(path + ".scales.npy", scales)
+
+        template_rows, edge_rows = rows[:len(templates)], rows[len(templates):]
+        metadata = {
+            "name": self.name,
+            "dtype": dtype,
+            "templates": [[template.name, template.weight, row] for (template, row) in zip(templates, template_rows)],
+            "nodes": [node.to_dict() for node in self.node_dict.values()],
+            "edges": [[start_id, end_id, edge.name, edge.weight, row] for ((start_id, end_id), edge), row in zip(edges, edge_rows)]
+        }
+        with open(path + ".meta.json", "w") as f:
+            json.dump(metadata, f, separators=(",", ":"))
+
+    @classmethod
+    def build_from_binary(cls:'BaseGameTree', path: str, embedding_function: 'Embeddings'=None, mmap: bool=True, compact: bool=False, dtype: str="float32") -> 'BaseGameTree':
+        """
+        Rebuild tree from the files written by to_binary(). May cause unexpected behaviour if they were built using derived GameNode and EdgeEmbedding classes.
+        Params:
+            - path: the path of both files, without extension
+            - embedding_function: Takes input and returns embedding. If not provided, the Tree is marked as Final (cannot be changed)
+            - mmap: open the embedding matrix read-only with mmap_mode='r', so embeddings are only read from disk on first access.
+              Tuning an edge replaces its embedding with an in-memory copy. If False, the whole matrix is read up front.
+            - compact: see constructor. Embeddings are copied into the compact table, so mmap only saves the parsing.
+            - dtype: see constructor. The dtype of the files is read from their metadata, quantized rows are converted back to float32 when loaded.
+        """
+        with open(path + ".meta.json", "r") as f:
+            metadata = json.load(f)
+        matrix = numpy.load(path + ".npy", mmap_mode="r" if mmap else None)
+        file_dtype = metadata.get("dtype", "float32")
+        scales = numpy.load(path + ".scales.npy") if file_dtype == "int8" else None
+
+        # Rows used several times are loaded once and shared, like the untuned template copies they were saved from
+        uses = {}
+        for row in itertools.chain((template[2] for template in metadata["templates"]), (edge[4] for edge in metadata["edges"])):
+            uses[row] = uses.get(row, 0) + 1
+        def load(row: int) -> numpy.ndarray:
+            if file_dtype == "float32":
+                return matrix[row]
+            return dequantize(matrix[row], None if scales is None else scales[row])
+
+        shared = {row: read_only(numpy.array(load(row))) for (row, count) in uses.items() if count > 1 and row >= 0}
+
+        def embedding(row: int) -> numpy.ndarray:
+            return None if row < 0 else shared[row] if row in shared else load(row)
+
+        tree = cls(metadata["name"], embedding_function, compact, dtype)
+        for (name, weight, row) in metadata["templates"]:
+            tree.embedding_template_dict[name] = EdgeEmbedding(name, embedding_function, embedding(row), weight)
+
+        for node_dict in metadata["nodes"]:
+            tree.node_dict[node_dict["id"]] = GameNode.from_dict(node_dict)
+
+        for (start_id, end_id, name, weight, row) in metadata["edges"]:
+            tree.edge_dict[(start_id, end_id)] = EdgeEmbedding(name, embedding_function, embedding(row), weight)
+
+        tree._dirty_edges = set(tree.edge_dict) # Nothing was written to the database yet
+        return tree
+
+    @staticmethod
+    def _db_id(edge_id: tuple) -> str:
+        """Database id of an edge, same format as the edge keys of to_dict()"""
+        return edge_id[0] + " " + edge_id[1]
+
+    def _write_chunk(self, edge_ids: list) -> None:
+        """Upsert a chunk of edges into the ChromaDB collection"""
         embeddings = []
         documents = []
         metadatas=[]
         ids=[]
 
-        for (edge, embedding) in self.edge_dict.items():
-            target_node_id = edge[1]
-            target_node = self.node_dict[target_node_id]
+        for edge_id in edge_ids:
+            # Only need to add the following nodes to chroma, as the starting state does not need to be defined
+            target_node = self.node_dict[edge_id[1]]
 
-            embeddings.append(embedding.get_embedding())
+            embeddings.append(self.edge_dict[edge_id].get_embedding().tolist())
             documents.append(target_node.context)
-            ids.append(target_node_id)
+            ids.append(self._db_id(edge_id))
             metadatas.append(target_node.metadata)
 
-        self.vectorstore._collection.add(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+        with metrics.span("tree.write_chunk"):
+            self.vectorstore._collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
 
-    def get_retriever(self, **kwargs) -> BaseRetriever:
+    def write_db(self, chunk_size: int=1000, max_workers: int=1) -> dict:
+        """
+        Sync the ChromaDB collection with the tree. Only edges added, tuned or removed since the last sync are written,
+        so a sync with no change costs O(1).
+        Params:
+            - chunk_size: maximum number of edges per request to the database
+            - max_workers: number of threads sending chunks. 1 sends them one after another. Only use more with a client/server Chroma, the in-process client is not thread safe.
+
+        Returns: a report of the form {'upserted': ..., 'deleted': ..., 'chunks': ..., 'seconds': ...}, also kept in last_sync
+        """
+        start = time.perf_counter()
+        upserts = [edge_id for edge_id in self._dirty_edges if self.edge_dict[edge_id].get_embedding() is not None]
+        deletes = [self._db_id(edge_id) for edge_id in self._removed_edges]
+        chunks = [upserts[i:i + chunk_size] for i in range(0, len(upserts), chunk_size)]
+
+        if max_workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers) as pool:
+                list(pool.map(self._write_chunk, chunks))
+        else:
+            for chunk in chunks:
+                self._write_chunk(chunk)
+
+        for i in range(0, len(deletes), chunk_size):
+            self.vectorstore._collection.delete(ids=deletes[i:i + chunk_size])
+
+        # Only cleared once written, a failed sync is retried by the next one
+        self._dirty_edges.clear()
+        self._removed_edges.clear()
+        self.last_sync = {
+            "upserted": len(upserts),
+            "deleted": len(deletes),
+            "chunks": len(chunks) + (len(deletes) + chunk_size - 1) // chunk_size,
+            "seconds": time.perf_counter() - start
+        }
+        metrics.value("tree.write_db_edges", len(upserts) + len(deletes))
+        return self.last_sync
+
+    def get_retriever(self, local: bool=False, **kwargs) -> 'BaseRetriever':
         """
         Some possible arguments:
+            - local: search edge_dict in-process with exact KNN instead of going through the vectorstore. No write_db() needed.
+            - ann: with local, search approximately with the tree's IVFIndex, see ann_index()
+            - nprobe: number of clusters scored per query, only for ann retrievers
             - search_type
             - search_kwargs: {"k": Number of returned results}
+            - metric: "cosine" or "l2", only for local retrievers
         """
+        if local and kwargs.get("ann"):
+            from lifelike.StateManager.ann import ANNRetriever
+            self.ann_index(metric=kwargs.get("metric", "cosine"))
+            return ANNRetriever(self, kwargs.get("search_kwargs", {}).get("k", 4), kwargs.get("nprobe"))
+        if local:
+            from lifelike.StateManager.retriever import EdgeRetriever
+            return EdgeRetriever(self, kwargs.get("search_kwargs", {}).get("k", 4), kwargs.get("metric", "cosine"))
         return self.vectorstore.as_retriever(**kwargs) # Adding some options
+
+    def get_node_retriever(self, node_id: str=None, k: int=4, metric: str="cosine") -> 'GameNodeRetriever':
+        """
+        In-process retriever that only scores the edges going out of node_id, or the wildcard '_' edges if there are none.
+        Params:
+            - node_id: id of the current node
+            - k: Number of returned results
+            - metric: "cosine" or "l2"
+        """
+        from lifelike.StateManager.retriever import GameNodeRetriever
+        return GameNodeRetriever(self, node_id, k, metric)
+
+
+def convert_json_to_binary(json_path: str, binary_path: str, dtype: str="float32") -> None:
+    """
+    Convert a tree saved with to_json() to the binary format of to_binary().
+    Params:
+        - json_path: path of the json file
+        - binary_path: path of the binary files, without extension
+        - dtype: "float32", "float16" or "int8", see to_binary()
+    """
+    BaseGameTree.build_from_json(json_path).to_binary(binary_path, dtype)
+
+
+def __getattr__(name: str):
+    # The retrievers moved to retriever.py, they are loaded with langchain on first access
+    if name in ("EdgeRetriever", "GameNodeRetriever"):
+        from lifelike.StateManager import retriever
+        return getattr(retriever, name)
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
@@ -0,0 +1,348 @@
+"""
+Compact storage for large game trees, used by BaseGameTree(name, embedding_function, compact=True).
+Edges are kept in a columnar table of numpy arrays instead of one EdgeEmbedding object per edge.
+Node ids are mapped to integers, and edge_dict style access keeps working through lightweight EdgeView objects.
+"""
+from collections.abc import MutableMapping
+
+import numpy
+
+from lifelike.StateManager.base_game_tree import EdgeEmbedding, buffer_key, read_only
+from lifelike.StateManager.quantize import check_dtype, dequantize, quantize
+
+class IdTable:
+    """Maps string ids to consecutive integers and back. The strings are stored once."""
+    __slots__ = ("ids", "index")
+
+    def __init__(self) -> None:
+        self.ids = [] # integer - id
+        self.index = {} # id - integer
+
+    def intern(self, id: str) -> int:
+        """Integer of an id, assigning the next one if the id is new"""
+        number = self.index.get(id)
+        if number is None:
+            number = len(self.ids)
+            self.ids.append(id)
+            self.index[id] = number
+        return number
+
+    def get(self, id: str) -> int:
+        """Integer of an id, -1 if the id is unknown"""
+        return self.index.get(id, -1)
+
+    def __getitem__(self, number: int) -> str:
+        return self.ids[number]
+
+
+class CompactEdgeDict(MutableMapping):
+    """
+    Drop-in replacement for edge_dict storing edges column by column: start index, end index, weight, final flag and embedding row.
+    Embeddings are rows of a single float32, float16 or int8 matrix. Keys are (start_id, end_id) tuples like edge_dict, values are EdgeView.
+    Edges copied from the same template share a row until they are tuned.
+    All edges share the tree's embedding function, edges stored without one are marked Final.
+    """
+    def __init__(self, embedding_function=None, capacity: int=1024, dtype: str="float32") -> None:
+        """
+        Constructor.
+        Params:
+            - embedding_function: embedding function of every tunable edge, usually the tree's
+            - capacity: number of edges allocated up front. Grows by doubling.
+            - dtype: storage of the embedding matrix, "float32", "float16" or "int8" (see quantize.py).
+              Quantized embeddings are converted back to float32 copies when read.
+        """
+        self.embed = embedding_function
+        self.dtype = check_dtype(dtype)
+        self.ids = IdTable()
+        self.size = 0
+
+        # Edge codes (start integer << 32 | end integer) are looked up in a sorted array, which costs 12 bytes per edge
+        # instead of a dict entry and two int objects. Edges inserted or moved since the last merge are kept in recent.
+        # Entries of the sorted array can be stale, so a match is only trusted if the columns agree.
+        self.sorted_codes = numpy.zeros(0, dtype=numpy.int64)
+        self.sorted_positions = numpy.zeros(0, dtype=numpy.int32)
+        self.recent = {} # code - position
+
+        self.start = numpy.zeros(capacity, dtype=numpy.int32)
+        self.end = numpy.zeros(capacity, dtype=numpy.int32)
+        self.weight = numpy.zeros(capacity, dtype=numpy.int64)
+        self.final = numpy.zeros(capacity, dtype=numpy.bool_)
+        self.row = numpy.full(capacity, -1, dtype=numpy.int32)
+        self.names = [] # Usually the end id, which is then stored once by IdTable
+
+        self.matrix = None # (rows, dimension) embeddings, allocated when the first embedding is stored
+        self.refs = None # (rows,) number of edges using each row
+        self.scales = None # (rows,) int8 scales
+        self.decoded = {} # row - read-only float32 embedding of quantized rows used by several edges, so that they stay shared when read
+        self.totals = {} # code - float32 running sum of the edges tuned since loading, only for quantized dtypes, see EdgeView
+        self.used_rows = 0
+        self.free_rows = []
+        self.shared_rows = {} # buffer key of a shared embedding - row
+        self.row_keys = {} # row - buffer key, for rows in shared_rows
+
+    def _code(self, key: tuple) -> int:
+        """Integer key of an existing (start_id, end_id) pair, -1 if one of the ids is unknown"""
+        start, end = self.ids.get(key[0]), self.ids.get(key[1])
+        if start < 0 or end < 0:
+            return -1
+        return start << 32 | end
+
+    def _code_at(self, position: int) -> int:
+        """Code of the edge stored at position"""
+        return int(self.start[position]) << 32 | int(self.end[position])
+
+    def _find(self, code: int) -> int:
+        """Position of the edge with this code, None if it does not exist"""
+        position = self.recent.get(code)
+        if position is not None or code < 0:
+            return position
+        if self.sorted_codes.shape[0] == 0:
+            return None
+        i = int(self.sorted_codes.searchsorted(code))
+        if i < self.sorted_codes.shape[0] and self.sorted_codes[i] == code:
+            position = int(self.sorted_positions[i])
+            if position < self.size and self._code_at(position) == code:
+                return position
+        return None
+
+    def _merge(self) -> None:
+        """Rebuild the sorted array from the columns and empty recent"""
+        codes = self.start[:self.size].astype(numpy.int64) << 32 | self.end[:self.size]
+        order = numpy.argsort(codes)
+        self.sorted_codes = codes[order]
+        self.sorted_positions = order.astype(numpy.int32)
+        self.recent.clear()
+
+    def position(self, key: tuple) -> int:
+        """Position of an edge in the columns. Raises KeyError if the edge does not exist."""
+        position = self._find(self._code(key))
+        if position is None:
+            raise KeyError(key)
+        return position
+
+    def _grow(self) -> None:
+        """Double the allocated columns"""
+        capacity = self.start.shape[0] * 2
+        for column in ("start", "end", "weight", "final", "row"):
+            old = getattr(self, column)
+            new = numpy.full(capacity, -1 if column == "row" else 0, dtype=old.dtype)
+            new[:old.shape[0]] = old
+            setattr(self, column, new)
+
+    def _allocate_row(self, dimension: int) -> int:
+        """Row of the embedding matrix for a new embedding"""
+        if self.free_rows:
+            return self.free_rows.pop()
+        if self.matrix is None:
+            self.matrix = numpy.zeros((64, dimension), dtype=self.dtype)
+            self.refs = numpy.zeros(64, dtype=numpy.int32)
+            self.scales = numpy.ones(64, dtype=numpy.float32)
+        elif self.used_rows == self.matrix.shape[0]:
+            matrix = numpy.zeros((self.matrix.shape[0] * 2, self.matrix.shape[1]), dtype=self.dtype)
+            matrix[:self.used_rows] = self.matrix
+            refs = numpy.zeros(matrix.shape[0], dtype=numpy.int32)
+            refs[:self.used_rows] = self.refs
+            scales = numpy.ones(matrix.shape[0], dtype=numpy.float32)
+            scales[:self.used_rows] = self.scales[:self.used_rows]
+            self.matrix, self.refs, self.scales = matrix, refs, scales
+        self.used_rows += 1
+        return self.used_rows - 1
+
+    def _release(self, row: int) -> None:
+        """Drop one use of a row, freeing it after the last one"""
+        self.refs[row] -= 1
+        if self.refs[row] == 0:
+            self.free_rows.append(row)
+            self.decoded.pop(row, None)
+            key = self.row_keys.pop(row, None)
+            if key is not None and self.shared_rows.get(key) == row:
+                del self.shared_rows[key]
+
+    @staticmethod
+    def _shareable(embedding: numpy.ndarray) -> bool:
+        """Whether an embedding is shared between edges, see EdgeEmbedding.copy(). Rows of a memory-mapped file are read-only too but never shared."""
+        return not embedding.flags.writeable and not isinstance(embedding, numpy.memmap) and not isinstance(embedding.base, numpy.memmap)
+
+    def get_embedding(self, position: int) -> numpy.ndarray:
+        """Embedding of the edge at position, a view of the float32 matrix or a float32 copy of a quantized one. None if it has none."""
+        row = self.row[position]
+        if row < 0:
+            return None
+        if self.dtype == "float32":
+            return self.matrix[row]
+        if row in self.decoded:
+            return self.decoded[row]
+        embedding = dequantize(self.matrix[row], self.scales[row] if self.dtype == "int8" else None)
+        if self.refs[row] > 1:
+            self.decoded[row] = read_only(embedding)
+        return embedding
+
+    def set_embedding(self, position: int, embedding: numpy.ndarray) -> None:
+        """
+        Store the embedding of the edge at position, None to remove it.
+        Shared embeddings are stored once, edges using them point to the same row until their embedding is replaced.
+        """
+        row = int(self.row[position])
+        if row >= 0:
+            self._release(row)
+            self.row[position] = -1
+        if embedding is None:
+            return
+
+        embedding = numpy.asarray(embedding, dtype=numpy.float32)
+        key = buffer_key(embedding) if self._shareable(embedding) else None
+        row = self.shared_rows.get(key, -1)
+        (codes, scale) = quantize(embedding, self.dtype)
+        # A buffer key can be reused by a new array once the shared one is freed, so the row must also match
+        if row < 0 or not numpy.array_equal(self.matrix[row], codes):
+            row = self._allocate_row(len(embedding))
+            self.matrix[row] = codes
+            if scale is not None:
+                self.scales[row] = scale
+            if key is not None:
+                self.shared_rows[key] = row
+                self.row_keys[row] = key
+        self.refs[row] += 1
+        self.row[position] = row
+
+    def __setitem__(self, key: tuple, edge: EdgeEmbedding) -> None:
+        start, end = self.ids.intern(key[0]), self.ids.intern(key[1])
+        code = start << 32 | end
+        position = self._find(code)
+        if position is None:
+            position = self.size
+            if position == self.start.shape[0]:
+                self._grow()
+            self.recent[code] = position
+            self.names.append(edge.name)
+            self.size += 1
+        else:
+            self.names[position] = edge.name
+
+        self.start[position] = start
+        self.end[position] = end
+        self.weight[position] = edge.weight
+        self.final[position] = edge._final
+        self.set_embedding(position, edge.get_embedding())
+        self.totals.pop(code, None)
+        if len(self.recent) > max(4096, self.size >> 3):
+            self._merge()
+
+    def __getitem__(self, key: tuple) -> 'EdgeView':
+        code = self._code(key)
+        position = self._find(code)
+        if position is None:
+            raise KeyError(key)
+        return EdgeView(self, code, position)
+
+    def __delitem__(self, key: tuple) -> None:
+        code = self._code(key)
+        position = self._find(code)
+        if position is None:
+            raise KeyError(key)
+        self.set_embedding(position, None)
+        self.recent.pop(code, None)
+        self.totals.pop(code, None)
+
+        # Move the last edge into the hole to keep the columns contiguous
+        last = self.size - 1
+        if position != last:
+            for column in (self.start, self.end, self.weight, self.final, self.row):
+                column[position] = column[last]
+            self.names[position] = self.names[last]
+            self.recent[self._code_at(position)] = position
+        self.row[last] = -1
+        self.names.pop()
+        self.size -= 1
+
+    def __contains__(self, key) -> bool:
+        return isinstance(key, tuple) and len(key) == 2 and self._find(self._code(key)) is not None
+
+    def __iter__(self):
+        ids = self.ids.ids
+        for (start, end) in zip(self.start[:self.size].tolist(), self.end[:self.size].tolist()):
+            yield (ids[start], ids[end])
+
+    def __len__(self) -> int:
+        return self.size
+
+    def items(self):
+        """(key, EdgeView) pairs, without looking every key up again"""
+        ids = self.ids.ids
+        for (position, (start, end)) in enumerate(zip(self.start[:self.size].tolist(), self.end[:self.size].tolist())):
+            yield ((ids[start], ids[end]), EdgeView(self, start << 32 | end, position))
+
+    def values(self):
+        """EdgeView of every edge"""
+        for (_, edge) in self.items():
+            yield edge
+
+
+class EdgeView(EdgeEmbedding):
+    """EdgeEmbedding backed by a row of a CompactEdgeDict. Reads and writes go straight to the columns."""
+    __slots__ = ("_table", "_code", "_cached_position")
+
+    def __init__(self, table: CompactEdgeDict, code: int, position: int) -> None:
+        self._table = table
+        self._code = code
+        self._cached_position = position
+
+    @property
+    def _position(self) -> int:
+        """Position of the edge, looked up again if a removal moved it"""
+        position = self._cached_position
+        if position >= self._table.size or self._table._code_at(position) != self._code:
+            position = self._table._find(self._code)
+            if position is None:
+                raise KeyError("Edge was removed from the tree")
+            self._cached_position = position
+        return position
+
+    @property
+    def name(self) -> str:
+        return self._table.names[self._position]
+
+    @property
+    def embed(self):
+        return None if self._final else self._table.embed
+
+    @property
+    def _final(self) -> bool:
+        return bool(self._table.final[self._position])
+
+    @property
+    def embedding(self) -> numpy.ndarray:
+        return self._table.get_embedding(self._position)
+
+    @embedding.setter
+    def embedding(self, embedding: numpy.ndarray) -> None:
+        self._table.set_embedding(self._position, embedding)
+
+    def _running_sum(self, dimension: int) -> numpy.ndarray:
+        """
+        Quantized rows move by less than their rounding step once an edge has many responses, so tuning would stall on them.
+        Tuned edges of quantized tables keep a float32 running sum instead, float32 tables rebuild it from the row like EdgeEmbedding.
+        """
+        total = self._table.totals.get(self._code)
+        if total is None:
+            return super()._running_sum(dimension)
+        return total.astype(numpy.float64)
+
+    def _set_running_sum(self, total: numpy.ndarray) -> None:
+        super()._set_running_sum(total)
+        if self._table.dtype != "float32":
+            self._table.totals[self._code] = total.astype(numpy.float32)
+
+    @property
+    def weight(self) -> int:
+        return int(self._table.weight[self._position])
+
+    @weight.setter
+    def weight(self, weight: int) -> None:
+        self._table.weight[self._position] = weight
+
+    def copy(self, new_name: str) -> EdgeEmbedding:
+        """Return a copy of this edge as an EdgeEmbedding. Rows can be reused by other edges, so the embedding is copied out of the table."""
+        embedding = self.embedding
+        embedding = None if embedding is None else read_only(embedding.copy())
+        return EdgeEmbedding(new_name, self.embed, embedding, self.weight)
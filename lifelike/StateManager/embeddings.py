@@ -0,0 +1,213 @@
+"""
+Embeddings wrappers that cut down on calls to the underlying embedding model.
+Wrappers implement the Embeddings interface, so they can be given to BaseGameTree and its children directly:
+    tree = BaseGameTree(name, CachedEmbeddings(embedding_function, "my-model", path="embeddings.sqlite"))
+"""
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy
+
+from langchain.embeddings.base import Embeddings
+
+from lifelike import metrics
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed embedding cache keyed by (model id, text hash).
+    Keeps an in-memory LRU and optionally a persistent SQLite store. Only misses are sent to the wrapped embeddings, as one batch.
+    """
+    def __init__(self, embeddings: Embeddings, model_id: str=None, max_size: int=100000, path: str=None) -> None:
+        """
+        Constructor.
+        Params:
+            - embeddings: the wrapped Embeddings instance
+            - model_id: identifies the embedding model, so that stores can be shared between models. Defaulted to the class and model name of embeddings.
+            - max_size: maximum number of embeddings kept in memory
+            - path: path to a SQLite file used as persistent store. If not provided, embeddings are only cached in memory.
+        """
+        self.embeddings = embeddings
+        if model_id is None:
+            model_id = "{}:{}".format(type(embeddings).__name__, getattr(embeddings, "model", getattr(embeddings, "model_name", "")))
+        self.model_id = model_id
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict() # text hash - float32 embedding
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (model TEXT, hash TEXT, embedding BLOB, PRIMARY KEY (model, hash))")
+            self._db.commit()
+
+    @staticmethod
+    def _hash(text: str, kind: str) -> str:
+        """Content address of a text. Documents and queries are kept apart as some models embed them differently."""
+        return hashlib.sha256((kind + "\0" + text).encode("utf-8")).hexdigest()
+
+    def _lookup(self, hashes: list) -> dict:
+        """Returns the cached embeddings among hashes, reading the persistent store for memory misses"""
+        found = {}
+        with self._lock:
+            for text_hash in hashes:
+                if text_hash in self._memory:
+                    self._memory.move_to_end(text_hash)
+                    found[text_hash] = self._memory[text_hash]
+
+            missing = [text_hash for text_hash in hashes if text_hash not in found]
+            if self._db is not None:
+                for start in range(0, len(missing), 500): # Stay below SQLite's variable limit
+                    chunk = missing[start:start + 500]
+                    rows = self._db.execute(
+                        "SELECT hash, embedding FROM embeddings WHERE model = ? AND hash IN ({})".format(",".join("?" * len(chunk))),
+                        [self.model_id] + chunk
+                    ).fetchall()
+                    for (text_hash, blob) in rows:
+                        found[text_hash] = numpy.frombuffer(blob, dtype=numpy.float32)
+                        self._remember(text_hash, found[text_hash])
+        return found
+
+    def _store(self, hashes: list, embeddings: list) -> None:
+        """Adds new embeddings to every cache tier"""
+        with self._lock:
+            for (text_hash, embedding) in zip(hashes, embeddings):
+                self._remember(text_hash, embedding)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                    [(self.model_id, text_hash, embedding.tobytes()) for (text_hash, embedding) in zip(hashes, embeddings)]
+                )
+                self._db.commit()
+
+    def _remember(self, text_hash: str, embedding: numpy.ndarray) -> None:
+        """Adds to the in-memory LRU, evicting the least recently used embeddings"""
+        self._memory[text_hash] = embedding
+        self._memory.move_to_end(text_hash)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _embed(self, texts: list, kind: str) -> list:
+        """Embeds texts, sending unique misses to the wrapped embeddings in one batch"""
+        hashes = [self._hash(text, kind) for text in texts]
+        found = self._lookup(hashes)
+
+        missing = {} # text hash - text, in order of first appearance
+        for (text_hash, text) in zip(hashes, texts):
+            if text_hash not in found:
+                missing.setdefault(text_hash, text)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        metrics.count("embedding_cache.hits", len(texts) - len(missing))
+        metrics.count("embedding_cache.misses", len(missing))
+
+        if missing:
+            if kind == "query":
+                new_embeddings = [self.embeddings.embed_query(text) for text in missing.values()]
+            else:
+                new_embeddings = self.embeddings.embed_documents(list(missing.values()))
+            new_embeddings = [numpy.asarray(embedding, dtype=numpy.float32) for embedding in new_embeddings]
+            self._store(list(missing.keys()), new_embeddings)
+            found.update(zip(missing.keys(), new_embeddings))
+
+        return [found[text_hash].tolist() for text_hash in hashes]
+
+    def embed_documents(self, texts: list) -> list:
+        """Embed search docs, only embedding texts that are not cached yet"""
+        return self._embed(texts, "document")
+
+    def embed_query(self, text: str) -> list:
+        """Embed query text, only calling the wrapped embeddings if it is not cached yet"""
+        return self._embed([text], "query")[0]
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters and the number of embeddings in memory"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._memory)}
+
+
+class CoalescingEmbeddings(Embeddings):
+    """
+    Micro-batching wrapper: embed_documents() calls made concurrently from several threads within a short window are sent to the wrapped embeddings
+    as one batch, and each caller gets back its own embeddings. Useful when many sessions or workers tune edges at the same time.
+    Gives the same embeddings as calling the wrapped embeddings directly, as long as they embed each text independently of the rest of the batch.
+    Queries are not batched, they are passed through.
+    """
+    def __init__(self, embeddings: Embeddings, window: float=0.005, max_batch: int=2048) -> None:
+        """
+        Constructor.
+        Params:
+            - embeddings: the wrapped Embeddings instance
+            - window: seconds the first request of a batch waits for others to join
+            - max_batch: number of texts that sends a batch before the end of the window
+        """
+        self.embeddings = embeddings
+        self.window = window
+        self.max_batch = max_batch
+        self.requests = 0
+        self.calls = 0
+
+        self._lock = threading.Lock()
+        self._pending = [] # (texts, request) waiting for the next batch
+        self._pending_texts = 0
+        self._full = threading.Event() # Set when the pending batch reaches max_batch
+        self._collecting = False # Whether a thread is waiting to send the pending batch
+
+    def _send(self, batch: list) -> None:
+        """Embeds a batch of requests in one call and hands each request its slice of the results"""
+        texts = [text for (request_texts, _) in batch for text in request_texts]
+        try:
+            embeddings = self.embeddings.embed_documents(texts)
+            error = None
+        except Exception as exception:
+            embeddings = None
+            error = exception
+
+        start = 0
+        for (request_texts, request) in batch:
+            if error is None:
+                request["result"] = list(embeddings[start:start + len(request_texts)])
+            request["error"] = error
+            start += len(request_texts)
+            request["done"].set()
+
+    def embed_documents(self, texts: list) -> list:
+        """Embed search docs, in one batch with the concurrent calls made within the window"""
+        if not texts:
+            return []
+
+        request = {"done": threading.Event(), "result": None, "error": None}
+        with self._lock:
+            self._pending.append((list(texts), request))
+            self._pending_texts += len(texts)
+            self.requests += 1
+            leader = not self._collecting
+            self._collecting = True
+            if self._pending_texts >= self.max_batch:
+                self._full.set()
+
+        if leader: # The first request of a batch waits for the window, then sends everything pending
+            self._full.wait(self.window)
+            with self._lock:
+                batch = self._pending
+                self._pending = []
+                self._pending_texts = 0
+                self._collecting = False
+                self._full.clear()
+                self.calls += 1
+            self._send(batch)
+
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["result"]
+
+    def embed_query(self, text: str) -> list:
+        """Embed query text with the wrapped embeddings"""
+        return self.embeddings.embed_query(text)
+
+    def stats(self) -> dict:
+        """Returns the number of embed_documents() requests and of calls made to the wrapped embeddings"""
+        return {"requests": self.requests, "calls": self.calls}
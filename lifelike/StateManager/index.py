@@ -0,0 +1,189 @@
+"""
+Exact in-process index over the edge embeddings of a game tree, used by the local retrievers and by sessions.
+All edge embeddings are kept in one contiguous matrix, so a query is a single matrix-vector product. Only needs numpy.
+"""
+import numpy
+
+from lifelike.StateManager.quantize import check_dtype, dequantize, quantize
+
+class EdgeIndex:
+    """
+    Contiguous matrix of edge embeddings with precomputed norms, for exact cosine or L2 top-k search.
+    The matrix can be stored as float16 or int8 (see quantize.py). Candidates are then re-scored in full precision.
+    """
+    def __init__(self, capacity: int=1024, dtype: str="float32", lookup=None, rescore: int=4) -> None:
+        """
+        Constructor. The dimension is taken from the first embedding added.
+        Params:
+            - capacity: number of rows allocated up front. Grows by doubling.
+            - dtype: storage of the matrix, "float32", "float16" or "int8"
+            - lookup: for quantized matrices, function returning the full precision embedding of an edge key, used to re-score
+              the top rescore * k candidates. If not provided, quantized scores are returned as they are.
+            - rescore: number of candidates re-scored per result
+        """
+        self.capacity = capacity
+        self.dtype = check_dtype(dtype)
+        self.lookup = lookup
+        self.rescore = rescore
+        self.keys = [] # row - edge key
+        self.rows = {} # edge key - row
+        self.matrix = None # (capacity, dimension), only the first len(keys) rows are used
+        self.norms = None # (capacity,) norms of the full precision embeddings
+        self.scales = None # (capacity,) int8 scales
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key) -> bool:
+        return key in self.rows
+
+    def upsert(self, key, embedding: numpy.ndarray) -> None:
+        """
+        Add or replace the embedding of an edge.
+        Params:
+            - key: edge identifier, usually the (start_id, end_id) tuple of edge_dict
+            - embedding: the edge embedding
+        """
+        embedding = numpy.asarray(embedding, dtype=numpy.float32)
+        if self.matrix is None:
+            self.matrix = numpy.zeros((self.capacity, embedding.shape[0]), dtype=self.dtype)
+            self.norms = numpy.zeros(self.capacity, dtype=numpy.float32)
+            self.scales = numpy.ones(self.capacity, dtype=numpy.float32)
+
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == self.matrix.shape[0]:
+                self._grow()
+            self.keys.append(key)
+            self.rows[key] = row
+
+        (codes, scale) = quantize(embedding, self.dtype)
+        self.matrix[row] = codes
+        if scale is not None:
+            self.scales[row] = scale
+        self.norms[row] = numpy.linalg.norm(embedding)
+
+    def remove(self, key) -> bool:
+        """
+        Remove an edge. The last row is moved into its place to keep the matrix contiguous.
+        Params:
+            - key: edge identifier
+        """
+        row = self.rows.pop(key, None)
+        if row is None:
+            return False
+
+        last = len(self.keys) - 1
+        last_key = self.keys.pop()
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.norms[row] = self.norms[last]
+            self.scales[row] = self.scales[last]
+            self.keys[row] = last_key
+            self.rows[last_key] = row
+        return True
+
+    def _grow(self) -> None:
+        """Double the allocated rows"""
+        matrix = numpy.zeros((self.matrix.shape[0] * 2, self.matrix.shape[1]), dtype=self.matrix.dtype)
+        matrix[:self.matrix.shape[0]] = self.matrix
+        norms = numpy.zeros(matrix.shape[0], dtype=numpy.float32)
+        norms[:self.norms.shape[0]] = self.norms
+        scales = numpy.ones(matrix.shape[0], dtype=numpy.float32)
+        scales[:self.scales.shape[0]] = self.scales
+        self.matrix, self.norms, self.scales = matrix, norms, scales
+
+    def _dots(self, queries: numpy.ndarray, rows: numpy.ndarray=None) -> numpy.ndarray:
+        """Dot products of queries with the stored embeddings. Quantized rows are converted to float32 in chunks."""
+        if self.dtype == "float32":
+            return queries @ (self.matrix[:len(self.keys)] if rows is None else self.matrix[rows]).T
+
+        rows = numpy.arange(len(self.keys)) if rows is None else numpy.asarray(rows)
+        dots = numpy.empty((queries.shape[0], rows.shape[0]), dtype=numpy.float32)
+        for start in range(0, rows.shape[0], 65536):
+            chunk = rows[start:start + 65536]
+            block = dequantize(self.matrix[chunk], self.scales[chunk] if self.dtype == "int8" else None)
+            dots[:, start:start + chunk.shape[0]] = queries @ block.T
+        return dots
+
+    @staticmethod
+    def _metric(dots: numpy.ndarray, query_norms: numpy.ndarray, norms: numpy.ndarray, metric: str) -> numpy.ndarray:
+        """Scores from dot products and norms"""
+        if metric == "cosine":
+            return dots / numpy.maximum(numpy.outer(query_norms, norms), numpy.finfo(numpy.float32).tiny)
+        elif metric == "l2":
+            return 2 * dots - norms[None, :] ** 2 - query_norms[:, None] ** 2
+        raise ValueError("Unknown metric {}. Must be one of cosine, l2".format(metric))
+
+    def scores(self, queries: numpy.ndarray, metric: str="cosine", rows: numpy.ndarray=None) -> numpy.ndarray:
+        """
+        Similarity of every query to every edge, higher is closer. Approximate for quantized matrices.
+        Params:
+            - queries: (n, dimension) query embeddings
+            - metric: "cosine" for cosine similarity, "l2" for negated squared euclidean distance
+            - rows: restrict scoring to these rows. If not provided, every edge is scored.
+
+        Returns: (n, rows) scores
+        """
+        queries = numpy.asarray(queries, dtype=numpy.float32)
+        norms = self.norms[:len(self.keys)] if rows is None else self.norms[rows]
+        return self._metric(self._dots(queries, rows), numpy.linalg.norm(queries, axis=1), norms, metric)
+
+    def _rescore(self, query: numpy.ndarray, keys: list, metric: str) -> numpy.ndarray:
+        """Full precision scores of one query against the embeddings of keys, from lookup"""
+        embeddings = numpy.asarray([self.lookup(key) for key in keys], dtype=numpy.float32)
+        return self._metric((embeddings @ query)[None, :], numpy.linalg.norm(query)[None], numpy.linalg.norm(embeddings, axis=1), metric)[0]
+
+    def search(self, queries: numpy.ndarray, k: int=4, metric: str="cosine", rows: numpy.ndarray=None) -> list:
+        """
+        Exact top-k search.
+        Params:
+            - queries: a (dimension,) query embedding or a (n, dimension) batch of them
+            - k: number of results per query
+            - metric: "cosine" or "l2"
+            - rows: restrict the search to these rows. If not provided, every edge is searched.
+
+        Returns: for each query, a list of (edge key, score) sorted from closest. A single list for a single query.
+        """
+        queries = numpy.asarray(queries, dtype=numpy.float32)
+        single = queries.ndim == 1
+        if single:
+            queries = queries[None, :]
+
+        candidates = numpy.arange(len(self.keys)) if rows is None else numpy.asarray(rows)
+        if len(candidates) == 0 or k <= 0:
+            results = [[] for _ in queries]
+            return results[0] if single else results
+
+        scores = self.scores(queries, metric, None if rows is None else candidates)
+        rescore = self.dtype != "float32" and self.lookup is not None
+        top_k = min(k * self.rescore if rescore else k, len(candidates))
+        top = numpy.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        results = []
+        for (query, query_scores, query_top) in zip(queries, scores, top):
+            if rescore:
+                keys = [self.keys[candidates[i]] for i in query_top]
+                exact = self._rescore(query, keys, metric)
+                order = numpy.argsort(-exact)[:k]
+                results.append([(keys[i], float(exact[i])) for i in order])
+            else:
+                query_top = query_top[numpy.argsort(-query_scores[query_top])]
+                results.append([(self.keys[candidates[i]], float(query_scores[i])) for i in query_top])
+        return results[0] if single else results
+
+    @classmethod
+    def from_edge_dict(cls: 'EdgeIndex', edge_dict: dict, dtype: str="float32", rescore: int=4) -> 'EdgeIndex':
+        """
+        Build an index from the edge_dict of a game tree. Edges without embedding are skipped.
+        Quantized indexes re-score their candidates with the embeddings of edge_dict, unless edge_dict is a quantized CompactEdgeDict:
+        its rows are no more precise than the index, so its scores are returned as they are.
+        """
+        full_precision = getattr(edge_dict, "dtype", "float32") == "float32"
+        lookup = (lambda key: edge_dict[key].get_embedding()) if full_precision else None
+        index = cls(max(len(edge_dict), 1), dtype, lookup, rescore)
+        for (key, edge) in edge_dict.items():
+            embedding = edge.get_embedding()
+            if embedding is not None:
+                index.upsert(key, embedding)
+        return index
@@ -1,22 +1,29 @@
 """
 Inherits from BaseGameTree. Demonstrates a GameTree for knowledge-based games
 """
-import uuid
-
-from langchain.vectorstores import Chroma
-from langchain.embeddings.base import Embeddings
+from typing import TYPE_CHECKING
 
 from lifelike.StateManager.base_game_tree import BaseGameTree
 
+if TYPE_CHECKING:
+    from langchain.embeddings.base import Embeddings
+
 class KnowledgeTree(BaseGameTree):
     """Allows for loading the tree from a pre-defined list of contextual texts"""
     @classmethod
-    def from_texts(cls: BaseGameTree, name:str, texts: list[str], embedding_function: Embeddings, metadatas: list[dict]=None, ids: list[str]=None) -> 'KnowledgeTree':
-        """For now, must know the embedding dimension."""
-        if ids is None: # If id not provided, generate it
-            ids = [str(uuid.uuid1()) for _ in texts]
-
+    def from_texts(cls: BaseGameTree, name:str, texts: list[str], embedding_function: 'Embeddings', metadatas: list[dict]=None, ids: list[str]=None,
+                   chunk_size: int=256, max_workers: int=4, write_db: bool=None, progress=None) -> 'KnowledgeTree':
+        """
+        Build the tree and its vectorstore from texts with add_text_stream(). texts, metadatas and ids can be any iterables, including generators.
+        For chunk_size, max_workers, write_db and progress, see add_text_stream().
+        write_db defaults to writing the vectorstore only when chromadb is installed. Without it, use the in-process retrievers (get_retriever(local=True)).
+        """
+        if write_db is None:
+            try:
+                import chromadb
+                write_db = True
+            except ImportError:
+                write_db = False
         tree = cls(name, embedding_function)
-        # TODO: Currently bypasses building tree. Tree is essentially non-functional
-        tree.vectorstore = Chroma.from_texts(texts, embedding_function, metadatas, ids)
+        tree.add_text_stream(texts, metadatas, ids, chunk_size, max_workers, write_db=write_db, progress=progress)
         return tree
\ No newline at end of file
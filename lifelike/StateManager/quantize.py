@@ -0,0 +1,46 @@
+"""
+Quantized storage of embeddings, used by EdgeIndex, CompactEdgeDict and to_binary() to cut memory and disk use.
+    - float16: half precision, 2x smaller than float32
+    - int8: one byte per value with a float32 scale per vector (symmetric, scale = max |value| / 127), about 4x smaller
+"""
+import numpy
+
+DTYPES = ("float32", "float16", "int8")
+
+def check_dtype(dtype: str) -> str:
+    """Returns dtype, raises ValueError if it is not a supported storage dtype"""
+    if dtype not in DTYPES:
+        raise ValueError("Unknown dtype {}. Must be one of {}".format(dtype, ", ".join(DTYPES)))
+    return dtype
+
+def quantize(embeddings: numpy.ndarray, dtype: str) -> tuple:
+    """
+    Quantize embeddings.
+    Params:
+        - embeddings: a (dimension,) embedding or a (n, dimension) batch of them
+        - dtype: one of DTYPES
+
+    Returns: (codes, scales) where scales is None unless dtype is int8
+    """
+    embeddings = numpy.asarray(embeddings, dtype=numpy.float32)
+    if dtype == "float32":
+        return (embeddings, None)
+    if dtype == "float16":
+        return (embeddings.astype(numpy.float16), None)
+
+    scales = numpy.abs(embeddings).max(axis=-1) / 127
+    safe = numpy.where(scales > 0, scales, 1)
+    codes = numpy.rint(embeddings / numpy.expand_dims(safe, -1)).astype(numpy.int8)
+    return (codes, scales.astype(numpy.float32))
+
+def dequantize(codes: numpy.ndarray, scales: numpy.ndarray=None) -> numpy.ndarray:
+    """
+    Float32 embeddings back from quantize(). Always returns a new array for quantized codes.
+    Params:
+        - codes: codes from quantize()
+        - scales: scales from quantize(), only for int8
+    """
+    embeddings = numpy.asarray(codes).astype(numpy.float32)
+    if scales is not None:
+        embeddings *= numpy.expand_dims(numpy.asarray(scales, dtype=numpy.float32), -1)
+    return embeddings
@@ -0,0 +1,177 @@
+"""
+In-process retrieval over the edges of a game tree. Alternative to going through Chroma with write_db().
+Langchain retrievers over EdgeIndex (index.py), IVFIndex (ann.py) and sessions. The indexes do not import langchain, only the retrievers do.
+"""
+import numpy
+
+from langchain.schema import BaseRetriever, Document
+
+from lifelike import metrics
+from lifelike.StateManager.index import EdgeIndex # EdgeIndex used to live here
+
+class EdgeRetriever(BaseRetriever):
+    """
+    Exact KNN retriever over every edge of a game tree, backed by the tree's EdgeIndex.
+    Stays in sync with the tree as edges are added or tuned. Drop-in for the Chroma retriever of get_retriever().
+    """
+    def __init__(self, tree, k: int=4, metric: str="cosine") -> None:
+        """
+        Constructor. Use tree.get_retriever(local=True) instead.
+        Params:
+            - tree: the BaseGameTree to search
+            - k: number of returned results
+            - metric: "cosine" or "l2"
+        """
+        self.tree = tree
+        self.k = k
+        self.metric = metric
+
+    def _documents(self, results: list) -> list:
+        """Turn (edge key, score) results into documents of the target nodes. The node id is added to the metadata."""
+        documents = []
+        for (edge, _) in results:
+            node = self.tree.node_dict[edge[1]]
+            documents.append(Document(page_content=node.context, metadata=dict(node.metadata, id=node.id)))
+        return documents
+
+    def get_relevant_documents(self, query: str) -> list:
+        """Get the target nodes of the k edges closest to the query"""
+        with metrics.span("retriever.query", retriever=type(self).__name__):
+            embedding = self.tree.embed.embed_query(query)
+            return self._documents(self.tree.edge_index().search(embedding, self.k, self.metric))
+
+    async def aget_relevant_documents(self, query: str) -> list:
+        return self.get_relevant_documents(query)
+
+    def get_relevant_documents_batch(self, queries: list) -> list:
+        """Get relevant documents for several queries with a single matrix product"""
+        if not queries:
+            return []
+        metrics.value("retriever.batch_size", len(queries), retriever=type(self).__name__)
+        with metrics.span("retriever.query_batch", retriever=type(self).__name__):
+            embeddings = [self.tree.embed.embed_query(query) for query in queries]
+            return [self._documents(results) for results in self.tree.edge_index().search(embeddings, self.k, self.metric)]
+
+
+class GameNodeRetriever(EdgeRetriever):
+    """
+    Retriever scoped to the edges reachable from the current node, O(out-degree) per query instead of O(all edges).
+    Falls back to the wildcard '_' edges when the current node has no outgoing edge.
+    """
+    def __init__(self, tree, node_id: str=None, k: int=4, metric: str="cosine") -> None:
+        """
+        Constructor. Use tree.get_node_retriever() instead.
+        Params:
+            - tree: the BaseGameTree to search
+            - node_id: id of the current node. If not provided, only wildcard edges are searched.
+            - k: number of returned results
+            - metric: "cosine" or "l2"
+        """
+        super().__init__(tree, k, metric)
+        self.node_id = node_id
+
+    def set_node(self, node_id: str) -> None:
+        """Move the retriever to another node, usually the id in the metadata of a retrieved document"""
+        self.node_id = node_id
+
+    def candidate_rows(self) -> list:
+        """Rows of the tree's EdgeIndex that can be reached from the current node"""
+        index = self.tree.edge_index()
+        adjacency = self.tree.adjacency()
+        ends = adjacency.get(self.node_id) if self.node_id is not None else None
+        start = self.node_id
+        if not ends:
+            ends = adjacency.get('_', ())
+            start = '_'
+        return [index.rows[(start, end)] for end in ends if (start, end) in index]
+
+    def get_relevant_documents(self, query: str) -> list:
+        """Get the target nodes of the k reachable edges closest to the query"""
+        with metrics.span("retriever.query", retriever=type(self).__name__):
+            embedding = self.tree.embed.embed_query(query)
+            return self._documents(self.tree.edge_index().search(embedding, self.k, self.metric, self.candidate_rows()))
+
+    def get_relevant_documents_batch(self, queries: list) -> list:
+        """Get relevant documents for several queries from the current node with a single matrix product"""
+        if not queries:
+            return []
+        metrics.value("retriever.batch_size", len(queries), retriever=type(self).__name__)
+        with metrics.span("retriever.query_batch", retriever=type(self).__name__):
+            embeddings = [self.tree.embed.embed_query(query) for query in queries]
+            return [self._documents(results) for results in self.tree.edge_index().search(embeddings, self.k, self.metric, self.candidate_rows())]
+
+
+class ANNRetriever(EdgeRetriever):
+    """
+    Approximate KNN retriever over every edge of a game tree, backed by the tree's IVFIndex.
+    Stays in sync with the tree as edges are added, tuned or removed. Drop-in for the exact EdgeRetriever.
+    """
+    def __init__(self, tree, k: int=4, nprobe: int=None) -> None:
+        """
+        Constructor. Use tree.get_retriever(local=True, ann=True) instead.
+        Params:
+            - tree: the BaseGameTree to search
+            - k: number of returned results
+            - nprobe: number of clusters scored per query. Defaulted to the index's nprobe.
+        """
+        super().__init__(tree, k, tree.ann_index().metric)
+        self.nprobe = nprobe
+
+    def get_relevant_documents(self, query: str) -> list:
+        """Get the target nodes of the k edges closest to the query, approximately"""
+        with metrics.span("retriever.query", retriever=type(self).__name__):
+            embedding = self.tree.embed.embed_query(query)
+            return self._documents(self.tree.ann_index().search(embedding, self.k, self.nprobe))
+
+    def get_relevant_documents_batch(self, queries: list) -> list:
+        """Get relevant documents for several queries"""
+        if not queries:
+            return []
+        metrics.value("retriever.batch_size", len(queries), retriever=type(self).__name__)
+        with metrics.span("retriever.query_batch", retriever=type(self).__name__):
+            embeddings = [self.tree.embed.embed_query(query) for query in queries]
+            return [self._documents(results) for results in self.tree.ann_index().search(embeddings, self.k, self.nprobe)]
+
+
+class SessionRetriever(BaseRetriever):
+    """Exact KNN retriever over a frozen base tree merged with one session. Follows the session's current node unless given one."""
+    def __init__(self, session: 'GameSession', node_id: str=None, k: int=4, metric: str="cosine", scoped: bool=True) -> None:
+        """
+        Constructor. Use session.get_retriever() instead.
+        Params:
+            - session: the GameSession to search
+            - node_id: the node to search from. If not provided, the session's current node is used.
+            - k: number of returned results
+            - metric: "cosine" or "l2"
+            - scoped: only search the edges reachable from the node
+        """
+        self.session = session
+        self.node_id = node_id
+        self.k = k
+        self.metric = metric
+        self.scoped = scoped
+
+    def _documents(self, results: list) -> list:
+        """Turn (edge key, score) results into documents of the target nodes. The node id is added to the metadata."""
+        documents = []
+        for (edge, _) in results:
+            node = self.session.get_node(edge[1])
+            documents.append(Document(page_content=node.context, metadata=dict(node.metadata, id=node.id)))
+        return documents
+
+    def get_relevant_documents_batch(self, queries: list) -> list:
+        """Get relevant documents for several queries with a single matrix product per index"""
+        if not queries:
+            return []
+        metrics.value("retriever.batch_size", len(queries), retriever=type(self).__name__)
+        with metrics.span("retriever.query_batch", retriever=type(self).__name__):
+            embeddings = numpy.asarray([self.session.embed.embed_query(query) for query in queries], dtype=numpy.float32)
+            node_id = self.session.node_id if self.node_id is None else self.node_id
+            return [self._documents(results) for results in self.session.search(embeddings, self.k, self.metric, node_id, self.scoped)]
+
+    def get_relevant_documents(self, query: str) -> list:
+        """Get the target nodes of the k closest edges, merged from the base tree and the session"""
+        return self.get_relevant_documents_batch([query])[0]
+
+    async def aget_relevant_documents(self, query: str) -> list:
+        return self.get_relevant_documents(query)
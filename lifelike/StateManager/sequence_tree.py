@@ -2,13 +2,20 @@
 Inherits from GameNode. Meant for linear games with branching story paths.
 Good example of simple GameTree object.
 """
-from lifelike.StateManager.base_game_tree import GameNodeRetriever, BaseGameTree, GameNode, EdgeEmbedding
+from typing import TYPE_CHECKING
+
+from lifelike.StateManager.base_game_tree import BaseGameTree, GameNode, EdgeEmbedding
+
+if TYPE_CHECKING:
+    from langchain.schema import BaseRetriever
 
 PathEmbedding = EdgeEmbedding
 
 class SequenceEvent(GameNode):
     """Wrapper for an event document in Database. The game can only see 1 at a time."""
-    def __init__(self, id: str, context: str, metadata: dict={}, reachable: list[str]=[]) -> None:
+    __slots__ = ()
+
+    def __init__(self, id: str, context: str, metadata: dict=None, reachable: list[str]=None) -> None:
         """
         Constructor. To build the event from dict, use .from_dict()
         Params:
@@ -17,8 +24,8 @@ class SequenceEvent(GameNode):
             - metadata: the text prompts given as response to player speech.
             - reachable: list of ids for sequence event that this specific event can reach. This behaviour can be customized via SequenceEventRetriever
         """
-        super().__init__(id, context, metadata)
-        self.metadata["reachable"] = reachable # Internal metadata
+        super().__init__(id, context, {} if metadata is None else metadata)
+        self.metadata["reachable"] = [] if reachable is None else reachable # Internal metadata
 
 
 class SequenceTree(BaseGameTree):
@@ -27,9 +34,9 @@ class SequenceTree(BaseGameTree):
     Provides methods that supports building out a sequence tree and acts as an interface for Database.
     Only Constructor can exit to support retries.
     """
-    def validate_edge(self, start_id: str, end_id: str, embedding_name: str, embedding_template: str = "default") -> bool:
+    def validate_edge(self, start_id: str, end_id: str, embedding_template_name: str = "default") -> bool:
         """Validates new edge_dict entry. All node in an edge must exist."""
-        if not super().validate_edge(start_id, end_id, embedding_name, embedding_template):
+        if not super().validate_edge(start_id, end_id, embedding_template_name):
             return False
         elif start_id not in self.node_dict or end_id not in self.node_dict:
             print("Either start_id or end_id does not exist in event_dict. Must be 2 of {}.".format(self.node_dict.keys()))
@@ -37,6 +44,38 @@ class SequenceTree(BaseGameTree):
         else:
             return True
 
-    def add_edge(self, start_id: str, end_id: str, embedding_name: str, embedding_template: str = "default") -> bool:
+    def add_edge(self, start_id: str, end_id: str, embedding_name: str, embedding_template: PathEmbedding) -> bool:
         if super().add_edge(start_id, end_id, embedding_name, embedding_template):
-            self.node_dict[start_id].metadata["reachable"].append(end_id)
\ No newline at end of file
+            self.node_dict[start_id].metadata["reachable"].append(end_id)
+            return True
+        return False
+
+    def remove_edge(self, edge_id: tuple) -> bool:
+        if super().remove_edge(edge_id):
+            if edge_id[0] in self.node_dict:
+                reachable = self.node_dict[edge_id[0]].metadata["reachable"]
+                reachable[:] = [end_id for end_id in reachable if end_id != edge_id[1]]
+            return True
+        return False
+
+    def remove_node(self, node_id: str) -> bool:
+        """Remove a node and its edges. node_id is also dropped from the reachable list of every other event."""
+        if super().remove_node(node_id):
+            for node in self.node_dict.values():
+                node.metadata["reachable"][:] = [end_id for end_id in node.metadata["reachable"] if end_id != node_id]
+            return True
+        return False
+
+    def get_retriever(self, local: bool=False, node_id: str=None, **kwargs) -> 'BaseRetriever':
+        """
+        Same options as BaseGameTree.get_retriever(). The in-process exact retriever is scoped to the events reachable from node_id,
+        falling back to the wildcard '_' edges. Without local, the Chroma retriever is returned, with search_type and search_kwargs.
+        Params:
+            - local: search in-process instead of through the vectorstore
+            - node_id: id of the current SequenceEvent, only for the local exact retriever
+            - search_kwargs: {"k": Number of returned results}
+            - metric: "cosine" or "l2"
+        """
+        if not local or kwargs.get("ann"):
+            return super().get_retriever(local, **kwargs)
+        return self.get_node_retriever(node_id, kwargs.get("search_kwargs", {}).get("k", 4), kwargs.get("metric", "cosine"))
\ No newline at end of file
@@ -0,0 +1,280 @@
+"""
+Per-player sessions over a shared game tree.
+The base tree is frozen (marked as Final) and shared by every session. A session only stores what its player changed:
+tuned copies of base edges, added nodes and added edges, so it costs O(changes) memory and can be created, saved and dropped cheaply.
+    tree.freeze()
+    session = tree.new_session("player-1")
+    session.tune_edge(edge_id, prompts)
+    session.get_retriever(node_id).get_relevant_documents(query)
+"""
+import json
+
+import numpy
+
+from lifelike.StateManager.base_game_tree import BaseGameTree, EdgeEmbedding, GameNode, embed_prompts
+from lifelike.StateManager.index import EdgeIndex
+
+class GameSession:
+    """Overlay of one player's changes on a frozen BaseGameTree. Reads fall back to the base tree, writes stay in the session."""
+    def __init__(self, tree: BaseGameTree, session_id: str=None, node_id: str=None) -> None:
+        """
+        Constructor. Use tree.new_session() instead.
+        Params:
+            - tree: the shared base tree. Must be frozen with tree.freeze().
+            - session_id: identifier of the session, usually the player's
+            - node_id: the node the player is at. Defaulted to None (start of the game).
+        """
+        if not tree._final:
+            raise Exception("Sessions need a frozen base tree, call tree.freeze() first")
+
+        self.tree = tree
+        self.session_id = session_id
+        self.node_id = node_id
+        self.embed = tree.embed
+
+        self.node_dict = {} # id - GameNode, nodes added by this session
+        self.edge_dict = {} # edge id - EdgeEmbedding, edges added by this session or tuned copies of base edges
+        self._edge_index = EdgeIndex(1) # Over edge_dict
+        self._adjacency = {} # start id - list of end ids, edges added by this session only
+
+    def __len__(self) -> int:
+        """Size of the delta: number of session nodes and edges"""
+        return len(self.node_dict) + len(self.edge_dict)
+
+    def move(self, node_id: str) -> bool:
+        """
+        Move the player to another node, usually the id in the metadata of a retrieved document.
+        Params:
+            - node_id: id of a node of the base tree or of the session
+        """
+        if self.get_node(node_id) is None:
+            print("Node {} does not exists".format(node_id))
+            return False
+        self.node_id = node_id
+        return True
+
+    def get_node(self, node_id: str) -> GameNode:
+        """Node of the session or of the base tree, None if neither has it"""
+        node = self.node_dict.get(node_id)
+        if node is None:
+            node = self.tree.node_dict.get(node_id)
+        return node
+
+    def get_edge(self, edge_id: tuple) -> EdgeEmbedding:
+        """Edge of the session or of the base tree, None if neither has it"""
+        edge = self.edge_dict.get(edge_id)
+        if edge is None and edge_id in self.tree.edge_dict:
+            edge = self.tree.edge_dict[edge_id]
+        return edge
+
+    def add_node(self, node: GameNode) -> bool:
+        """
+        Add a node to this session only.
+        Params:
+            - node: a GameNode instance
+        """
+        if self.get_node(node.id) is not None:
+            print("Node id {} already exists".format(node.id))
+            return False
+        self.node_dict[node.id] = node
+        return True
+
+    def add_edge(self, start_id: str, end_id: str, embedding_name: str, embedding_template: EdgeEmbedding) -> bool:
+        """
+        Add an edge to this session only. Same rules as BaseGameTree.add_edge(): end_id must exist, start_id can be '_'.
+        Params:
+            - start_id: The id of the start node
+            - end_id: The id of the end node
+            - embedding_name: Rename the embedding class
+            - embedding_template: The EdgeEmbedding object to use as a template, for saved templates use tree.get_template()
+        """
+        edge_id = (start_id, end_id)
+        if self.get_node(end_id) is None:
+            print("end_id {} does not exist in the tree or the session".format(end_id))
+            return False
+        if self.get_edge(edge_id) is not None:
+            print("Invalid edge: edge {} already exists".format(start_id + '-' + end_id))
+            return False
+
+        self._set_edge(edge_id, embedding_template.copy(embedding_name))
+        self._adjacency.setdefault(start_id, []).append(end_id)
+        return True
+
+    def tune_edge(self, edge_id: tuple, prompts: list) -> bool:
+        """
+        Tune an edge for this session only. A base edge is copied into the session first, sharing its embedding until tuned.
+        Params:
+            - edge_id: Identifier for edge, is a tuple of form (start_event, end_event)
+            - prompts: List of prompts for tuning
+        """
+        edge = self.edge_dict.get(edge_id)
+        if edge is None:
+            if edge_id not in self.tree.edge_dict:
+                print("edge {} does not exists".format(edge_id))
+                return False
+            edge = self.tree.edge_dict[edge_id].copy(self.tree.edge_dict[edge_id].name)
+
+        if edge.embed is None:
+            print("The Embedding is marked as Final. Cannot be tuned.")
+            return False
+        edge.tune_prompts(prompts)
+        self._set_edge(edge_id, edge)
+        return True
+
+    def tune_edges(self, edge_prompts: dict, batch_size: int=None) -> bool:
+        """
+        Tune many edges for this session at once, embedding all their prompts together. Same as tune_edge() on each edge in order.
+        Nothing is tuned if one of the edges does not exist.
+        Params:
+            - edge_prompts: dict of the form {edge_id: prompts}
+            - batch_size: maximum number of prompts per embed_documents() call. Defaulted to None (one call).
+        """
+        missing = [edge_id for edge_id in edge_prompts if edge_id not in self.edge_dict and edge_id not in self.tree.edge_dict]
+        if missing:
+            print("edges {} do not exist".format(missing))
+            return False
+
+        edges = {}
+        for edge_id in edge_prompts:
+            edge = self.edge_dict.get(edge_id)
+            if edge is None:
+                edge = self.tree.edge_dict[edge_id].copy(self.tree.edge_dict[edge_id].name)
+            edges[edge_id] = edge
+
+        for (edge_id, new_embeddings) in embed_prompts(edges, edge_prompts, batch_size).items():
+            edges[edge_id].tune_embeddings(new_embeddings)
+            self._set_edge(edge_id, edges[edge_id])
+        return True
+
+    def _set_edge(self, edge_id: tuple, edge: EdgeEmbedding) -> None:
+        """Store an edge of the session and keep its index in sync"""
+        self.edge_dict[edge_id] = edge
+        if edge.get_embedding() is not None:
+            self._edge_index.upsert(edge_id, edge.get_embedding())
+
+    def reset_edge(self, edge_id: tuple) -> bool:
+        """
+        Drop the session's version of an edge. A tuned base edge goes back to the base tuning, an added edge is removed.
+        Params:
+            - edge_id: Identifier for edge
+        """
+        if edge_id not in self.edge_dict:
+            print("edge {} was not changed in this session".format(edge_id))
+            return False
+        self.edge_dict.pop(edge_id)
+        self._edge_index.remove(edge_id)
+        if edge_id[1] in self._adjacency.get(edge_id[0], ()):
+            self._adjacency[edge_id[0]].remove(edge_id[1])
+        return True
+
+    def clear(self) -> None:
+        """Discard every change of the session"""
+        self.node_dict.clear()
+        self.edge_dict.clear()
+        self._edge_index = EdgeIndex(1)
+        self._adjacency.clear()
+
+    def reachable(self, node_id: str) -> tuple:
+        """
+        Edges that can be taken from node_id, merged from the base tree and the session, falling back to the wildcard '_' edges.
+        Returns: (start id, list of end ids) where start id is node_id or '_'
+        """
+        for start_id in (node_id, '_'):
+            if start_id is None:
+                continue
+            ends = list(self.tree.adjacency().get(start_id, ())) + self._adjacency.get(start_id, [])
+            if ends:
+                return (start_id, ends)
+        return ('_', [])
+
+    def search(self, embeddings: numpy.ndarray, k: int=4, metric: str="cosine", node_id: str=None, scoped: bool=False) -> list:
+        """
+        Exact top-k search over the base edges and the session edges, session edges replacing the base edges they tuned.
+        Params:
+            - embeddings: (n, dimension) query embeddings
+            - k: number of results per query
+            - metric: "cosine" or "l2"
+            - node_id: with scoped, the node whose outgoing edges are searched
+            - scoped: only search the edges reachable from node_id (see reachable()) instead of every edge
+
+        Returns: for each query, a list of (edge key, score) sorted from closest
+        """
+        base_index = self.tree.edge_index()
+        if scoped:
+            (start_id, ends) = self.reachable(node_id)
+            keys = [(start_id, end_id) for end_id in ends]
+            base_rows = [base_index.rows[key] for key in keys if key not in self.edge_dict and key in base_index]
+            session_rows = [self._edge_index.rows[key] for key in keys if key in self._edge_index]
+        else:
+            overridden = [base_index.rows[key] for key in self.edge_dict if key in base_index]
+            base_rows = numpy.setdiff1d(numpy.arange(len(base_index)), overridden) if overridden else None
+            session_rows = None
+
+        results = base_index.search(embeddings, k, metric, base_rows) if len(base_index) else [[] for _ in embeddings]
+        if len(self._edge_index):
+            session_results = self._edge_index.search(embeddings, k, metric, session_rows)
+            results = [sorted(base + session, key=lambda result: -result[1])[:k] for (base, session) in zip(results, session_results)]
+        return results
+
+    def get_retriever(self, node_id: str=None, k: int=4, metric: str="cosine", scoped: bool=True) -> 'SessionRetriever':
+        """
+        Retriever over the base tree merged with this session.
+        Params:
+            - node_id: the node to search from. Defaulted to the session's current node.
+            - k: Number of returned results
+            - metric: "cosine" or "l2"
+            - scoped: only search the edges reachable from the node, like tree.get_node_retriever(). If False, every edge is searched.
+        """
+        from lifelike.StateManager.retriever import SessionRetriever # Only load langchain when a retriever is used
+        return SessionRetriever(self, node_id, k, metric, scoped)
+
+    def to_dict(self) -> dict:
+        """Return the session delta in dictionary form to be saved to json. The base tree is not included."""
+        return {
+            "tree": self.tree.name,
+            "session_id": self.session_id,
+            "node_id": self.node_id,
+            "event_dict": {node_id: node.to_dict() for (node_id, node) in self.node_dict.items()},
+            "edge_dict": {edge[0]+" "+edge[1]: embedding.to_dict() for (edge, embedding) in self.edge_dict.items()},
+            "added_edges": [start_id+" "+end_id for (start_id, ends) in self._adjacency.items() for end_id in ends]
+        }
+
+    @classmethod
+    def from_dict(cls: 'GameSession', tree: BaseGameTree, session_dict: dict) -> 'GameSession':
+        """
+        Rebuild a session on its base tree.
+        Params:
+            - tree: the frozen base tree the session was created on
+            - session_dict: the result of to_dict()
+        """
+        if session_dict["tree"] != tree.name:
+            raise Exception("Session was created on tree {}, not {}".format(session_dict["tree"], tree.name))
+
+        session = cls(tree, session_dict["session_id"], session_dict["node_id"])
+        for (node_id, node_dict) in session_dict["event_dict"].items():
+            session.node_dict[node_id] = GameNode.from_dict(node_dict)
+        for (edge_string, embedding_dict) in session_dict["edge_dict"].items():
+            session._set_edge(tuple(edge_string.split(" ")), EdgeEmbedding.from_dict(embedding_dict, tree.embed))
+        for edge_string in session_dict["added_edges"]:
+            (start_id, end_id) = edge_string.split(" ")
+            session._adjacency.setdefault(start_id, []).append(end_id)
+        return session
+
+    def to_json(self, edge_to_json: str) -> None:
+        """Saves the session delta to json"""
+        with open(edge_to_json, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def build_from_json(cls: 'GameSession', tree: BaseGameTree, edge_to_json: str) -> 'GameSession':
+        """Rebuild a session saved with to_json() on its base tree"""
+        with open(edge_to_json, "r") as f:
+            return cls.from_dict(tree, json.load(f))
+
+
+def __getattr__(name: str):
+    # SessionRetriever moved to retriever.py with the other langchain retrievers, so that sessions do not load langchain
+    if name == "SessionRetriever":
+        from lifelike.StateManager.retriever import SessionRetriever
+        return SessionRetriever
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
@@ -0,0 +1,135 @@
+"""
+This file contains the background memory used by Characters to put only the relevant parts of long backgrounds in prompts
+"""
+import hashlib
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy
+
+from lifelike import metrics
+
+
+class BackgroundMemory:
+    """
+    This class splits character backgrounds into chunks and embeds them once, when the background is set.
+    Prompts then get the k chunks closest to the recent conversation, in their original order, instead of the whole background.
+    """
+    def __init__(self, embeddings, k: int = 3, chunk_chars: int = 500) -> None:
+        """
+        @param embeddings: langchain Embeddings object used for chunks and queries
+        @param k: number of chunks put in the prompt
+        @param chunk_chars: maximum length of a chunk, paragraphs and then sentences are kept together when they fit
+        @return: None, initializes BackgroundMemory
+        """
+        self.embeddings = embeddings
+        self.k = k
+        self.chunk_chars = chunk_chars
+        self.chunks = {} # name - (background hash, chunks, unit norm chunk embeddings or None for a single chunk)
+        self._lock = threading.Lock()
+
+    def _hash(self, background: str) -> str:
+        """
+        @param background: background of a character
+        @return: content hash of the background and of the chunk size
+        """
+        return hashlib.sha256(f"{self.chunk_chars}\0{background}".encode('utf-8')).hexdigest()
+
+    def split(self, background: str) -> List[str]:
+        """
+        @param background: background of a character
+        @return: chunks of at most chunk_chars, packing whole paragraphs, then whole sentences, then words
+        """
+        pieces = []
+        for paragraph in re.split(r'\n\s*\n', background.strip()):
+            paragraph = paragraph.strip()
+            if len(paragraph) <= self.chunk_chars:
+                pieces.append(paragraph)
+                continue
+            for sentence in re.split(r'(?<=[.!?])\s+', paragraph):
+                while len(sentence) > self.chunk_chars:
+                    cut = sentence.rfind(' ', 0, self.chunk_chars)
+                    cut = self.chunk_chars if cut <= 0 else cut
+                    pieces.append(sentence[:cut])
+                    sentence = sentence[cut:].lstrip()
+                pieces.append(sentence)
+
+        chunks = []
+        for piece in pieces:
+            if not piece:
+                continue
+            if chunks and len(chunks[-1]) + 1 + len(piece) <= self.chunk_chars:
+                chunks[-1] = chunks[-1] + '\n' + piece
+            else:
+                chunks.append(piece)
+        return chunks
+
+    def index(self, name: str, background: str) -> None:
+        """
+        Does nothing if the background did not change since it was last indexed.
+        @param name: unique name of the character
+        @param background: background of the character
+        @return: None, chunks and embeds the background
+        """
+        background_hash = self._hash(background)
+        with self._lock:
+            if name in self.chunks and self.chunks[name][0] == background_hash:
+                return
+        chunks = self.split(background)
+        vectors = None
+        if len(chunks) > 1:
+            with metrics.span("background.embed"):
+                vectors = numpy.asarray(self.embeddings.embed_documents(chunks), dtype=numpy.float32)
+            norms = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= numpy.where(norms > 0, norms, 1)
+        with self._lock:
+            self.chunks[name] = (background_hash, chunks, vectors)
+
+    def discard(self, name: str) -> None:
+        """
+        @param name: unique name of the character
+        @return: None, forgets the chunks of a deleted character
+        """
+        with self._lock:
+            self.chunks.pop(name, None)
+
+    def relevant(self, name: str, background: str, query: str) -> str:
+        """
+        Backgrounds that were not indexed yet, or changed outside of Characters, are indexed first.
+        @param name: unique name of the character
+        @param background: current background of the character
+        @param query: recent conversation the chunks should be relevant to
+        @return: the k chunks of the background closest to the query, in background order. The first k chunks when the query is empty.
+        """
+        self.index(name, background)
+        with self._lock:
+            _, chunks, vectors = self.chunks[name]
+        if len(chunks) <= self.k:
+            return '\n'.join(chunks)
+
+        if query.strip():
+            with metrics.span("background.embed_query"):
+                query_vector = numpy.asarray(self.embeddings.embed_query(query), dtype=numpy.float32)
+            scores = vectors @ query_vector
+            selected = numpy.sort(numpy.argpartition(-scores, self.k - 1)[:self.k])
+        else:
+            selected = range(self.k)
+        return '\n'.join(chunks[i] for i in selected)
+
+    def to_dict(self) -> Dict[str, Tuple[str, List[str], Optional[List[List[float]]]]]:
+        """
+        @return: chunks and embeddings that can be serialized with json, to skip embedding the backgrounds again on restart
+        """
+        with self._lock:
+            return {name: [background_hash, chunks, None if vectors is None else vectors.tolist()]
+                    for name, (background_hash, chunks, vectors) in self.chunks.items()}
+
+    def load(self, chunks: Dict[str, Tuple[str, List[str], Optional[List[List[float]]]]]) -> None:
+        """
+        @param chunks: the result of to_dict()
+        @return: None, restores chunks and embeddings
+        """
+        with self._lock:
+            self.chunks.update({name: (background_hash, list(texts), None if vectors is None else numpy.asarray(vectors, dtype=numpy.float32))
+                                for name, (background_hash, texts, vectors) in chunks.items()})
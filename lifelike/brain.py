@@ -1,27 +1,99 @@
 """
 This file contains the interface to manage characters and conversations
 """
+import asyncio
+import functools
 import json
 import os
+import queue
 import random
-from typing import List, Dict, Set
-from langchain import PromptTemplate, LLMChain
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Iterator, List, Dict, Optional, Set, Tuple
+
+from lifelike import metrics
+from lifelike.background import BackgroundMemory
+from lifelike.cache import ResponseCache
+from lifelike.journal import Journal, write_json_atomic
+from lifelike.memory import RollingSummary
+from lifelike.speculation import Speculator
+
+# langchain takes seconds to import, it is only loaded once a Conversations is created
+if TYPE_CHECKING:
+    from langchain.schema import PromptValue
+
+
+# Default prompt of Conversations. Custom templates may use any of PROMPT_VARIABLES.
+DEFAULT_TEMPLATE = "Context:\n"\
+"{context}\n"\
+"\n"\
+"Background:\n"\
+"{background}\n"\
+"\n"\
+"Relevant pieces of information:\n"\
+"{history}\n"\
+"(Only use if relevant to the conversation)\n"\
+"\n"\
+"{summary}"\
+"Conversation:\n"\
+"{log}\n"\
+"{speaker}:"
+
+PROMPT_VARIABLES = {"context", "background", "history", "summary", "log", "speaker"}
 
 
 class Characters:
     """
     This class is an interface to manage characters.
     """
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, journal: bool = False, memory: Optional[BackgroundMemory] = None) -> None:
         """
         @param path: path to the json file
+        @param journal: record changes in an append-only journal next to the json file instead of rewriting it on save
+        @param memory: BackgroundMemory that puts only the relevant parts of backgrounds in prompts, None to use whole backgrounds
         @return: None, initializes Characters
         """
         self.path = path
         self.characters = {}
-        if os.path.exists(path):
+        self.memory = memory
+        self.journal = None
+        if journal:
+            self.journal = Journal(path)
+            self.characters = self.journal.snapshot()
+            for op, key, value in self.journal.replay():
+                self._apply(op, key, value)
+        elif os.path.exists(path):
             self.characters = json.load(open(path, 'r', encoding='utf-8'))
 
+    def _apply(self, op: str, name: str, background: str) -> None:
+        """
+        @param op: one of new, update, delete
+        @param name: unique name of the character
+        @param background: background of the character
+        @return: None, applies a change to Characters
+        """
+        if op == "delete":
+            self.characters.pop(name, None)
+        else:
+            self.characters[name] = background
+
+    def _change(self, op: str, name: str, background: str = None) -> None:
+        """
+        @param op: one of new, update, delete
+        @param name: unique name of the character
+        @param background: background of the character
+        @return: None, applies a change to Characters and records it in the journal
+        """
+        self._apply(op, name, background)
+        if self.journal is not None:
+            self.journal.record(op, name, background)
+        if self.memory is not None:
+            if op == "delete":
+                self.memory.discard(name)
+            else:
+                self.memory.index(name, background)
+
     def is_out(self, name: str) -> ValueError:
         """
         @param name: unique name of the character
@@ -46,6 +118,17 @@ class Characters:
         self.is_out(name)
         return self.characters[name]
 
+    def background(self, name: str, query: str) -> str:
+        """
+        @param name: unique name of the character
+        @param query: recent conversation
+        @return: the parts of the background relevant to the query, or the whole background without memory
+        """
+        background = self.get(name)
+        if self.memory is None:
+            return background
+        return self.memory.relevant(name, background, query)
+
     def add(self, name: str, background: str) -> None:
         """
         @param name: unique name of the character
@@ -53,7 +136,7 @@ class Characters:
         @return: None, adds character to Characters
         """
         self.is_in(name)
-        self.characters[name] = background
+        self._change("new", name, background)
 
     def update(self, name: str, background: str) -> None:
         """
@@ -62,7 +145,7 @@ class Characters:
         @return: None, updates character in Characters
         """
         self.is_out(name)
-        self.characters[name] = background
+        self._change("update", name, background)
 
     def delete(self, name) -> None:
         """
@@ -70,7 +153,7 @@ class Characters:
         @return: None, deletes character from Characters
         """
         self.is_out(name)
-        self.characters.pop(name)
+        self._change("delete", name)
 
     def __str__(self) -> str:
         """
@@ -80,29 +163,83 @@ class Characters:
 
     def save(self) -> None:
         """
-        @return: None, saves Characters to json file
+        @return: None, saves Characters to json file, or flushes the journal when journaling
         """
-        json.dump(self.characters, open(self.path, 'w', encoding='utf-8'))
+        if self.journal is None:
+            write_json_atomic(self.path, self.characters)
+        elif self.journal.needs_compaction():
+            self.journal.compact(self.characters)
+        else:
+            self.journal.flush()
 
 
 class Conversations:
     """
     This class is an interface to manage conversations
     """
-    def __init__(self, path: str, characters: Characters, llm) -> None:
+    def __init__(self, path: str, characters: Characters, llm, max_concurrency: int = 8,
+                 stop: Optional[List[str]] = None, max_tokens: Optional[int] = None, journal: bool = False,
+                 window_size: int = 3, window_chars: Optional[int] = None, memory: Optional[RollingSummary] = None,
+                 template: Optional[str] = None, cache: Optional[ResponseCache] = None, speculator: Optional[Speculator] = None) -> None:
         """
         @param path: path to the json file
         @param characters: Characters object
         @param llm: langchain llm object
+        @param max_concurrency: maximum number of agenerate calls waiting on the llm at once
+        @param stop: stop sequences passed to the llm, defaults to a newline as only the first line is used
+        @param max_tokens: cap on generated tokens passed to the llm, None to use the llm's own setting
+        @param journal: record changes in an append-only journal next to the json file instead of rewriting it on save
+        @param window_size: number of most recent utterances shown in the prompt, at least 1
+        @param window_chars: character budget of the utterances shown in the prompt, None for no budget
+        @param memory: RollingSummary that condenses utterances older than the window, None to drop them
+        @param template: custom prompt template using any of PROMPT_VARIABLES, None for DEFAULT_TEMPLATE
+        @param cache: ResponseCache used to skip the llm for prompts it already answered, None to always call the llm
+        @param speculator: Speculator that generates the next utterance of every possible speaker after each append, None to only call the llm when asked
         @return: None, initializes Conversations
         """
-        # TODO: Allow for custom prompt template
+        from langchain import PromptTemplate
+        self.prompt = PromptTemplate.from_template(DEFAULT_TEMPLATE if template is None else template)
+        unknown = set(self.prompt.input_variables) - PROMPT_VARIABLES
+        if unknown:
+            raise ValueError(f"The template variables in {unknown} do not exist.")
+        if window_size < 1:
+            raise ValueError(f"window_size must be at least 1, got {window_size}.")
+        self.cache = cache
         self.path = path
         self.valid = characters
         self.llm = llm
+        self.max_concurrency = max_concurrency
+        self.stop = ["\n"] if stop is None else stop
+        self.max_tokens = max_tokens
         self.conversations = {}
-        if os.path.exists(path):
-            self.conversations = json.load(open(path, 'r', encoding='utf-8'))
+        self.window_size = window_size
+        self.window_chars = window_chars
+        self._windows = {} # context - deque of the last window_size formatted utterances
+        self.memory = memory
+        self.speculator = speculator
+        self._turn_inputs = {} # context - (history, muted) of the last turn, reused by speculations
+        # asyncio primitives are bound to the event loop they are used in
+        self._loop = None
+        self._semaphore = None
+        self._locks = {}
+        self.journal = None
+        if journal:
+            self.journal = Journal(path)
+            conversations = self.journal.snapshot()
+        elif os.path.exists(path):
+            conversations = json.load(open(path, 'r', encoding='utf-8'))
+        else:
+            conversations = {}
+        for context, convo in conversations.items():
+            self._apply("new", context, convo)
+        if journal:
+            for op, key, value in self.journal.replay():
+                self._apply(op, key, value)
+        if memory is not None and os.path.exists(self._summary_path()):
+            summaries = json.load(open(self._summary_path(), 'r', encoding='utf-8'))
+            # A summary is only kept if the log it covers was saved too
+            memory.load({context: summary for context, summary in summaries.items()
+                         if context in self.conversations and summary[1] <= len(self.conversations[context]["log"])})
 
     def context_out(self, context: str) -> ValueError:
         """
@@ -146,7 +283,7 @@ class Conversations:
         """
         self.valid_participants(participants)
         self.context_in(context)
-        self.conversations[context] = {"participants": participants, "log": []}
+        self._change("new", context, {"participants": participants, "log": []})
 
     def update(self, context: str, participants: Set[str], log: List[List[str]]) -> None:
         """
@@ -157,7 +294,11 @@ class Conversations:
         """
         self.valid_participants(participants)
         self.context_out(context)
-        self.conversations[context] = {"participants": participants, "log": log}
+        self._change("update", context, {"participants": participants, "log": log})
+        if self.memory is not None:
+            self.memory.discard(context)
+        if self.speculator is not None:
+            self.speculator.cancel(context)
 
     def delete(self, context: str) -> None:
         """
@@ -165,7 +306,12 @@ class Conversations:
         @return: None, deletes conversation
         """
         self.context_out(context)
-        self.conversations.pop(context)
+        self._change("delete", context)
+        if self.memory is not None:
+            self.memory.discard(context)
+        if self.speculator is not None:
+            self.speculator.cancel(context)
+            self._turn_inputs.pop(context, None)
 
     def append(self, context: str, speaker: str, utterance: str) -> None:
         """
@@ -174,61 +320,387 @@ class Conversations:
         @param utterance: utterance of the speaker
         @return: None, appends utterance to the conversation
         """
-        self.valid_participants({speaker})
+        with metrics.span("conversations.append"):
+            self.valid_participants({speaker})
+            self.context_out(context)
+            self._change("append", context, {"index": len(self.conversations[context]["log"]), "entry": [speaker, utterance]})
+            if self.memory is not None:
+                self.memory.update(context, self.conversations[context]["log"], self.window_size)
+            if self.speculator is not None:
+                self._speculate(context)
+
+    def _apply(self, op: str, context: str, value: Dict[str, Any]) -> None:
+        """
+        Replaying a journal on top of a newer snapshot must not change it, so appends carry the log index they expect.
+        @param op: one of new, update, delete, append
+        @param context: unique context of the conversation
+        @param value: conversation for new and update, index and [speaker, utterance] for append
+        @return: None, applies a change to Conversations
+        """
+        if op == "delete":
+            self.conversations.pop(context, None)
+            self._locks.pop(context, None)
+            self._windows.pop(context, None)
+        elif op == "append":
+            convo = self.conversations.get(context)
+            if convo is not None and len(convo["log"]) == value["index"]:
+                convo["log"].append(value["entry"])
+                self._windows[context].append(self._format(*value["entry"]))
+        else:
+            log = list(value["log"])
+            self.conversations[context] = {"participants": set(value["participants"]), "log": log}
+            self._windows[context] = deque((self._format(speaker, utterance) for speaker, utterance in log[-self.window_size:]),
+                                           maxlen=self.window_size)
+
+    @staticmethod
+    def _format(speaker: str, utterance: str) -> str:
+        """
+        @param speaker: name of the speaker
+        @param utterance: utterance of the speaker
+        @return: the utterance as a line of the prompt
+        """
+        return f"{speaker}: {utterance}"
+
+    def window(self, context: str) -> str:
+        """
+        Costs O(window_size) regardless of the length of the log.
+        @param context: unique context of the conversation
+        @return: the most recent utterances that fit in window_size and window_chars, the latest one is always included
+        """
         self.context_out(context)
-        self.conversations[context]["log"].append([speaker, utterance])
+        lines = []
+        size = 0
+        for line in reversed(self._windows[context]):
+            size += len(line) + 1
+            if lines and self.window_chars is not None and size > self.window_chars:
+                break
+            lines.append(line)
+        return '\n'.join(reversed(lines))
 
-    def generate(self, context: str, history: str, muted: Set[str]) -> List[str]:
+    def _change(self, op: str, context: str, value: Dict[str, Any] = None) -> None:
         """
+        @param op: one of new, update, delete, append
         @param context: unique context of the conversation
+        @param value: conversation for new and update, index and [speaker, utterance] for append
+        @return: None, applies a change to Conversations and records it in the journal
+        """
+        self._apply(op, context, value)
+        if self.journal is not None:
+            self.journal.record(op, context, value)
+
+    def _prepare(self, context: str, history: str, muted: Set[str]) -> Tuple[str, 'PromptValue']:
+        """
+        @param context: unique context of the conversation
+        @param history: relevant pieces of information for the prompt
         @param muted: list of muted characters
-        @return: speaker and generated utterance
+        @return: next speaker and the prompt for the next utterance
         """
-        #TODO: find a smarter way to choose next character
-        #TODO: Find a smarter way to get a single response.
-        #TODO: memory for conversation log overflow
-        #TODO: memory for the context
-        #TODO: memory for the character background
-        self.valid_participants(muted)
+        with metrics.span("conversations.prepare"):
+            #TODO: find a smarter way to choose next character
+            #TODO: memory for the context
+            self.valid_participants(muted)
+
+            convo = self.get(context)
+
+            convo_speakers = convo["participants"]
+            unmuted = convo_speakers.difference(muted)
+            if not unmuted:
+                raise ValueError(f"Conversation {context} has no unmuted participant.")
+            # random.sample no longer accepts sets
+            next_speaker = random.choice(sorted(unmuted))
+            if self.speculator is not None:
+                self._turn_inputs[context] = (history, set(muted))
+            # Never waits on the summarizer, the latest finished summary is used
+            summary = self.memory.get(context) if self.memory is not None else ""
+            return next_speaker, self._prompt(context, history, next_speaker, self.window(context), summary)
+
+    def _prompt(self, context: str, history: str, speaker: str, log_str: str, summary: str) -> 'PromptValue':
+        """
+        @param context: unique context of the conversation
+        @param history: relevant pieces of information for the prompt
+        @param speaker: next speaker
+        @param log_str: conversation window
+        @param summary: summary of the earlier conversation, empty if there is none
+        @return: the prompt for the next utterance of speaker
+        """
+        bg = self.valid.background(speaker, log_str) if "background" in self.prompt.input_variables else ""
+        if summary:
+            summary = f"Summary of the earlier conversation:\n{summary}\n\n"
 
-        convo = self.get(context)
+        inputs = {"context": context, "background": bg, "history": history,
+                  "summary": summary, "log": log_str, "speaker": speaker}
+        return self.prompt.format_prompt(**{name: inputs[name] for name in self.prompt.input_variables})
 
-        convo_speakers = convo["participants"]
-        unmuted = convo_speakers.difference(muted)
-        next_speaker = random.sample(unmuted, 1)[0]
-        bg = self.valid.get(next_speaker)
+    def _speculate(self, context: str) -> None:
+        """
+        Uses the history and muted characters of the last turn. The prompts are rendered and sent to the llm in the background.
+        @param context: unique context of the conversation
+        @return: None, replaces the speculations of the conversation with one per unmuted participant
+        """
+        self.speculator.cancel(context)
+        history, muted = self._turn_inputs.get(context, ("", set()))
+        log_str = self.window(context)
+        summary = self.memory.get(context) if self.memory is not None else ""
+        for speaker in sorted(self.conversations[context]["participants"].difference(muted)):
+            self.speculator.submit(context, speaker, lambda speaker=speaker: self._prompt(context, history, speaker, log_str, summary),
+                                   lambda prompt: self._complete([prompt])[0])
 
-        convo_log = convo["log"]
-        log_str = '\n'.join([f"{speaker}: {utterance}" for speaker, utterance in convo_log])
-        # get last 3 lines of log
+    def _speculated(self, context: str, speaker: str, prompt: 'PromptValue') -> Optional[Future]:
+        """
+        @param context: unique context of the conversation
+        @param speaker: speaker of the turn
+        @param prompt: rendered prompt of the turn
+        @return: future of the speculative completion of the same prompt, None without speculator or on a miss
+        """
+        if self.speculator is None:
+            return None
+        return self.speculator.take(context, speaker, prompt.to_string())
+
+    @staticmethod
+    def _speculation_output(future: Optional[Future]) -> Optional[str]:
+        """
+        @param future: future from _speculated
+        @return: the speculative completion, None on a miss or if the speculation failed and the turn has to call the llm itself
+        """
+        if future is None:
+            return None
         try:
-            log_str = '\n'.join(log_str.split('\n')[-3:])
-        except IndexError:
-            pass
-
-        template = "Context:\n"\
-        "{context}\n"\
-        "\n"\
-        "Background:\n"\
-        "{background}\n"\
-        "\n"\
-        "Relevant pieces of information:\n"\
-        "{history}\n"\
-        "(Only use if relevant to the conversation)\n"\
-        "\n"\
-        "Conversation:\n"\
-        "{log}\n"\
-        "{speaker}:"
-
-        prompt = PromptTemplate(template=template,
-                                input_variables=["context", "background",
-                                "history", "log", "speaker"])
-        chain = LLMChain(prompt=prompt, llm=self.llm)
-
-        output = chain.run({"context": context, "background": bg, "history": history, "log": log_str, "speaker": next_speaker})
+            return future.result()
+        except Exception:
+            return None
+
+    def _llm_kwargs(self) -> Dict[str, Any]:
+        """
+        @return: extra keyword arguments for the llm call
+        """
+        if self.max_tokens is None:
+            return {}
+        return {"max_tokens": self.max_tokens}
+
+    @staticmethod
+    def _first_line(output: str) -> str:
+        """
+        @param output: raw llm completion
+        @return: the utterance, i.e. the first line of the completion
+        """
+        #TODO: Find a smarter way to get a single response.
         if output != "":
             output = output.split('\n')[0].lstrip()
-        self.append(context, next_speaker, output)
+        return output
+
+    def _cache_key(self, prompt: 'PromptValue') -> str:
+        """
+        @param prompt: rendered prompt
+        @return: response cache key of the prompt with the current llm parameters
+        """
+        llm_params = self.llm.dict() if hasattr(self.llm, "dict") else repr(self.llm)
+        return self.cache.key(prompt.to_string(), {"llm": llm_params, "stop": self.stop, "max_tokens": self.max_tokens})
+
+    def _complete(self, prompts: List['PromptValue']) -> List[str]:
+        """
+        @param prompts: rendered prompts
+        @return: llm completion of each prompt, only prompts missing from the cache are sent to the llm in one batch
+        """
+        outputs = [None] * len(prompts)
+        keys = [None] * len(prompts)
+        if self.cache is not None:
+            for i, prompt in enumerate(prompts):
+                keys[i] = self._cache_key(prompt)
+                outputs[i] = self.cache.get(keys[i])
+        missing = [i for i, output in enumerate(outputs) if output is None]
+        if missing:
+            if metrics.enabled():
+                metrics.value("conversations.llm_batch_size", len(missing))
+                for i in missing:
+                    metrics.prompt("conversations.llm_prompt", prompts[i].to_string())
+            with metrics.span("conversations.llm"):
+                result = self.llm.generate_prompt([prompts[i] for i in missing], self.stop, **self._llm_kwargs())
+            for i, generation in zip(missing, result.generations):
+                outputs[i] = generation[0].text
+                if self.cache is not None:
+                    self.cache.put(keys[i], outputs[i])
+        return outputs
+
+    async def _acomplete(self, prompt: 'PromptValue') -> str:
+        """
+        @param prompt: rendered prompt
+        @return: llm completion of the prompt, from the cache if possible
+        """
+        key = None
+        if self.cache is not None:
+            key = self._cache_key(prompt)
+            output = self.cache.get(key)
+            if output is not None:
+                return output
+        if metrics.enabled():
+            metrics.prompt("conversations.llm_prompt", prompt.to_string())
+        with metrics.span("conversations.llm"):
+            try:
+                result = await self.llm.agenerate_prompt([prompt], self.stop, **self._llm_kwargs())
+            except NotImplementedError:
+                # llm has no async support, run the blocking call off the event loop
+                result = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: self.llm.generate_prompt([prompt], self.stop, **self._llm_kwargs()))
+        output = result.generations[0][0].text
+        if self.cache is not None:
+            self.cache.put(key, output)
+        return output
+
+    def generate(self, context: str, history: str, muted: Set[str]) -> List[str]:
+        """
+        @param context: unique context of the conversation
+        @param muted: list of muted characters
+        @return: speaker and generated utterance
+        """
+        with metrics.span("conversations.generate"):
+            next_speaker, prompt = self._prepare(context, history, muted)
+            output = self._speculation_output(self._speculated(context, next_speaker, prompt))
+            if output is None:
+                output = self._complete([prompt])[0]
+            with metrics.span("conversations.postprocess"):
+                output = self._first_line(output)
+            self.append(context, next_speaker, output)
+        return [next_speaker, output]
+
+    def generate_many(self, requests: List[Tuple[str, str, Set[str]]]) -> List[Any]:
+        """
+        Generate the next utterance of several conversations with a single batched llm call.
+        A failing request does not fail the rest of the batch.
+        @param requests: list of (context, history, muted), each context at most once
+        @return: in request order, speaker and generated utterance, or the exception raised for that request
+        """
+        metrics.value("conversations.generate_many_size", len(requests))
+        results = [None] * len(requests)
+        prepared = [] # (request index, context, speaker, prompt)
+        seen = set()
+        for i, (context, history, muted) in enumerate(requests):
+            try:
+                if context in seen:
+                    raise ValueError(f"Conversation {context} appears more than once in the batch.")
+                seen.add(context)
+                next_speaker, prompt = self._prepare(context, history, muted)
+            except ValueError as e:
+                results[i] = e
+                continue
+            prepared.append((i, context, next_speaker, prompt))
+
+        if not prepared:
+            return results
+
+        try:
+            outputs = self._complete([prompt for _, _, _, prompt in prepared])
+        except Exception as e:
+            for i, _, _, _ in prepared:
+                results[i] = e
+            return results
+
+        for (i, context, next_speaker, _), output in zip(prepared, outputs):
+            output = self._first_line(output)
+            self.append(context, next_speaker, output)
+            results[i] = [next_speaker, output]
+        return results
+
+    def generate_stream(self, context: str, history: str, muted: Set[str]) -> Iterator[List[str]]:
+        """
+        Streaming version of generate. Tokens are yielded as the llm produces them and the llm stream
+        is abandoned as soon as the first line is complete. The utterance is appended to the log before
+        its last piece is yielded. Token by token output requires an llm with streaming enabled,
+        other llms yield the whole utterance at once.
+        @param context: unique context of the conversation
+        @param muted: list of muted characters
+        @return: generator of [speaker, token]
+        """
+        next_speaker, prompt = self._prepare(context, history, muted)
+        key = None
+        output = self._speculation_output(self._speculated(context, next_speaker, prompt))
+        if self.cache is not None:
+            key = self._cache_key(prompt)
+            if output is None:
+                output = self.cache.get(key)
+        if output is not None:
+            output = self._first_line(output)
+            self.append(context, next_speaker, output)
+            if output:
+                yield [next_speaker, output]
+            return
+
+        handler = _token_queue_handler()()
+
+        def produce() -> None:
+            try:
+                if metrics.enabled():
+                    metrics.prompt("conversations.llm_prompt", prompt.to_string())
+                with metrics.span("conversations.llm_stream"):
+                    result = self.llm.generate_prompt([prompt], self.stop, callbacks=[handler], **self._llm_kwargs())
+                handler.tokens.put((True, result.generations[0][0].text))
+            except Exception as e:
+                handler.tokens.put((True, e))
+
+        threading.Thread(target=produce, daemon=True).start()
+
+        text = "" # everything received so far
+        sent = "" # part of the utterance already yielded
+        try:
+            while True:
+                done, token = handler.tokens.get()
+                if isinstance(token, Exception):
+                    raise token
+                # The final message carries the full completion, the only message for non streaming llms
+                text = token if done else text + token
+                complete = done or '\n' in text
+                utterance = self._first_line(text) if complete else text.lstrip()
+                if complete:
+                    handler.stopped = True
+                    if self.cache is not None:
+                        self.cache.put(key, utterance)
+                    self.append(context, next_speaker, utterance)
+                if len(utterance) > len(sent):
+                    yield [next_speaker, utterance[len(sent):]]
+                    sent = utterance
+                if complete:
+                    return
+        finally:
+            handler.stopped = True
+
+    def _async_primitives(self, context: str) -> Tuple[asyncio.Lock, asyncio.Semaphore]:
+        """
+        @param context: unique context of the conversation
+        @return: lock of the context and the shared concurrency limit for the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._locks = {}
+        if context not in self._locks:
+            self._locks[context] = asyncio.Lock()
+        return self._locks[context], self._semaphore
+
+    async def agenerate(self, context: str, history: str, muted: Set[str]) -> List[str]:
+        """
+        Coroutine version of generate. Turns in the same context run one at a time,
+        turns in different contexts run concurrently, up to max_concurrency at once.
+        @param context: unique context of the conversation
+        @param muted: list of muted characters
+        @return: speaker and generated utterance
+        """
+        lock, semaphore = self._async_primitives(context)
+        with metrics.span("conversations.agenerate"):
+            async with lock:
+                next_speaker, prompt = self._prepare(context, history, muted)
+                output = None
+                future = self._speculated(context, next_speaker, prompt)
+                if future is not None:
+                    try:
+                        output = await asyncio.wrap_future(future)
+                    except Exception:
+                        pass # failed speculation, the turn calls the llm itself
+                if output is None:
+                    async with semaphore:
+                        output = await self._acomplete(prompt)
+                with metrics.span("conversations.postprocess"):
+                    output = self._first_line(output)
+                self.append(context, next_speaker, output)
         return [next_speaker, output]
 
     def __str__(self) -> str:
@@ -237,8 +709,48 @@ class Conversations:
         """
         return str(self.conversations)
 
+    def _summary_path(self) -> str:
+        """
+        @return: path of the json file storing the summaries of memory, next to the conversations
+        """
+        return self.path + ".summaries.json"
+
     def save(self) -> None:
         """
-        @return: None, saves Conversations to json file
+        @return: None, saves Conversations to json file, or flushes the journal when journaling. The summaries of memory are saved next to it.
         """
-        json.dump(self.conversations, open(self.path, 'w', encoding='utf-8'))
+        if self.journal is None:
+            write_json_atomic(self.path, self.conversations)
+        elif self.journal.needs_compaction():
+            self.journal.compact(self.conversations)
+        else:
+            self.journal.flush()
+        if self.memory is not None:
+            write_json_atomic(self._summary_path(), self.memory.to_dict())
+
+
+class _StopStream(Exception):
+    """Raised inside the llm callback to abandon a stream once the utterance is complete"""
+
+
+@functools.lru_cache(maxsize=None)
+def _token_queue_handler() -> type:
+    """
+    @return: the callback handler class of generate_stream, defined on first use as it subclasses a langchain class
+    """
+    from langchain.callbacks.base import BaseCallbackHandler
+
+    class _TokenQueueHandler(BaseCallbackHandler):
+        """Callback handler forwarding streamed tokens to generate_stream"""
+        raise_error = True
+
+        def __init__(self) -> None:
+            self.tokens = queue.Queue() # (done, token) while streaming, (True, completion or exception) when done
+            self.stopped = False
+
+        def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+            if self.stopped:
+                raise _StopStream()
+            self.tokens.put((False, token))
+
+    return _TokenQueueHandler
@@ -0,0 +1,124 @@
+"""
+This file contains the response cache used by Conversations to skip repeated llm calls
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from lifelike import metrics
+
+
+class ResponseCache:
+    """
+    This class is an LRU cache of llm completions keyed by the rendered prompt and llm parameters.
+    Entries can expire after a ttl and can be kept in an on-disk sqlite tier that survives restarts.
+    """
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None, path: Optional[str] = None) -> None:
+        """
+        @param max_size: maximum number of completions kept in memory
+        @param ttl: seconds before an entry expires, None to never expire
+        @param path: path to a sqlite file used as a second tier, None to only cache in memory
+        @return: None, initializes ResponseCache
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key - (completion, expiry time or None)
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+            self._db.commit()
+
+    @staticmethod
+    def key(prompt: str, params: Dict[str, Any]) -> str:
+        """
+        @param prompt: rendered prompt
+        @param params: llm parameters that change the completion
+        @return: cache key of the completion
+        """
+        payload = json.dumps([prompt, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        @param key: cache key from key()
+        @return: cached completion, None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], row[1])
+                    self._remember(key, entry)
+            if entry is None or (entry[1] is not None and entry[1] < now):
+                if entry is not None:
+                    self._forget(key)
+                self.misses += 1
+                metrics.count("response_cache.misses")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.count("response_cache.hits")
+            return entry[0]
+
+    def put(self, key: str, value: str) -> None:
+        """
+        @param key: cache key from key()
+        @param value: completion
+        @return: None, stores the completion
+        """
+        entry = (value, None if self.ttl is None else time.time() + self.ttl)
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, entry[0], entry[1]))
+                self._db.commit()
+
+    def _remember(self, key: str, entry: tuple) -> None:
+        """
+        @param key: cache key
+        @param entry: (completion, expiry time)
+        @return: None, stores the entry in memory and evicts the least recently used ones
+        """
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _forget(self, key: str) -> None:
+        """
+        @param key: cache key
+        @return: None, removes an expired entry from both tiers
+        """
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+
+    def clear(self) -> None:
+        """
+        @return: None, removes every entry and resets the counters
+        """
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        @return: hit and miss counters and the number of entries in memory
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
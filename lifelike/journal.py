@@ -0,0 +1,151 @@
+"""
+This file contains the append-only journal storage used by Characters and Conversations
+"""
+import json
+import os
+from typing import Any, Dict, Iterator, Tuple
+
+
+def encode(obj: Any) -> Any:
+    """
+    @param obj: object json cannot serialize natively
+    @return: json friendly version of obj, sets become sorted lists
+    """
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def write_json_atomic(path: str, data: Any) -> None:
+    """
+    @param path: path to the json file
+    @param data: json serializable data
+    @return: None, replaces the file so that a crash leaves either the old or the new content
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, default=encode)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path)
+
+
+def _fsync_dir(path: str) -> None:
+    """
+    @param path: path of a file whose directory entry changed
+    @return: None, persists the rename on platforms that allow it
+    """
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """
+    Append-only log of new/append/update/delete operations next to a json snapshot.
+    The snapshot lives at path and keeps the plain json format, the log at path + ".journal".
+    Operations must be idempotent when replayed in order on top of a newer snapshot,
+    as a crash between writing the snapshot and truncating the log replays the whole log.
+    """
+    def __init__(self, path: str, fsync_every: int = 64, compact_every: int = 10000) -> None:
+        """
+        @param path: path to the json snapshot
+        @param fsync_every: number of records buffered before they are forced to disk
+        @param compact_every: number of records in the log before save() rewrites the snapshot
+        @return: None, initializes Journal
+        """
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.fsync_every = fsync_every
+        self.compact_every = compact_every
+        self.pending = 0 # records not yet forced to disk
+        self.records = 0 # records in the log
+        self._file = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        @return: content of the snapshot, empty if there is none
+        """
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def replay(self) -> Iterator[Tuple[str, str, Any]]:
+        """
+        Reads the log back. A torn last record left by a crash is dropped from the file.
+        @return: generator of (op, key, value) in the order they were recorded
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        good = 0 # offset right after the last complete record
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    op, key, value = json.loads(line)
+                except ValueError:
+                    break
+                good += len(line)
+                self.records += 1
+                yield op, key, value
+        if good != os.path.getsize(self.journal_path):
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(good)
+
+    def record(self, op: str, key: str, value: Any = None) -> None:
+        """
+        @param op: name of the operation
+        @param key: key of the changed entry
+        @param value: payload of the operation
+        @return: None, appends the operation to the log
+        """
+        if self._file is None:
+            self._file = open(self.journal_path, 'a', encoding='utf-8')
+        self._file.write(json.dumps([op, key, value], default=encode) + "\n")
+        self.pending += 1
+        self.records += 1
+        if self.pending >= self.fsync_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        @return: None, forces recorded operations to disk
+        """
+        if self._file is not None and self.pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self.pending = 0
+
+    def needs_compaction(self) -> bool:
+        """
+        @return: whether the log grew past compact_every
+        """
+        return self.records >= self.compact_every
+
+    def compact(self, state: Any) -> None:
+        """
+        @param state: full current state, must include every recorded operation
+        @return: None, writes state as the new snapshot and empties the log
+        """
+        self.flush()
+        write_json_atomic(self.path, state)
+        self.close()
+        with open(self.journal_path, 'w', encoding='utf-8') as f:
+            os.fsync(f.fileno())
+        self.records = 0
+
+    def close(self) -> None:
+        """
+        @return: None, flushes and closes the log file
+        """
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
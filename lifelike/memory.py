@@ -0,0 +1,121 @@
+"""
+This file contains the rolling summary memory used by Conversations for conversation log overflow
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from lifelike import metrics
+
+
+SUMMARY_TEMPLATE = "Summary so far:\n"\
+"{summary}\n"\
+"\n"\
+"New lines of the conversation:\n"\
+"{lines}\n"\
+"\n"\
+"Write a short summary of the whole conversation, including the summary so far:\n"
+
+
+class RollingSummary:
+    """
+    This class condenses the older part of conversation logs into a summary.
+    Summaries are written by a background worker, so reading one never waits on the llm.
+    """
+    def __init__(self, llm, threshold: int = 20, max_chars: int = 1000) -> None:
+        """
+        @param llm: langchain llm object used to write summaries
+        @param threshold: number of unsummarized utterances before the window that triggers a new summary
+        @param max_chars: maximum length of a summary
+        @return: None, initializes RollingSummary
+        """
+        self.llm = llm
+        self.threshold = threshold
+        self.max_chars = max_chars
+        self.summaries = {} # context - (summary, number of log entries it covers)
+        self._versions = {} # context - bumped when the log is replaced, so in flight summaries are dropped
+        self._pending = set() # contexts with a summary in flight
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lifelike-summary")
+
+    def get(self, context: str) -> str:
+        """
+        @param context: unique context of the conversation
+        @return: latest finished summary of the conversation, empty if there is none yet
+        """
+        return self.summaries.get(context, ("", 0))[0]
+
+    def update(self, context: str, log: List[List[str]], keep: int) -> None:
+        """
+        Schedules a new summary if enough utterances fell out of the window. Returns immediately.
+        @param context: unique context of the conversation
+        @param log: list of [speaker, utterance]
+        @param keep: number of most recent utterances still shown in the prompt
+        @return: None
+        """
+        with self._lock:
+            summary, covered = self.summaries.get(context, ("", 0))
+            end = len(log) - keep
+            if end - covered < self.threshold or context in self._pending:
+                return
+            lines = [f"{speaker}: {utterance}" for speaker, utterance in log[covered:end]]
+            self._pending.add(context)
+            version = self._versions.get(context, 0)
+        self._executor.submit(self._summarize, context, version, summary, lines, covered)
+
+    def _summarize(self, context: str, version: int, summary: str, lines: List[str], start: int) -> None:
+        """
+        The lines are summarized in chunks of at most 2 * threshold to bound the prompt, each chunk is folded into the summary of the previous one.
+        @param context: unique context of the conversation
+        @param version: version of the log the lines were taken from
+        @param summary: previous summary
+        @param lines: formatted utterances to add to the summary
+        @param start: number of log entries covered by the previous summary
+        @return: None, stores the summary after each chunk. On failure the summary of the last finished chunk is kept.
+        """
+        try:
+            size = 2 * self.threshold
+            for i in range(0, len(lines), size):
+                chunk = lines[i:i + size]
+                with metrics.span("summary.llm"):
+                    output = self.llm.predict(SUMMARY_TEMPLATE.format(summary=summary or "(none)", lines='\n'.join(chunk)))
+                summary = output.strip()[:self.max_chars]
+                with self._lock:
+                    if self._versions.get(context, 0) != version:
+                        return
+                    self.summaries[context] = (summary, start + i + len(chunk))
+        except Exception as e:
+            print(f"Summary of conversation {context} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(context)
+
+    def discard(self, context: str) -> None:
+        """
+        @param context: unique context of the conversation
+        @return: None, forgets the summary of a conversation whose log was replaced or deleted
+        """
+        with self._lock:
+            self.summaries.pop(context, None)
+            self._versions[context] = self._versions.get(context, 0) + 1
+
+    def to_dict(self) -> Dict[str, Tuple[str, int]]:
+        """
+        @return: summaries that can be serialized with json
+        """
+        with self._lock:
+            return {context: list(summary) for context, summary in self.summaries.items()}
+
+    def load(self, summaries: Dict[str, Tuple[str, int]]) -> None:
+        """
+        @param summaries: the result of to_dict()
+        @return: None, restores summaries
+        """
+        with self._lock:
+            self.summaries.update({context: tuple(summary) for context, summary in summaries.items()})
+
+    def wait(self) -> None:
+        """
+        @return: None, blocks until every scheduled summary is finished
+        """
+        self._executor.submit(lambda: None).result()
@@ -0,0 +1,374 @@
+"""
+This file contains the instrumentation of Conversations and game trees: timing spans, counters and observed values, sent to hooks.
+Nothing is recorded until a hook is added, a disabled span costs one function call.
+    histograms = metrics.Histograms()
+    metrics.add_hook(histograms)
+    ...
+    histograms.summary()["conversations.llm"]["p99"]
+"""
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional
+
+
+_hooks = [] # Registered hooks, replaced rather than mutated so that events never iterate over a changing list
+_token_counter = None # Counts the tokens of a prompt, None to only count characters
+
+
+class Hook:
+    """
+    This class is the interface of hooks. Override the events you need, they are called on the thread that produced them.
+    """
+    def on_span(self, name: str, seconds: float, labels: Dict[str, str]) -> None:
+        """
+        @param name: name of the timed stage
+        @param seconds: duration of the stage
+        @param labels: extra dimensions of the event
+        @return: None
+        """
+
+    def on_value(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        """
+        @param name: name of the observed quantity, such as a batch size
+        @param value: observed value
+        @param labels: extra dimensions of the event
+        @return: None
+        """
+
+    def on_count(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        """
+        @param name: name of the counter
+        @param value: increment
+        @param labels: extra dimensions of the event
+        @return: None
+        """
+
+
+class _Span:
+    """Times a stage and reports it to the hooks when it ends"""
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name: str, labels: Dict[str, str]) -> None:
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> '_Span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        seconds = time.perf_counter() - self.start
+        for hook in _hooks:
+            hook.on_span(self.name, seconds, self.labels)
+
+
+class _NoSpan:
+    """Span used while no hook is registered"""
+    __slots__ = ()
+
+    def __enter__(self) -> '_NoSpan':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def enabled() -> bool:
+    """
+    @return: whether any hook is registered, to skip computing values that are only recorded
+    """
+    return bool(_hooks)
+
+
+def add_hook(hook: Hook) -> None:
+    """
+    @param hook: hook receiving every event from now on
+    @return: None
+    """
+    global _hooks
+    _hooks = _hooks + [hook]
+
+
+def remove_hook(hook: Hook) -> None:
+    """
+    @param hook: a hook added with add_hook
+    @return: None, stops sending events to it
+    """
+    global _hooks
+    _hooks = [registered for registered in _hooks if registered is not hook]
+
+
+def set_token_counter(counter: Optional[Callable[[str], int]]) -> None:
+    """
+    @param counter: returns the number of tokens of a text, such as llm.get_num_tokens. None to stop counting prompt tokens.
+    @return: None
+    """
+    global _token_counter
+    _token_counter = counter
+
+
+def span(name: str, **labels: str):
+    """
+    @param name: name of the stage
+    @param labels: extra dimensions of the event
+    @return: context manager timing the stage
+    """
+    if not _hooks:
+        return _NO_SPAN
+    return _Span(name, labels)
+
+
+def value(name: str, value: float, **labels: str) -> None:
+    """
+    @param name: name of the observed quantity
+    @param value: observed value
+    @param labels: extra dimensions of the event
+    @return: None
+    """
+    for hook in _hooks:
+        hook.on_value(name, value, labels)
+
+
+def count(name: str, value: float = 1, **labels: str) -> None:
+    """
+    @param name: name of the counter
+    @param value: increment
+    @param labels: extra dimensions of the event
+    @return: None
+    """
+    for hook in _hooks:
+        hook.on_count(name, value, labels)
+
+
+def prompt(name: str, text: str) -> None:
+    """
+    @param name: prefix of the prompt metrics
+    @param text: rendered prompt
+    @return: None, observes the characters of the prompt and its tokens if a token counter is set
+    """
+    if not _hooks:
+        return
+    value(name + "_chars", len(text))
+    if _token_counter is not None:
+        value(name + "_tokens", _token_counter(text))
+
+
+def _key(name: str, labels: Dict[str, str]) -> tuple:
+    """
+    @param name: name of the metric
+    @param labels: labels of the event
+    @return: hashable key of the series
+    """
+    return (name, tuple(sorted(labels.items()))) if labels else (name, ())
+
+
+class Histograms(Hook):
+    """
+    This class keeps spans and values in memory to report percentiles, and the totals of counters.
+    Each series keeps at most max_samples samples, picked uniformly at random once full (reservoir sampling).
+    """
+    def __init__(self, max_samples: int = 10000) -> None:
+        """
+        @param max_samples: maximum number of samples kept per series
+        @return: None, initializes Histograms
+        """
+        self.max_samples = max_samples
+        self._series = {} # (name, labels) - [number of events, sum, max, samples]
+        self._counters = {} # (name, labels) - total
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+
+    def _observe(self, name: str, observed: float, labels: Dict[str, str]) -> None:
+        """
+        @param name: name of the series
+        @param observed: sample
+        @param labels: labels of the event
+        @return: None, adds the sample to its series
+        """
+        with self._lock:
+            series = self._series.setdefault(_key(name, labels), [0, 0.0, observed, []])
+            series[0] += 1
+            series[1] += observed
+            series[2] = max(series[2], observed)
+            if len(series[3]) < self.max_samples:
+                series[3].append(observed)
+            else:
+                slot = self._random.randrange(series[0])
+                if slot < self.max_samples:
+                    series[3][slot] = observed
+
+    def on_span(self, name: str, seconds: float, labels: Dict[str, str]) -> None:
+        self._observe(name, seconds, labels)
+
+    def on_value(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        self._observe(name, value, labels)
+
+    def on_count(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        with self._lock:
+            key = _key(name, labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @staticmethod
+    def _label(key: tuple) -> str:
+        """
+        @param key: key of a series
+        @return: name of the series in reports, labels are appended as name{key=value}
+        """
+        name, labels = key
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{label}={value}" for label, value in labels) + "}"
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        @return: per series, the number of events, their mean, p50, p90, p99 and max, and per counter its total
+        """
+        with self._lock:
+            series = {key: (count, total, maximum, sorted(samples)) for key, (count, total, maximum, samples) in self._series.items()}
+            counters = dict(self._counters)
+
+        report = {}
+        for key, (count, total, maximum, samples) in series.items():
+            def percentile(q: float) -> float:
+                return samples[min(len(samples) - 1, int(q * len(samples)))]
+            report[self._label(key)] = {"count": count, "mean": total / count, "p50": percentile(0.5), "p90": percentile(0.9),
+                                        "p99": percentile(0.99), "max": maximum}
+        for key, total in counters.items():
+            report[self._label(key)] = {"total": total}
+        return report
+
+    def reset(self) -> None:
+        """
+        @return: None, forgets every sample and counter
+        """
+        with self._lock:
+            self._series.clear()
+            self._counters.clear()
+
+
+# Bucket upper bounds of the Prometheus histograms
+SECONDS_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+VALUE_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000]
+
+
+class PrometheusFile(Hook):
+    """
+    This class aggregates events into Prometheus histograms and counters, and writes them in the text exposition format,
+    for example to a file read by the node exporter textfile collector. Spans are exported in seconds as <prefix>_<name>_seconds.
+    """
+    def __init__(self, path: str, prefix: str = "lifelike", interval: Optional[float] = 10.0) -> None:
+        """
+        @param path: path of the .prom file, replaced atomically on each write
+        @param prefix: prefix of the metric names
+        @param interval: seconds between automatic writes, triggered by events. None to only write when write() is called.
+        @return: None, initializes PrometheusFile
+        """
+        self.path = path
+        self.prefix = prefix
+        self.interval = interval
+        self._histograms = {} # (metric name, labels) - [bucket counts, sum, count]
+        self._buckets = {} # metric name - bucket upper bounds
+        self._counters = {} # (metric name, labels) - total
+        self._lock = threading.Lock()
+        self._written = time.monotonic()
+
+    def _name(self, name: str, suffix: str = "") -> str:
+        """
+        @param name: name of the event
+        @param suffix: unit suffix
+        @return: valid Prometheus metric name
+        """
+        return re.sub(r"[^a-zA-Z0-9_]", "_", f"{self.prefix}_{name}{suffix}")
+
+    def _observe(self, name: str, observed: float, labels: Dict[str, str], buckets: List[float]) -> None:
+        """
+        @param name: metric name
+        @param observed: sample
+        @param labels: labels of the event
+        @param buckets: bucket upper bounds of the metric
+        @return: None, adds the sample to its histogram
+        """
+        with self._lock:
+            self._buckets.setdefault(name, buckets)
+            histogram = self._histograms.setdefault(_key(name, labels), [[0] * (len(buckets) + 1), 0.0, 0])
+            histogram[0][bisect_left(buckets, observed)] += 1
+            histogram[1] += observed
+            histogram[2] += 1
+        self._maybe_write()
+
+    def on_span(self, name: str, seconds: float, labels: Dict[str, str]) -> None:
+        self._observe(self._name(name, "_seconds"), seconds, labels, SECONDS_BUCKETS)
+
+    def on_value(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        self._observe(self._name(name), value, labels, VALUE_BUCKETS)
+
+    def on_count(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        with self._lock:
+            key = _key(self._name(name, "_total"), labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._maybe_write()
+
+    def _maybe_write(self) -> None:
+        """
+        @return: None, writes the file if interval seconds passed since the last write
+        """
+        if self.interval is not None and time.monotonic() - self._written >= self.interval:
+            self.write()
+
+    @staticmethod
+    def _labels(labels: tuple, extra: str = "") -> str:
+        """
+        @param labels: sorted (label, value) pairs
+        @param extra: extra label already formatted, such as le="0.5"
+        @return: label set in the exposition format, empty if there is no label
+        """
+        parts = ['{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for label, value in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        """
+        @return: every metric in the Prometheus text exposition format
+        """
+        with self._lock:
+            histograms = {key: (list(buckets), total, count) for key, (buckets, total, count) in self._histograms.items()}
+            counters = dict(self._counters)
+            bounds = dict(self._buckets)
+
+        lines = []
+        typed = set()
+        for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket in zip(bounds[name] + ["+Inf"], buckets):
+                cumulative += bucket
+                le = 'le="{}"'.format(bound)
+                lines.append(f"{name}_bucket{self._labels(labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+        for (name, labels), total in sorted(counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self._labels(labels)} {total}")
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> None:
+        """
+        @return: None, replaces the file with the current metrics
+        """
+        self._written = time.monotonic()
+        temporary = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(temporary, self.path)
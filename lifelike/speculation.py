@@ -0,0 +1,130 @@
+"""
+This file contains the speculator used by Conversations to generate likely next utterances before they are asked for
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from lifelike import metrics
+
+
+class Speculator:
+    """
+    This class runs speculative llm calls in the background, one per possible next speaker of a conversation.
+    A speculation is only used if the prompt it rendered is the prompt of the actual turn, so a hit returns what the llm would have been asked.
+    Speculations of a conversation are cancelled as soon as its log changes. Calls already sent to the llm finish, but their result is dropped.
+    """
+    def __init__(self, max_in_flight: int = 4) -> None:
+        """
+        @param max_in_flight: maximum number of speculative calls running at once, new speculations are skipped above it
+        @return: None, initializes Speculator
+        """
+        self.max_in_flight = max_in_flight
+        self.started = 0
+        self.skipped = 0
+        self.cancelled = 0
+        self.dropped = 0
+        self.hits = 0
+        self.misses = 0
+        self._in_flight = 0
+        self._speculations = {} # context - speaker - {"prompt": rendered prompt once known, "future": future of the completion}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="lifelike-speculation")
+
+    def submit(self, context: str, speaker: str, render: Callable[[], object], complete: Callable[[object], str]) -> bool:
+        """
+        @param context: unique context of the conversation
+        @param speaker: the next speaker this speculation is for
+        @param render: renders the prompt, called in the background
+        @param complete: returns the llm completion of a rendered prompt, called in the background
+        @return: False if the speculation was skipped because max_in_flight calls are running
+        """
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                self.skipped += 1
+                return False
+            self._in_flight += 1
+            self.started += 1
+            speculation = {"prompt": None}
+
+            def run() -> str:
+                prompt = render()
+                speculation["prompt"] = prompt.to_string()
+                return complete(prompt)
+
+            speculation["future"] = self._executor.submit(run)
+            self._speculations.setdefault(context, {})[speaker] = speculation
+        # Outside of the lock, the callback runs right away if the speculation already finished
+        speculation["future"].add_done_callback(self._done)
+        return True
+
+    def _done(self, future: Future) -> None:
+        """
+        @param future: a finished or cancelled speculation
+        @return: None, frees its in flight slot
+        """
+        with self._lock:
+            self._in_flight -= 1
+
+    def take(self, context: str, speaker: str, prompt: str) -> Optional[Future]:
+        """
+        Every speculation of the context is given up, the one matching the turn is returned.
+        @param context: unique context of the conversation
+        @param speaker: speaker of the turn
+        @param prompt: rendered prompt of the turn
+        @return: future of the completion of the same prompt, None on a miss
+        """
+        with self._lock:
+            speculations = self._speculations.pop(context, {})
+            speculation = speculations.pop(speaker, None)
+            hit = speculation is not None and speculation["prompt"] == prompt and not speculation["future"].cancelled()
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if speculation is not None:
+                    speculations[speaker] = speculation
+        metrics.count("speculation.hits" if hit else "speculation.misses")
+        self._cancel(speculations)
+        return speculation["future"] if hit else None
+
+    def cancel(self, context: str) -> None:
+        """
+        @param context: unique context of the conversation
+        @return: None, cancels the speculations of a conversation whose log changed
+        """
+        with self._lock:
+            speculations = self._speculations.pop(context, {})
+        self._cancel(speculations)
+
+    def _cancel(self, speculations: Dict[str, dict]) -> None:
+        """
+        @param speculations: speculations that will not be used
+        @return: None, cancels the ones that did not start yet, the result of the running ones is dropped
+        """
+        for speculation in speculations.values():
+            cancelled = speculation["future"].cancel()
+            with self._lock:
+                if cancelled:
+                    self.cancelled += 1
+                elif not speculation["future"].done():
+                    self.dropped += 1
+
+    def stats(self) -> Dict[str, float]:
+        """
+        @return: counters of speculations and the hit rate of the turns
+        """
+        with self._lock:
+            turns = self.hits + self.misses
+            return {"started": self.started, "skipped": self.skipped, "cancelled": self.cancelled, "dropped": self.dropped, "in_flight": self._in_flight,
+                    "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / turns if turns else 0.0}
+
+    def wait(self) -> None:
+        """
+        @return: None, blocks until every running speculation is finished
+        """
+        with self._lock:
+            futures = [speculation["future"] for speculations in self._speculations.values() for speculation in speculations.values()]
+        for future in futures:
+            if not future.cancelled():
+                future.exception()
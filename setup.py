@@ -6,8 +6,12 @@ setup(
     description='A A toolkit that allows for the creation of "lifelike" characters that you can interact with and change how they behave towards you',
     author='Mustafa Tariq and Khoa Nguyen',
     license='MIT',
-    packages=find_packages(),
+    packages=find_packages(exclude=['tests', 'tests.*']),
         install_requires=[
-        'langchain'
-    ]
+        'langchain',
+        'numpy'
+    ],
+    extras_require={
+        'chroma': ['chromadb'] # vectorstore of BaseGameTree, only needed for write_db() and get_retriever() without local
+    }
 )
@@ -0,0 +1,40 @@
+"""
+Fixtures shared by the tests. The llm and embeddings are the deterministic fakes of benchmarks/fakes.py, so the tests run offline.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from fakes import FakeLLM, HashEmbeddings, sentences # noqa: E402
+from lifelike.brain import Characters, Conversations # noqa: E402
+
+
+@pytest.fixture
+def llm() -> FakeLLM:
+    return FakeLLM()
+
+
+@pytest.fixture
+def embeddings() -> HashEmbeddings:
+    return HashEmbeddings(32)
+
+
+@pytest.fixture
+def texts() -> list:
+    return sentences(50)
+
+
+@pytest.fixture
+def characters(tmp_path) -> Characters:
+    characters = Characters(str(tmp_path / "characters.json"))
+    characters.add("A", "A baker.")
+    characters.add("B", "A smith.")
+    return characters
+
+
+@pytest.fixture
+def conversations(tmp_path, characters, llm) -> Conversations:
+    return Conversations(str(tmp_path / "conversations.json"), characters, llm)
@@ -0,0 +1,53 @@
+import time
+
+from fakes import HashEmbeddings
+from lifelike.brain import Conversations
+from lifelike.cache import ResponseCache
+from lifelike.StateManager.embeddings import CachedEmbeddings
+
+
+def test_response_cache_evicts_the_least_recently_used():
+    cache = ResponseCache(max_size=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("1", "3")
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_response_cache_expires_entries():
+    cache = ResponseCache(ttl=0.01)
+    cache.put("a", "1")
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_response_cache_sqlite_tier_survives_restarts(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    ResponseCache(path=path).put("a", "1")
+    assert ResponseCache(path=path).get("a") == "1"
+
+
+def test_generate_skips_the_llm_on_a_cached_prompt(tmp_path, characters, llm):
+    conversations = Conversations(str(tmp_path / "conversations.json"), characters, llm, cache=ResponseCache())
+    conversations.new("room", {"A"})
+    first = conversations.generate("room", "", set())
+    conversations.update("room", {"A"}, [])
+    assert conversations.generate("room", "", set()) == first
+    assert llm.calls == 1
+
+
+def test_cached_embeddings_only_embed_misses(tmp_path):
+    embeddings = HashEmbeddings(16)
+    path = str(tmp_path / "embeddings.sqlite")
+    cached = CachedEmbeddings(embeddings, "fake", path=path)
+    first = cached.embed_documents(["a", "b", "a"])
+    assert embeddings.texts == 2
+    assert cached.embed_documents(["b", "a"]) == [first[1], first[0]]
+    assert embeddings.texts == 2
+
+    restarted = CachedEmbeddings(embeddings, "fake", path=path)
+    assert restarted.embed_documents(["a"]) == [first[0]]
+    assert embeddings.texts == 2
@@ -0,0 +1,56 @@
+import numpy
+import pytest
+
+from lifelike.StateManager.base_game_tree import BaseGameTree, EdgeEmbedding
+
+
+@pytest.fixture
+def trees(embeddings, texts) -> tuple:
+    """The same edges stored in an edge_dict of EdgeEmbedding and in a CompactEdgeDict"""
+    ids = [f"n{i}" for i in range(len(texts))]
+    trees = (BaseGameTree("plain", embeddings), BaseGameTree("compact", embeddings, compact=True))
+    for tree in trees:
+        tree.add_texts(texts, ids=ids)
+        tree.add_edge("n0", "n1", "n1", tree.edge_dict[('_', 'n1')])
+    return trees
+
+
+def test_compact_matches_plain_storage(trees):
+    plain, compact = trees
+    assert list(plain.edge_dict) == list(compact.edge_dict)
+    for key in plain.edge_dict:
+        assert compact.edge_dict[key].name == plain.edge_dict[key].name
+        assert compact.edge_dict[key].weight == plain.edge_dict[key].weight
+        assert numpy.array_equal(compact.edge_dict[key].get_embedding(), plain.edge_dict[key].get_embedding())
+
+
+def test_compact_tuning_matches_plain_tuning(trees):
+    for tree in trees:
+        assert tree.tune_edge(('_', 'n5'), ["harbor lantern", "river"])
+        assert tree.tune_edge(("n0", "n1"), ["bridge"])
+    plain, compact = trees
+    for key in (('_', 'n5'), ("n0", "n1"), ('_', 'n1')):
+        assert compact.edge_dict[key].weight == plain.edge_dict[key].weight
+        assert numpy.allclose(compact.edge_dict[key].get_embedding(), plain.edge_dict[key].get_embedding(), atol=1e-6)
+
+
+def test_compact_template_copies_share_a_row_until_tuned(trees, embeddings):
+    _, compact = trees
+    template = EdgeEmbedding("template", embeddings, embeddings.embed_query("harbor"), 1)
+    compact.add_edge("n2", "n3", "n3", template)
+    compact.add_edge("n2", "n4", "n4", template)
+    table = compact.edge_dict
+    assert table.row[table.position(("n2", "n3"))] == table.row[table.position(("n2", "n4"))]
+    compact.tune_edge(("n2", "n3"), ["bridge"])
+    assert table.row[table.position(("n2", "n3"))] != table.row[table.position(("n2", "n4"))]
+    assert numpy.allclose(table[("n2", "n4")].get_embedding(), embeddings.embed_query("harbor"))
+
+
+def test_compact_removal_keeps_other_edges(trees):
+    _, compact = trees
+    expected = {key: compact.edge_dict[key].get_embedding().copy() for key in compact.edge_dict if key != ('_', 'n2')}
+    assert compact.remove_edge(('_', 'n2'))
+    assert ('_', 'n2') not in compact.edge_dict
+    assert len(compact.edge_dict) == len(expected)
+    for (key, embedding) in expected.items():
+        assert numpy.array_equal(compact.edge_dict[key].get_embedding(), embedding)
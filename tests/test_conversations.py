@@ -0,0 +1,53 @@
+import asyncio
+
+from fakes import FakeLLM
+from lifelike.brain import Conversations
+
+
+def test_generate_appends_to_the_log(conversations):
+    conversations.new("room", {"A", "B"})
+    speaker, utterance = conversations.generate("room", "", set())
+    assert speaker in {"A", "B"}
+    assert "\n" not in utterance
+    assert conversations.get("room")["log"] == [[speaker, utterance]]
+
+
+def test_generate_many_reports_all_muted_request_without_failing_the_batch(conversations):
+    conversations.new("r1", {"A", "B"})
+    conversations.new("r2", {"A", "B"})
+    valid, muted = conversations.generate_many([("r1", "", set()), ("r2", "", {"A", "B"})])
+    assert isinstance(muted, ValueError)
+    assert isinstance(valid, list)
+    assert conversations.get("r1")["log"] == [valid]
+    assert conversations.get("r2")["log"] == []
+
+
+def test_generate_many_rejects_a_context_twice(conversations):
+    conversations.new("r1", {"A", "B"})
+    first, second = conversations.generate_many([("r1", "", set()), ("r1", "", set())])
+    assert isinstance(first, list)
+    assert isinstance(second, ValueError)
+
+
+def test_agenerate_runs_contexts_concurrently(tmp_path, characters):
+    llm = FakeLLM(latency=0.1)
+    conversations = Conversations(str(tmp_path / "conversations.json"), characters, llm, max_concurrency=8)
+    for i in range(8):
+        conversations.new(f"room {i}", {"A", "B"})
+
+    async def run() -> float:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.gather(*[conversations.agenerate(f"room {i}", "", set()) for i in range(8)])
+        return loop.time() - start
+
+    assert asyncio.run(run()) < 0.4
+    assert all(len(conversations.get(f"room {i}")["log"]) == 1 for i in range(8))
+
+
+def test_window_keeps_the_last_utterances(tmp_path, characters, llm):
+    conversations = Conversations(str(tmp_path / "conversations.json"), characters, llm, window_size=2)
+    conversations.new("room", {"A", "B"})
+    for i in range(5):
+        conversations.append("room", "A", f"line {i}")
+    assert conversations.window("room") == "A: line 3\nA: line 4"
@@ -0,0 +1,42 @@
+import numpy
+import pytest
+
+from lifelike.StateManager.ann import IVFIndex
+from lifelike.StateManager.index import EdgeIndex
+
+
+@pytest.fixture
+def vectors() -> numpy.ndarray:
+    return numpy.random.default_rng(0).standard_normal((200, 16)).astype(numpy.float32)
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_edge_index_matches_brute_force(vectors, dtype):
+    index = EdgeIndex(1, dtype, lambda key: vectors[key])
+    for (i, vector) in enumerate(vectors):
+        index.upsert(i, vector)
+    scores = vectors @ vectors[7] / numpy.linalg.norm(vectors, axis=1) / numpy.linalg.norm(vectors[7])
+    assert [key for (key, _) in index.search(vectors[7], 5)] == list(numpy.argsort(-scores)[:5])
+
+
+def test_edge_index_remove_keeps_the_other_rows(vectors):
+    index = EdgeIndex(1)
+    for (i, vector) in enumerate(vectors[:10]):
+        index.upsert(i, vector)
+    assert index.remove(3)
+    assert not index.remove(3)
+    assert len(index) == 9
+    assert index.search(vectors[9], 1)[0][0] == 9
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_search_with_no_result_requested(vectors, k):
+    index = EdgeIndex(1, "int8", lambda key: vectors[key])
+    for (i, vector) in enumerate(vectors):
+        index.upsert(i, vector)
+    assert index.search(vectors[0], k) == []
+    assert index.search(vectors[:2], k) == [[], []]
+    assert index.search(vectors[0], k, rows=numpy.arange(5)) == []
+
+    ann = IVFIndex.from_edge_dict({i: type("Edge", (), {"get_embedding": lambda self, v=v: v})() for (i, v) in enumerate(vectors)}, nlist=4)
+    assert ann.search(vectors[0], k) == []
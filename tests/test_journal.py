@@ -0,0 +1,44 @@
+from lifelike.brain import Characters, Conversations
+from lifelike.journal import Journal
+
+
+def test_journal_replays_characters_and_conversations(tmp_path, llm):
+    characters = Characters(str(tmp_path / "characters.json"), journal=True)
+    characters.add("A", "A baker.")
+    characters.add("B", "A smith.")
+    characters.update("B", "A retired smith.")
+    conversations = Conversations(str(tmp_path / "conversations.json"), characters, llm, journal=True)
+    conversations.new("room", {"A", "B"})
+    conversations.append("room", "A", "Hello.")
+    characters.save()
+    conversations.save()
+
+    reloaded = Characters(str(tmp_path / "characters.json"), journal=True)
+    assert reloaded.characters == {"A": "A baker.", "B": "A retired smith."}
+    convos = Conversations(str(tmp_path / "conversations.json"), reloaded, llm, journal=True)
+    assert convos.get("room")["participants"] == {"A", "B"}
+    assert convos.get("room")["log"] == [["A", "Hello."]]
+
+
+def test_journal_compaction_keeps_the_state(tmp_path):
+    path = str(tmp_path / "state.json")
+    journal = Journal(path, compact_every=2)
+    journal.record("add", "A", "first")
+    journal.record("add", "B", "second")
+    assert journal.needs_compaction()
+    journal.compact({"A": "first", "B": "second"})
+
+    reopened = Journal(path)
+    assert reopened.snapshot() == {"A": "first", "B": "second"}
+    assert list(reopened.replay()) == []
+
+
+def test_journal_ignores_a_torn_last_line(tmp_path):
+    path = str(tmp_path / "state.json")
+    journal = Journal(path)
+    journal.record("add", "A", "first")
+    journal.close()
+    with open(journal.journal_path, "a", encoding="utf-8") as f:
+        f.write('["add", "B", "sec')
+
+    assert list(Journal(path).replay()) == [("add", "A", "first")]
@@ -0,0 +1,39 @@
+from lifelike.brain import Conversations
+from lifelike.memory import RollingSummary
+
+
+class RecordingLLM:
+    """Answers every summary prompt with its number and keeps the prompts"""
+    def __init__(self) -> None:
+        self.prompts = []
+
+    def predict(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        return f"summary {len(self.prompts)}"
+
+
+def test_a_long_backlog_is_summarized_in_bounded_chunks():
+    llm = RecordingLLM()
+    memory = RollingSummary(llm, threshold=2)
+    log = [["A", f"line {i}"] for i in range(10)]
+    memory.update("room", log, 1)
+    memory.wait()
+
+    assert len(llm.prompts) == 3
+    for i in range(9):
+        assert sum(f"A: line {i}\n" in prompt for prompt in llm.prompts) == 1
+    assert "summary 1" in llm.prompts[1] and "summary 2" in llm.prompts[2]
+    assert memory.summaries["room"] == ("summary 3", 9)
+
+
+def test_summaries_survive_save_and_load(tmp_path, characters, llm):
+    path = str(tmp_path / "conversations.json")
+    conversations = Conversations(path, characters, llm, window_size=1, memory=RollingSummary(RecordingLLM(), threshold=2))
+    conversations.new("room", {"A", "B"})
+    for i in range(4):
+        conversations.append("room", "A", f"line {i}")
+    conversations.memory.wait()
+    conversations.save()
+
+    reloaded = Conversations(path, characters, llm, window_size=1, memory=RollingSummary(RecordingLLM(), threshold=2))
+    assert reloaded.memory.get("room") == conversations.memory.get("room") != ""
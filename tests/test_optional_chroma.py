@@ -0,0 +1,23 @@
+import sys
+
+import pytest
+
+from lifelike.StateManager.knowledge_tree import KnowledgeTree
+
+
+@pytest.fixture
+def no_chromadb(monkeypatch):
+    """import chromadb raises ImportError"""
+    monkeypatch.setitem(sys.modules, "chromadb", None)
+
+
+def test_knowledge_tree_builds_and_searches_without_chromadb(no_chromadb, embeddings, texts):
+    tree = KnowledgeTree.from_texts("no-chroma", texts, embeddings, chunk_size=16)
+    assert len(tree.node_dict) == len(texts)
+    documents = tree.get_retriever(local=True, search_kwargs={"k": 1}).get_relevant_documents(texts[42])
+    assert documents[0].page_content == texts[42]
+
+
+def test_vectorstore_without_chromadb_names_the_extra(no_chromadb, embeddings, texts):
+    with pytest.raises(ImportError, match=r"lifelike\[chroma\]"):
+        KnowledgeTree.from_texts("no-chroma", texts, embeddings, write_db=True)
@@ -0,0 +1,52 @@
+import numpy
+import pytest
+
+from lifelike.StateManager.base_game_tree import BaseGameTree, EdgeEmbedding
+
+
+def test_tuning_with_no_prompt_leaves_the_edge_unchanged(embeddings, texts):
+    for compact in (False, True):
+        tree = BaseGameTree("empty-tune", embeddings, compact=compact)
+        tree.add_texts(texts[:3], ids=["a", "b", "c"])
+        before = tree.edge_dict[('_', 'a')].get_embedding().copy()
+        assert tree.tune_edge(('_', 'a'), [])
+        assert numpy.array_equal(tree.edge_dict[('_', 'a')].get_embedding(), before)
+        assert tree.edge_dict[('_', 'a')].weight == 20
+
+
+def test_edges_keep_no_running_sum(embeddings):
+    edge = EdgeEmbedding("a", embeddings)
+    edge.tune_prompts(["harbor", "violin"])
+    assert edge.__slots__ == ("name", "_final", "embed", "embedding", "weight")
+    assert numpy.allclose(edge.get_embedding(), numpy.mean(embeddings.embed_documents(["harbor", "violin"]), 0))
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_quantized_compact_tuning_tracks_the_mean(dtype):
+    rng = numpy.random.default_rng(0)
+    prompts = rng.standard_normal((500, 16)).astype(numpy.float32)
+
+    class Embeddings:
+        def embed_documents(self, texts: list) -> list:
+            return [prompts[int(text)] for text in texts]
+
+    tree = BaseGameTree("quantized-tune", Embeddings(), compact=True, dtype=dtype)
+    tree.add_texts(["node"], ids=["a"], custom_embeddings=[numpy.zeros(16)])
+    tree.edge_dict[('_', 'a')] = EdgeEmbedding("a", tree.embed)
+    for i in range(len(prompts)):
+        tree.tune_edge(('_', 'a'), [str(i)])
+
+    mean = prompts.astype(numpy.float64).mean(0)
+    step = {"float32": 1e-6, "float16": 1e-3, "int8": numpy.abs(mean).max() / 127}[dtype]
+    assert numpy.abs(tree.edge_dict[('_', 'a')].get_embedding() - mean).max() <= step
+    assert bool(tree.edge_dict.totals) == (dtype != "float32")
+
+
+def test_index_of_a_quantized_compact_tree_does_not_rescore(embeddings, texts):
+    plain = BaseGameTree("plain", embeddings, dtype="int8")
+    compact = BaseGameTree("compact", embeddings, compact=True, dtype="int8")
+    for tree in (plain, compact):
+        tree.add_texts(texts[:5])
+    assert plain.edge_index().lookup is not None
+    assert compact.edge_index().lookup is None
+
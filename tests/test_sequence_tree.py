@@ -0,0 +1,30 @@
+import pytest
+
+from lifelike.StateManager.base_game_tree import EdgeEmbedding
+from lifelike.StateManager.sequence_tree import SequenceEvent, SequenceTree
+
+
+@pytest.fixture
+def tree(embeddings, texts) -> SequenceTree:
+    tree = SequenceTree("sequence", embeddings)
+    for i in range(4):
+        assert tree.add_node(SequenceEvent(f"e{i}", texts[i]))
+    for i in (1, 2, 3):
+        assert tree.add_edge("e0", f"e{i}", f"e{i}", EdgeEmbedding(f"e{i}", embeddings, embeddings.embed_query(texts[i]), 1))
+    assert tree.add_edge("e1", "e2", "e2", EdgeEmbedding("e2", embeddings, embeddings.embed_query(texts[2]), 1))
+    return tree
+
+
+def test_removing_an_edge_prunes_reachable(tree, texts):
+    assert tree.remove_edge(("e0", "e2"))
+    assert tree.node_dict["e0"].metadata["reachable"] == ["e1", "e3"]
+    documents = tree.get_retriever(local=True, node_id="e0", search_kwargs={"k": 3}).get_relevant_documents(texts[2])
+    assert "e2" not in [document.metadata["id"] for document in documents]
+
+
+def test_removing_a_node_prunes_it_from_every_reachable(tree):
+    assert tree.remove_node("e2")
+    assert tree.node_dict["e0"].metadata["reachable"] == ["e1", "e3"]
+    assert tree.node_dict["e1"].metadata["reachable"] == []
+    assert not tree.remove_node("e2")
+    assert tree.node_dict["e0"].metadata["reachable"] == ["e1", "e3"]
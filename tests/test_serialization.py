@@ -0,0 +1,79 @@
+import numpy
+import pytest
+
+from lifelike.StateManager.base_game_tree import BaseGameTree, EdgeEmbedding
+
+TOLERANCE = {"float32": 0, "float16": 1e-3, "int8": 1e-2}
+
+
+@pytest.fixture
+def tree(embeddings, texts) -> BaseGameTree:
+    """Tree with tuned edges, untuned copies of a template sharing an embedding and a final edge"""
+    tree = BaseGameTree("serialized", embeddings)
+    tree.add_texts(texts[:6], ids=[f"n{i}" for i in range(6)])
+    template = EdgeEmbedding("template", embeddings, embeddings.embed_query("harbor"), 1)
+    assert tree.add_embedding_template(template)
+    for end_id in ("n1", "n2", "n3"):
+        assert tree.add_edge("n0", end_id, end_id, template)
+    assert tree.tune_edge(("n0", "n1"), ["bridge", "lantern"])
+    tree.edge_dict[("n4", "n5")] = EdgeEmbedding("final", None, embeddings.embed_query("river"), 3)
+    return tree
+
+
+def save(tree: BaseGameTree, path: str, format: str, dtype: str) -> None:
+    if format == "json":
+        tree.to_json(path + ".json")
+    else:
+        tree.to_binary(path, dtype)
+
+
+def load(path: str, format: str, embeddings, compact: bool, dtype: str) -> BaseGameTree:
+    if format == "json":
+        return BaseGameTree.build_from_json(path + ".json", embeddings, compact=compact, dtype=dtype)
+    return BaseGameTree.build_from_binary(path, embeddings, compact=compact, dtype=dtype)
+
+
+@pytest.mark.parametrize("format", ["json", "binary"])
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_round_trip_keeps_ids_weights_and_embeddings(tree, embeddings, tmp_path, format, compact, dtype):
+    path = str(tmp_path / "tree")
+    save(tree, path, format, dtype)
+    loaded = load(path, format, embeddings, compact, dtype)
+
+    # json files are float32, the quantization only happens when loading into a quantized compact table
+    atol = TOLERANCE[dtype] if format == "binary" or compact else 0
+    assert loaded.name == tree.name
+    assert list(loaded.node_dict) == list(tree.node_dict)
+    assert [node.context for node in loaded.node_dict.values()] == [node.context for node in tree.node_dict.values()]
+    assert list(loaded.edge_dict) == list(tree.edge_dict)
+    for key in tree.edge_dict:
+        assert loaded.edge_dict[key].name == tree.edge_dict[key].name
+        assert loaded.edge_dict[key].weight == tree.edge_dict[key].weight
+        assert numpy.allclose(loaded.edge_dict[key].get_embedding(), tree.edge_dict[key].get_embedding(), rtol=0, atol=atol)
+    template = loaded.get_template("template")
+    assert template.weight == 1
+    assert numpy.allclose(template.get_embedding(), tree.get_template("template").get_embedding(), rtol=0, atol=TOLERANCE[dtype] if format == "binary" else 0)
+
+
+@pytest.mark.parametrize("format", ["json", "binary"])
+def test_round_trip_keeps_shared_embeddings_shared(tree, embeddings, tmp_path, format):
+    path = str(tmp_path / "tree")
+    save(tree, path, format, "float32")
+    loaded = load(path, format, embeddings, False, "float32")
+    assert numpy.shares_memory(loaded.edge_dict[("n0", "n2")].get_embedding(), loaded.edge_dict[("n0", "n3")].get_embedding())
+    assert not numpy.shares_memory(loaded.edge_dict[("n0", "n1")].get_embedding(), loaded.edge_dict[("n0", "n2")].get_embedding())
+
+    compact = load(path, format, embeddings, True, "float32").edge_dict
+    assert compact.row[compact.position(("n0", "n2"))] == compact.row[compact.position(("n0", "n3"))]
+
+
+@pytest.mark.parametrize("format", ["json", "binary"])
+def test_round_trip_without_embedding_function_is_final(tree, tmp_path, format):
+    path = str(tmp_path / "tree")
+    save(tree, path, format, "float32")
+    loaded = load(path, format, None, False, "float32")
+    assert loaded._final
+    assert all(edge._final for edge in loaded.edge_dict.values())
+    assert numpy.array_equal(loaded.edge_dict[("n4", "n5")].get_embedding(), tree.edge_dict[("n4", "n5")].get_embedding())
+    assert not loaded.tune_edge(("n0", "n2"), ["bridge"])
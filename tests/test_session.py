@@ -0,0 +1,54 @@
+import numpy
+import pytest
+
+from lifelike.StateManager.base_game_tree import BaseGameTree, GameNode
+from lifelike.StateManager.session import GameSession
+
+
+@pytest.fixture
+def tree(embeddings, texts) -> BaseGameTree:
+    tree = BaseGameTree("session-tree", embeddings)
+    tree.add_texts(texts[:10], ids=[f"n{i}" for i in range(10)])
+    return tree.freeze()
+
+
+def test_session_needs_a_frozen_tree(embeddings):
+    with pytest.raises(Exception):
+        GameSession(BaseGameTree("unfrozen", embeddings))
+
+
+def test_tuning_stays_in_the_session(tree):
+    base = tree.edge_dict[('_', 'n0')].get_embedding().copy()
+    player = tree.new_session("player")
+    other = tree.new_session("other")
+    assert player.tune_edge(('_', 'n0'), ["harbor lantern"])
+
+    assert numpy.array_equal(tree.edge_dict[('_', 'n0')].get_embedding(), base)
+    assert other.get_edge(('_', 'n0')) is tree.edge_dict[('_', 'n0')]
+    assert not numpy.array_equal(player.get_edge(('_', 'n0')).get_embedding(), base)
+    assert player.get_edge(('_', 'n0')).weight == tree.edge_dict[('_', 'n0')].weight + 1
+
+    assert player.reset_edge(('_', 'n0'))
+    assert player.get_edge(('_', 'n0')) is tree.edge_dict[('_', 'n0')]
+
+
+def test_session_search_merges_its_edges_with_the_tree(tree, embeddings, texts):
+    session = tree.new_session("player", "n0")
+    assert session.add_node(GameNode("extra", texts[20], {}))
+    assert session.add_edge("n0", "extra", "extra", tree.edge_dict[('_', 'n1')])
+    assert session.tune_edge(("n0", "extra"), [texts[20]] * 50)
+
+    documents = session.get_retriever(k=1).get_relevant_documents(texts[20])
+    assert documents[0].metadata["id"] == "extra"
+    assert "extra" not in tree.node_dict
+
+
+def test_session_round_trips_through_json(tree, tmp_path):
+    session = tree.new_session("player", "n3")
+    session.tune_edge(('_', 'n1'), ["bridge"])
+    path = str(tmp_path / "session.json")
+    session.to_json(path)
+
+    loaded = GameSession.build_from_json(tree, path)
+    assert (loaded.session_id, loaded.node_id) == ("player", "n3")
+    assert numpy.array_equal(loaded.get_edge(('_', 'n1')).get_embedding(), session.get_edge(('_', 'n1')).get_embedding())